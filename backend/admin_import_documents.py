@@ -5,28 +5,111 @@
 import os
 import sys
 import uuid
+import argparse
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Optional
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app import app
-from database import db, Document
+from database import db, Document, IngestJob
 from config import Config
 from services.document_processor import document_processor
-from services.vector_store import vector_store
+from services.vector_store import vector_store, BatchWriteError
+from services.text_cache import text_cache
 
 
-def import_document(file_path: str, user_id: int = 1) -> bool:
+def _process_file(file_path: str) -> List[Dict]:
     """
-    导入单个文档到知识库
+    在工作进程中提取文本并分块（不触碰数据库和向量库）
+    
+    Args:
+        file_path: 文档的完整路径
+        
+    Returns:
+        List[Dict]: process_document 产生的分块列表
+    """
+    return document_processor.process_document(
+        file_path=file_path,
+        filename=os.path.basename(file_path),
+        chunk_size=Config.CHUNK_SIZE,
+        overlap=Config.CHUNK_OVERLAP,
+        unit=Config.CHUNK_UNIT
+    )
+
+
+def find_existing_document(content_hash: str, source_path: str, user_id: int = 1):
+    """
+    查找与待导入文件对应的已有文档记录
+    
+    Args:
+        content_hash: 文件内容 SHA-256
+        source_path: 相对于导入目录的路径（单文件导入为文件名）
+        user_id: 导入用户ID
+        
+    Returns:
+        tuple: (Document 或 None, 是否内容未变化且已处理完成)
+    """
+    unchanged = Document.query.filter_by(content_hash=content_hash, processed=True).first()
+    if unchanged:
+        return unchanged, True
+    
+    previous = Document.query.filter_by(uploaded_by=user_id, source_path=source_path, processed=True)\
+        .order_by(Document.id.desc()).first()
+    if previous is None:
+        # 记录来源路径之前导入的文档只能按文件名对应
+        previous = Document.query.filter_by(
+            filename=os.path.basename(source_path), source_path=None, processed=True
+        ).order_by(Document.id.desc()).first()
+    return previous, False
+
+
+def find_partial_documents(content_hash: str, source_path: str, user_id: int = 1):
+    """
+    查找同一来源路径下未导入完成的记录（上次导入中途失败，已写入的分块仍保留）
+    
+    Returns:
+        tuple: (内容相同、可以续传的记录 或 None, 其余未完成的记录列表)
+    """
+    partials = Document.query.filter_by(uploaded_by=user_id, source_path=source_path, processed=False)\
+        .order_by(Document.id.desc()).all()
+    resume = next(
+        (doc for doc in partials
+         if doc.content_hash == content_hash and doc.file_path and os.path.exists(doc.file_path)),
+        None
+    )
+    return resume, [doc for doc in partials if doc is not resume]
+
+
+def _remove_document(doc: Document) -> Optional[str]:
+    """删除文档的分块、导入任务和数据库记录（由调用方提交），返回提交后应删除的文件路径"""
+    vector_store.delete_by_document_id(str(doc.id))
+    IngestJob.query.filter_by(document_id=doc.id).delete()
+    db.session.delete(doc)
+    return doc.file_path
+
+
+def import_document(file_path: str, user_id: int = 1,
+                    chunks: Optional[List[Dict]] = None,
+                    content_hash: Optional[str] = None,
+                    source_path: Optional[str] = None) -> bool:
+    """
+    导入单个文档到知识库（内容未变化的文档直接跳过）
+    
+    内容变化的文档先以新记录写入新分块，全部成功后才删除旧记录、旧分块和旧文件；
+    中途失败时旧版本保持不变，新记录和已写入的分块保留（chunks_written 为续传起点），
+    再次导入同一文件时从该处续传。再次导入时内容已经不同的未完成记录会被清理。
     
     Args:
         file_path: 文档的完整路径
         user_id: 上传用户ID（默认1，可改为管理员ID）
+        chunks: 已在工作进程中生成的分块；为 None 时在当前进程处理
+        content_hash: 已计算好的文件内容哈希；为 None 时在此计算
+        source_path: 相对于导入目录的路径，用于对应已有文档；默认为文件名
         
     Returns:
-        bool: 导入成功返回 True
+        bool: 导入成功（或内容未变化被跳过）返回 True
     """
     if not os.path.exists(file_path):
         print(f"❌ 文件不存在: {file_path}")
@@ -34,6 +117,7 @@ def import_document(file_path: str, user_id: int = 1) -> bool:
     
     filename = os.path.basename(file_path)
     file_ext = os.path.splitext(filename)[1].lower()
+    source_path = source_path or filename
     
     # 检查文件类型
     if file_ext.lstrip('.') not in Config.ALLOWED_EXTENSIONS:
@@ -41,43 +125,81 @@ def import_document(file_path: str, user_id: int = 1) -> bool:
         print(f"   支持的类型: {', '.join(Config.ALLOWED_EXTENSIONS)}")
         return False
     
-    try:
-        # 复制文件到 storage/uploads
-        dest_filename = f"{uuid.uuid4()}_{filename}"
-        dest_path = os.path.join(Config.UPLOAD_FOLDER, dest_filename)
-        
-        import shutil
-        shutil.copy2(file_path, dest_path)
-        print(f"✓ 文件已复制到: {dest_path}")
-        
-        file_size = os.path.getsize(dest_path)
-        file_type = file_ext.lstrip('.')
-        
-        # 创建文档记录
-        doc = Document(
-            filename=filename,
-            file_path=dest_path,
-            file_type=file_type,
-            file_size=file_size,
-            uploaded_by=user_id,
-            uploaded_at=datetime.utcnow()
-        )
-        db.session.add(doc)
+    if content_hash is None:
+        content_hash = document_processor.compute_hash(file_path)
+    
+    previous, unchanged = find_existing_document(content_hash, source_path, user_id)
+    if unchanged:
+        if previous.source_path is None:
+            previous.source_path = source_path
+            db.session.commit()
+        print(f"⏭  内容未变化，跳过 (ID: {previous.id})")
+        return True
+    
+    doc, stale = find_partial_documents(content_hash, source_path, user_id)
+    if stale:
+        # 重新导入：内容已变化的未完成记录不再续传，清理其已写入的分块、记录和文件
+        stale_paths = [_remove_document(partial) for partial in stale]
         db.session.commit()
-        print(f"✓ 数据库记录已创建 (ID: {doc.id})")
-        
-        # 处理文档：提取文本并分块
-        print(f"⏳ 正在处理文档...")
-        chunks = document_processor.process_document(
-            file_path=dest_path,
-            filename=filename,
-            chunk_size=Config.CHUNK_SIZE,
-            overlap=Config.CHUNK_OVERLAP
-        )
+        for path in stale_paths:
+            if path and os.path.exists(path):
+                os.remove(path)
+        print(f"✓ 已清理 {len(stale)} 个内容不同的未完成导入")
+    
+    created = False
+    dest_path = None
+    try:
+        if doc is None:
+            # 复制文件到 storage/uploads
+            dest_filename = f"{uuid.uuid4()}_{filename}"
+            dest_path = os.path.join(Config.UPLOAD_FOLDER, dest_filename)
+            
+            import shutil
+            shutil.copy2(file_path, dest_path)
+            print(f"✓ 文件已复制到: {dest_path}")
+            
+            # 创建文档记录（内容变化时也先新建，旧记录在新分块写入成功后再删除）
+            doc = Document(
+                filename=filename,
+                file_path=dest_path,
+                file_type=file_ext.lstrip('.'),
+                file_size=os.path.getsize(dest_path),
+                content_hash=content_hash,
+                source_path=source_path,
+                uploaded_by=user_id,
+                uploaded_at=datetime.utcnow()
+            )
+            db.session.add(doc)
+            db.session.commit()
+            created = True
+            print(f"✓ 数据库记录已创建 (ID: {doc.id})")
+        else:
+            print(f"↻ 续传未完成的导入 (ID: {doc.id}, 已写入 {doc.chunks_written or 0} 个分块)")
+        
+        # 处理文档：提取文本并分块（并行模式下已由工作进程完成）
+        if chunks is None:
+            print(f"⏳ 正在处理文档...")
+            chunks = document_processor.process_document(
+                file_path=doc.file_path,
+                filename=filename,
+                chunk_size=Config.CHUNK_SIZE,
+                overlap=Config.CHUNK_OVERLAP,
+                unit=Config.CHUNK_UNIT
+            )
         print(f"✓ 文档已分块，共 {len(chunks)} 个片段")
         
+        # 续传：分块数与上次一致时跳过已连续写入的分块；否则先清理上次写入的分块，从头写入
+        start = doc.chunks_written or 0
+        if start and doc.chunks_count != len(chunks):
+            start = 0
+        if not start and not created:
+            vector_store.delete_by_document_id(str(doc.id))
+        doc.chunks_count = len(chunks)
+        doc.chunks_written = start
+        db.session.commit()
+        
         # 添加到向量库
-        print(f"⏳ 正在写入向量库...")
+        print(f"⏳ 正在写入向量库..." + (f"（从第 {start + 1} 个分块续传）" if start else ""))
         texts = [chunk['text'] for chunk in chunks]
         metadatas = [
             {**chunk['metadata'], 'document_id': str(doc.id)}
@@ -85,14 +207,31 @@ def import_document(file_path: str, user_id: int = 1) -> bool:
         ]
         ids = [f"doc_{doc.id}_chunk_{i}" for i in range(len(chunks))]
         
-        vector_store.add_documents(texts, metadatas, ids)
+        if start < len(chunks) or not chunks:  # 没有分块时由 add_documents 报错
+            try:
+                vector_store.add_documents(
+                    texts[start:], metadatas[start:], ids[start:],
+                    progress_callback=lambda done, total: print(f"   已写入 {start + done}/{len(chunks)}")
+                )
+            except BatchWriteError as e:
+                doc.chunks_written = start + e.report['resume_offset']
+                db.session.commit()
+                raise
         print(f"✓ 向量已写入 ChromaDB")
         
-        # 更新文档状态
+        # 更新文档状态；内容变化时用新记录替换旧记录
         doc.processed = True
-        doc.chunks_count = len(chunks)
+        doc.chunks_written = len(chunks)
+        if previous is not None:
+            previous_id = previous.id
+            old_path = _remove_document(previous)
         db.session.commit()
         
+        if previous is not None:
+            if old_path and os.path.exists(old_path):
+                os.remove(old_path)
+            print(f"✓ 内容已变化，已替换旧版本 (原 ID: {previous_id})")
+        
         print(f"✅ 导入成功: {filename}")
         print(f"   文档ID: {doc.id}, 分块数: {len(chunks)}")
         return True
@@ -100,18 +239,36 @@ def import_document(file_path: str, user_id: int = 1) -> bool:
     except Exception as e:
         db.session.rollback()
         print(f"❌ 导入失败: {str(e)}")
-        # 清理已创建的文件
-        if os.path.exists(dest_path):
-            os.remove(dest_path)
+        if dest_path and not created:
+            # 记录尚未创建：删除已复制的文件
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+        else:
+            # 已写入的分块和新记录保留，旧版本保持不变；再次导入同一文件时续传
+            print(f"   已写入 {doc.chunks_written or 0}/{doc.chunks_count or 0} 个分块，"
+                  f"重新运行导入将从此处续传")
         return False
 
 
-def import_directory(directory: str) -> dict:
+def _collect_files(directory: str) -> List[str]:
+    """收集目录下所有支持类型的文档路径"""
+    file_paths = []
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            file_ext = os.path.splitext(filename)[1].lower()
+            if file_ext.lstrip('.') in Config.ALLOWED_EXTENSIONS:
+                file_paths.append(os.path.join(root, filename))
+    return file_paths
+
+
+def import_directory(directory: str, workers: int = 1) -> dict:
     """
     批量导入目录下的所有文档
     
     Args:
         directory: 文档目录路径
+        workers: 提取/分块使用的进程数；大于 1 时并行处理，
+                 数据库记录和向量写入仍由当前进程串行完成
         
     Returns:
         dict: 导入统计信息
@@ -120,20 +277,61 @@ def import_directory(directory: str) -> dict:
         print(f"❌ 目录不存在: {directory}")
         return {'success': 0, 'failed': 0}
     
-    stats = {'success': 0, 'failed': 0, 'total': 0}
+    stats = {'success': 0, 'failed': 0, 'skipped': 0, 'total': 0}
     
     print(f"\n📂 扫描目录: {directory}")
     print("=" * 60)
     
-    for root, dirs, files in os.walk(directory):
-        for filename in files:
-            file_ext = os.path.splitext(filename)[1].lower()
-            if file_ext.lstrip('.') in Config.ALLOWED_EXTENSIONS:
-                file_path = os.path.join(root, filename)
+    # 先按内容哈希筛掉未变化的文档和本次目录内内容重复的文件，避免无谓的提取和向量化
+    pending = []
+    seen = {}  # 内容哈希 -> 本次先出现的相对路径
+    for file_path in _collect_files(directory):
+        source_path = os.path.relpath(file_path, directory).replace(os.sep, '/')
+        content_hash = document_processor.compute_hash(file_path)
+        if content_hash in seen:
+            stats['total'] += 1
+            stats['skipped'] += 1
+            print(f"\n[{stats['total']}] 跳过（与 {seen[content_hash]} 内容相同）: {source_path}")
+            continue
+        seen[content_hash] = source_path
+        
+        doc, unchanged = find_existing_document(content_hash, source_path)
+        if unchanged:
+            stats['total'] += 1
+            stats['skipped'] += 1
+            print(f"\n[{stats['total']}] 跳过（内容未变化）: {source_path}")
+        else:
+            pending.append((file_path, content_hash, source_path))
+    
+    if workers <= 1:
+        for file_path, content_hash, source_path in pending:
+            stats['total'] += 1
+            print(f"\n[{stats['total']}] 导入: {source_path}")
+            if import_document(file_path, content_hash=content_hash, source_path=source_path):
+                stats['success'] += 1
+            else:
+                stats['failed'] += 1
+    elif pending:
+        print(f"⚙️  并行模式: {workers} 个工作进程")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_process_file, file_path): (file_path, content_hash, source_path)
+                for file_path, content_hash, source_path in pending
+            }
+            # 按完成顺序写入，写入端始终只有当前进程
+            for future in as_completed(futures):
+                file_path, content_hash, source_path = futures[future]
                 stats['total'] += 1
+                print(f"\n[{stats['total']}] 导入: {source_path}")
+                try:
+                    chunks = future.result()
+                except Exception as e:
+                    print(f"❌ 导入失败: {str(e)}")
+                    stats['failed'] += 1
+                    continue
                 
-                print(f"\n[{stats['total']}] 导入: {filename}")
-                if import_document(file_path):
+                if import_document(file_path, chunks=chunks, content_hash=content_hash,
+                                   source_path=source_path):
                     stats['success'] += 1
                 else:
                     stats['failed'] += 1
@@ -142,38 +340,217 @@ def import_directory(directory: str) -> dict:
     print(f"📊 导入统计:")
     print(f"   总文档数: {stats['total']}")
     print(f"   成功: {stats['success']}")
+    print(f"   跳过: {stats['skipped']}")
     print(f"   失败: {stats['failed']}")
     return stats
 
 
+def rechunk_all() -> dict:
+    """
+    按当前分块配置重建所有已处理文档的分块
+    
+    与 --rebuild 相同：新分块写入新版本索引，核对通过后才切换，
+    任何文档失败时线上索引保持不变。
+    
+    Returns:
+        dict: rebuild_index 的统计信息
+    """
+    return rebuild_index()
+
+
+# 重建期间其他进程导入或删除的文档在后续轮次补齐，最多补齐的轮数
+REBUILD_MAX_ROUNDS = 5
+
+
+def _build_chunks(doc: Document) -> Optional[List[Dict]]:
+    """
+    按当前分块配置生成文档分块：优先读取提取文本缓存，缺失时重新解析已保存的原文件
+    
+    Returns:
+        List[Dict] 或 None（缓存与原文件都不可用）
+    """
+    options = dict(
+        filename=doc.filename,
+        chunk_size=Config.CHUNK_SIZE,
+        overlap=Config.CHUNK_OVERLAP,
+        unit=Config.CHUNK_UNIT
+    )
+    if text_cache.has(doc.content_hash):
+        return document_processor.process_cached(content_hash=doc.content_hash, **options)
+    if doc.file_path and os.path.exists(doc.file_path):
+        return document_processor.process_document(file_path=doc.file_path, **options)
+    return None
+
+
+def rebuild_index() -> dict:
+    """
+    蓝绿重建：把所有已处理文档按当前分块配置和嵌入模型写入新版本索引，
+    线上查询在此期间继续使用当前版本；逐文档核对分块数后原子切换，
+    原版本保留用于 --rollback
+    
+    Returns:
+        dict: 统计信息（'swapped' 表示是否已切换）
+    """
+    stats = {'total': 0, 'chunks': 0, 'failed': 0, 'rounds': 0, 'swapped': False}
+    staging = vector_store.create_staging()
+    
+    print(f"\n🔁 蓝绿重建: 版本 {vector_store.index_version} -> {staging.index_version} "
+          f"(unit={Config.CHUNK_UNIT}, size={Config.CHUNK_SIZE}, overlap={Config.CHUNK_OVERLAP})")
+    print("=" * 60)
+    
+    built = {}  # 文档ID -> (内容哈希, 写入的分块数)
+    converged = False
+    for _ in range(REBUILD_MAX_ROUNDS):
+        db.session.expire_all()
+        documents = Document.query.filter_by(processed=True).order_by(Document.id).all()
+        current = {doc.id for doc in documents}
+        pending = [doc for doc in documents if built.get(doc.id, (None,))[0] != doc.content_hash]
+        removed = [doc_id for doc_id in built if doc_id not in current]
+        if not pending and not removed:
+            converged = True
+            break
+        
+        stats['rounds'] += 1
+        if stats['rounds'] > 1:
+            print(f"\n↻ 第 {stats['rounds']} 轮：补齐重建期间变化的 "
+                  f"{len(pending)} 个文档，移除 {len(removed)} 个已删除文档")
+        
+        for doc_id in removed:
+            staging.delete_by_document_id(str(doc_id))
+            del built[doc_id]
+        
+        for doc in pending:
+            stats['total'] += 1
+            print(f"\n[{stats['total']}] 重建: {doc.filename} (ID: {doc.id})")
+            try:
+                chunks = _build_chunks(doc)
+                if chunks is None:
+                    raise FileNotFoundError("提取文本缓存与原文件均不可用")
+                
+                if doc.id in built:
+                    staging.delete_by_document_id(str(doc.id))
+                added = 0
+                if chunks:
+                    report = staging.add_documents(
+                        [chunk['text'] for chunk in chunks],
+                        [{**chunk['metadata'], 'document_id': str(doc.id)} for chunk in chunks],
+                        [f"doc_{doc.id}_chunk_{i}" for i in range(len(chunks))]
+                    )
+                    added = report['added']
+                built[doc.id] = (doc.content_hash, added)
+                print(f"✅ 分块数: {added}")
+            except Exception as e:
+                print(f"❌ 重建失败: {str(e)}")
+                stats['failed'] += 1
+        
+        if stats['failed']:
+            break
+    
+    print("\n" + "=" * 60)
+    if stats['failed'] or not converged:
+        reason = f"{stats['failed']} 个文档失败" if stats['failed'] else "文档持续变化，未能收敛"
+        print(f"❌ 重建中止（{reason}），继续使用版本 {vector_store.index_version}")
+        vector_store.drop_version(staging.index_version)
+        return stats
+    
+    # 切换前核对：新索引中每个文档的分块数与写入时一致，且不含 Document 表以外的文档
+    counts = staging.chunk_counts()
+    expected = {str(doc_id): added for doc_id, (_, added) in built.items() if added}
+    if counts != expected:
+        mismatched = sorted(set(counts.items()) ^ set(expected.items()))
+        print(f"❌ 分块数核对失败: {mismatched[:10]}，继续使用版本 {vector_store.index_version}")
+        vector_store.drop_version(staging.index_version)
+        stats['failed'] += 1
+        return stats
+    stats['chunks'] = sum(counts.values())
+    
+    state = vector_store.activate_version(staging.index_version)
+    stats['swapped'] = True
+    for doc_id, (_, added) in built.items():
+        Document.query.filter_by(id=doc_id).update({'chunks_count': added})
+    # 未完成的导入没有写入新版本，续传需从头开始
+    Document.query.filter_by(processed=False).update({'chunks_written': 0})
+    db.session.commit()
+    
+    print(f"📊 重建完成: {len(built)} 个文档, {stats['chunks']} 个分块")
+    print(f"   生效版本: {state['active']}，可回滚到版本: {state['previous']}")
+    return stats
+
+
+def rollback_index() -> bool:
+    """切回上一索引版本，并按该版本的实际分块数更新 Document 表"""
+    try:
+        state = vector_store.rollback()
+    except ValueError as e:
+        print(f"❌ {str(e)}")
+        return False
+    
+    counts = vector_store.chunk_counts()
+    for doc in Document.query.filter_by(processed=True).all():
+        doc.chunks_count = counts.get(str(doc.id), 0)
+    Document.query.filter_by(processed=False).update({'chunks_written': 0})
+    db.session.commit()
+    print(f"✅ 已回滚到索引版本 {state['active']}（版本 {state['previous']} 保留）")
+    return True
+
+
 def main():
     """主函数"""
     print("=" * 60)
     print("HKU 智能助手 - 知识库文档导入工具")
     print("=" * 60)
     
-    if len(sys.argv) < 2:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('target', nargs='?')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--rechunk', action='store_true')
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--rollback', action='store_true')
+    args = parser.parse_args()
+    
+    if not args.target and not (args.rechunk or args.rebuild or args.rollback):
         print("\n用法:")
         print("  导入单个文件:")
         print("    python admin_import_documents.py /path/to/document.pdf")
         print("\n  批量导入目录:")
         print("    python admin_import_documents.py /path/to/documents/")
+        print("\n  并行批量导入（N 个进程提取/分块）:")
+        print("    python admin_import_documents.py /path/to/documents/ --workers N")
+        print("\n  按当前分块配置重建全部分块（同 --rebuild）:")
+        print("    python admin_import_documents.py --rechunk")
+        print("\n  蓝绿重建（写入新版本索引，核对后原子切换，线上查询不受影响）:")
+        print("    python admin_import_documents.py --rebuild")
+        print("\n  回滚到上一索引版本:")
+        print("    python admin_import_documents.py --rollback")
         print("\n支持的文件类型:", ", ".join(Config.ALLOWED_EXTENSIONS))
         sys.exit(1)
     
-    target = sys.argv[1]
+    target = args.target
+    
+    # 延迟导入 Flask 应用：工作进程只需要 document_processor，
+    # 不应在子进程中重复初始化应用和 ChromaDB；脚本不需要服务端的后台预热
+    Config.WARMUP_ON_START = False
+    from app import app
     
     # 确保向量库已初始化
-    vector_store.initialize()
+    vector_store.ensure_initialized()
     
     with app.app_context():
-        if os.path.isfile(target):
+        if args.rollback:
+            sys.exit(0 if rollback_index() else 1)
+        elif args.rebuild or args.rechunk:
+            # 降低重建进程的调度优先级，向量计算让出 CPU 给线上查询
+            if hasattr(os, 'nice'):
+                os.nice(10)
+            stats = rechunk_all() if args.rechunk else rebuild_index()
+            sys.exit(0 if stats['swapped'] else 1)
+        elif os.path.isfile(target):
             # 导入单个文件
             success = import_document(target)
             sys.exit(0 if success else 1)
         elif os.path.isdir(target):
             # 批量导入目录
-            stats = import_directory(target)
+            stats = import_directory(target, workers=args.workers)
             sys.exit(0 if stats['failed'] == 0 else 1)
         else:
             print(f"❌ 路径不存在: {target}")
@@ -182,4 +559,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
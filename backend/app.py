@@ -11,6 +11,9 @@ import os
 from config import Config
 from database import db, init_db
 from routes import auth_bp, knowledge_bp, email_bp, chat_bp
+from services.ingest_queue import ingest_queue
+from services.answer_cache import answer_cache
+from services.warmup import warmup
 
 # Create Flask app
 app = Flask(__name__)
@@ -39,11 +42,25 @@ CORS(app, resources={r"/api/*": {
 # Initialize database
 init_db(app)
 
+# Background ingestion queue (worker threads start on the first request,
+# so importing the app from admin scripts does not spawn them)
+ingest_queue.init_app(app)
+
+# Semantic answer cache, seeded from query history once warmup has finished
+answer_cache.init_app(app)
+
+# Open the vector store and load the embedding model in the background so that
+# process start stays fast; /api/health/ready reports when it is done
+if Config.WARMUP_ON_START:
+    warmup.start()
+
 
 # Request hook - add request ID
 @app.before_request
 def before_request():
     request.request_id = request.headers.get('X-Request-ID', str(uuid.uuid4()))
+    ingest_queue.start()
+    warmup.start()
 
 
 # Response hook - append request ID header
@@ -78,19 +95,38 @@ app.register_blueprint(chat_bp, url_prefix='/api/chat')
 
 # Health check
 @app.route('/api/health', methods=['GET'])
+@app.route('/api/health/live', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Liveness: the process is up and serving requests (does not wait for warmup)"""
     return jsonify({
         'code': 0,
         'message': 'Service healthy',
         'data': {
             'status': 'healthy',
             'timestamp': datetime.now().isoformat(),
-            'version': '1.0.0'
+            'version': '1.0.0',
+            'warmup': warmup.state
         }
     })
 
 
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: vector store opened and embedding model loaded; 503 until warmup completes"""
+    status = warmup.status()
+    if not warmup.ready:
+        return jsonify({
+            'code': 503,
+            'message': 'Warming up',
+            'data': status
+        }), 503
+    return jsonify({
+        'code': 0,
+        'message': 'Ready',
+        'data': status
+    })
+
+
 # Root endpoint
 @app.route('/')
 def index():
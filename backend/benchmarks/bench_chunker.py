@@ -0,0 +1,124 @@
+"""
+分块器微基准 - 在 knowledge_base/ 语料上对比旧的 rfind 分块与 TextChunker
+
+用法（在 backend 目录执行）:
+    python benchmarks/bench_chunker.py [语料目录] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from config import Config
+from services.document_processor import document_processor
+from services.text_chunker import TextChunker
+from services.tokenizer import count_tokens, is_exact
+
+
+def legacy_chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200):
+    """旧版 chunk_text：每个窗口对 8 个分隔符逐一 rfind（加了前进保护以免死循环）"""
+    if len(text) <= chunk_size:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        if end < len(text):
+            for sep in ['\n\n', '。', '！', '？', '.', '!', '?', '\n']:
+                last_sep = text.rfind(sep, start, end)
+                if last_sep != -1:
+                    end = last_sep + 1
+                    break
+
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+
+        next_start = end - overlap if end < len(text) else end
+        start = next_start if next_start > start else end
+    return chunks
+
+
+def load_corpus(directory: str):
+    """提取语料目录下所有文档的文本"""
+    corpus = []
+    for root, dirs, files in os.walk(directory):
+        for filename in sorted(files):
+            ext = os.path.splitext(filename)[1].lower().lstrip('.')
+            if ext not in Config.ALLOWED_EXTENSIONS:
+                continue
+            try:
+                text = document_processor.extract_text(os.path.join(root, filename))
+            except Exception as e:
+                print(f"跳过 {filename}: {str(e)}")
+                continue
+            corpus.append((filename, text))
+    return corpus
+
+
+def time_it(func, text, repeat):
+    """返回 (最短耗时秒数, 分块结果)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分块器微基准')
+    parser.add_argument('directory', nargs='?',
+                        default=os.path.join(os.path.dirname(__file__), '..', 'knowledge_base'))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.directory)
+    if not corpus:
+        print("语料为空")
+        sys.exit(1)
+
+    # 额外加入一个分隔符稀少的长文本，暴露旧实现的重复扫描
+    corpus.append(('synthetic-few-separators', ('word ' * 4000 + '. ') * 50))
+
+    chunkers = [
+        ('legacy-char', lambda text: legacy_chunk_text(text, 1000, 200)),
+        ('engine-char', TextChunker(1000, 200, 'char').split),
+        ('engine-token', TextChunker(300, 50, 'token').split),
+    ]
+
+    print(f"token 计数: {'tiktoken' if is_exact() else '字符估算'}")
+    print(f"{'document':<48}{'chars':>10}  " + "".join(f"{name:>22}" for name, _ in chunkers))
+
+    totals = {name: 0.0 for name, _ in chunkers}
+    total_chars = 0
+    for filename, text in corpus:
+        total_chars += len(text)
+        cells = []
+        for name, func in chunkers:
+            elapsed, chunks = time_it(func, text, args.repeat)
+            totals[name] += elapsed
+            cells.append(f"{elapsed * 1000:>10.1f}ms/{len(chunks):>5}块")
+        print(f"{filename[:46]:<48}{len(text):>10}  " + "".join(f"{cell:>22}" for cell in cells))
+
+    print("-" * (60 + 22 * len(chunkers)))
+    for name, _ in chunkers:
+        mb_per_s = total_chars / 1e6 / totals[name] if totals[name] else float('inf')
+        print(f"{name:<16} 总耗时 {totals[name] * 1000:>9.1f}ms  吞吐 {mb_per_s:>7.2f} MB/s")
+
+    # 每块 token 数分布，确认 token 预算生效
+    token_chunks = TextChunker(300, 50, 'token').split(corpus[0][1])
+    if token_chunks:
+        sizes = sorted(count_tokens(chunk) for chunk in token_chunks)
+        print(f"\n{corpus[0][0]} token 模式每块 token 数: "
+              f"min={sizes[0]} p50={sizes[len(sizes) // 2]} max={sizes[-1]}")
+
+
+if __name__ == '__main__':
+    main()
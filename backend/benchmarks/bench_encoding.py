@@ -0,0 +1,97 @@
+"""
+TXT 编码检测吞吐基准 - 对比旧的逐编码重试读取与单次读取 + 统计检测
+
+生成混合编码语料（UTF-8 / GBK / Big5 / cp1252 / UTF-16），分别统计吞吐和检测正确率。
+
+用法（在 backend 目录执行）:
+    python benchmarks/bench_encoding.py [--size-mb 8] [--repeat 3]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from services.document_processor import DocumentProcessor
+
+SIMPLIFIED = "香港大学学生手册规定，所有学生必须在学期开始前完成课程注册。考试期间不得携带电子设备进入考场。\n"
+TRADITIONAL = "香港大學學生手冊規定，所有學生必須在學期開始前完成課程註冊。考試期間不得攜帶電子設備進入考場。\n"
+LATIN = "The café regulations — naïve résumé “quotes” apply to every undergraduate curriculum.\n"
+
+CORPUS = [
+    ('utf-8', SIMPLIFIED + LATIN),
+    ('gbk', SIMPLIFIED),
+    ('big5', TRADITIONAL),
+    ('cp1252', LATIN),
+    ('utf-16', TRADITIONAL + LATIN),
+]
+
+
+def legacy_read(file_path: str) -> str:
+    """旧版 _extract_from_txt：按编码列表逐个重新打开并完整解码"""
+    for encoding in ['utf-8', 'gbk', 'gb2312', 'gb18030', 'big5', 'latin-1', 'cp1252']:
+        try:
+            with open(file_path, 'r', encoding=encoding) as file:
+                return file.read()
+        except UnicodeDecodeError:
+            continue
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+        return file.read()
+
+
+def build_corpus(directory: str, size_mb: float):
+    """按目标大小重复样本文本，写出各编码的文件"""
+    files = []
+    for encoding, sample in CORPUS:
+        repeats = max(1, int(size_mb * 1024 * 1024 / len(sample.encode(encoding))))
+        text = "Header line\n" + sample * repeats
+        path = os.path.join(directory, f"{encoding}.txt")
+        with open(path, 'w', encoding=encoding, newline='') as file:
+            file.write(text)
+        files.append((encoding, path, text))
+    return files
+
+
+def best_time(func, path, repeat):
+    """返回 (最短耗时秒数, 结果)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TXT 编码检测吞吐基准')
+    parser.add_argument('--size-mb', type=float, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_encoding_')
+    try:
+        files = build_corpus(directory, args.size_mb)
+        print(f"{'encoding':<10}{'MB':>8}{'legacy MB/s':>14}{'ok':>5}"
+              f"{'new MB/s':>12}{'ok':>5}  detected")
+        for encoding, path, expected in files:
+            size = os.path.getsize(path) / 1e6
+            legacy_time, legacy_text = best_time(legacy_read, path, args.repeat)
+            new_time, (new_text, detected, confidence) = best_time(
+                DocumentProcessor._read_txt, path, args.repeat
+            )
+            print(f"{encoding:<10}{size:>8.1f}"
+                  f"{size / legacy_time:>14.1f}{'Y' if legacy_text == expected else 'N':>5}"
+                  f"{size / new_time:>12.1f}{'Y' if new_text == expected else 'N':>5}"
+                  f"  {detected} ({confidence})")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
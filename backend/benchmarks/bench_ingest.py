@@ -0,0 +1,276 @@
+"""
+导入流水线基准 - 分阶段统计提取 / 分块 / 嵌入 / 写入的耗时和峰值内存
+
+语料可以用 synthetic_corpus 现场生成，也可以指定已有目录；结果写成 JSON，
+之后用 compare 子命令对比两次运行，找出变慢的阶段。
+
+用法（在 backend 目录执行）:
+    python benchmarks/bench_ingest.py run --sizes 10000,100000 --cjk-ratios 0,0.5,1 --output before.json
+    python benchmarks/bench_ingest.py run --corpus ../knowledge_base --output after.json
+    python benchmarks/bench_ingest.py compare before.json after.json [--threshold 0.1]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from config import Config
+
+STAGES = ('extract', 'chunk', 'embed', 'persist')
+
+
+class StageTimer:
+    """记录单个阶段的耗时和 Python 堆峰值（tracemalloc 开启时）"""
+
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.result = {}
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.result['seconds'] = round(time.perf_counter() - self.start, 6)
+        if self.trace_memory:
+            self.result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        return False
+
+
+def collect_corpus(args, workdir):
+    """返回待测文件列表 [{'path', 'format', 'chars', 'cjk_ratio'}]"""
+    if args.corpus:
+        files = []
+        for root, _, names in os.walk(args.corpus):
+            for name in sorted(names):
+                ext = os.path.splitext(name)[1].lower().lstrip('.')
+                if ext in ('pdf', 'docx', 'txt'):
+                    files.append({'path': os.path.join(root, name), 'format': ext,
+                                  'chars': None, 'cjk_ratio': None})
+        return files
+
+    from synthetic_corpus import generate_corpus, parse_list
+    return generate_corpus(
+        os.path.join(workdir, 'corpus'),
+        parse_list(args.sizes, int),
+        parse_list(args.cjk_ratios, float),
+        parse_list(args.formats, str),
+        args.seed
+    )
+
+
+def bench_file(item, index, embedding_function, client, args):
+    """对单个文件依次执行四个阶段"""
+    from services.document_processor import DocumentProcessor
+    from services.text_chunker import TextChunker
+
+    path = item['path']
+    record = {
+        'file': os.path.basename(path),
+        'format': item['format'],
+        'bytes': os.path.getsize(path),
+        'target_chars': item['chars'],
+        'cjk_ratio': item['cjk_ratio'],
+        'stages': {}
+    }
+
+    info = {}
+    with StageTimer(args.trace_memory) as timer:
+        pieces = list(DocumentProcessor.iter_text(path, info))
+    record['stages']['extract'] = timer.result
+    record['chars'] = sum(len(piece) for piece in pieces)
+    record['pages'] = info.get('pages')
+
+    chunker = TextChunker(args.chunk_size, args.overlap, args.unit)
+    with StageTimer(args.trace_memory) as timer:
+        chunks = list(chunker.split_stream(pieces))
+    record['stages']['chunk'] = timer.result
+    record['chunks'] = len(chunks)
+    del pieces
+
+    batch_size = args.batch_size
+    with StageTimer(args.trace_memory) as timer:
+        embeddings = []
+        for start in range(0, len(chunks), batch_size):
+            vectors = embedding_function(chunks[start:start + batch_size])
+            embeddings.extend(v.tolist() if hasattr(v, 'tolist') else list(v) for v in vectors)
+    record['stages']['embed'] = timer.result
+
+    collection = client.get_or_create_collection(name=f"bench_{index}")
+    with StageTimer(args.trace_memory) as timer:
+        for start in range(0, len(chunks), batch_size):
+            end = min(start + batch_size, len(chunks))
+            collection.add(
+                embeddings=embeddings[start:end],
+                documents=chunks[start:end],
+                metadatas=[{'filename': record['file'], 'chunk_index': i} for i in range(start, end)],
+                ids=[f"bench_{index}_{i}" for i in range(start, end)]
+            )
+    record['stages']['persist'] = timer.result
+
+    record['total_seconds'] = round(sum(stage['seconds'] for stage in record['stages'].values()), 6)
+    return record
+
+
+def summarize(results):
+    """按阶段汇总总耗时、最大峰值内存和吞吐"""
+    summary = {}
+    total_chars = sum(r['chars'] for r in results) or 1
+    total_chunks = sum(r['chunks'] for r in results) or 1
+    for stage in STAGES:
+        seconds = sum(r['stages'][stage]['seconds'] for r in results)
+        peaks = [r['stages'][stage].get('peak_bytes') for r in results]
+        summary[stage] = {
+            'seconds': round(seconds, 6),
+            'peak_bytes': max((p for p in peaks if p is not None), default=None),
+            'chars_per_second': round(total_chars / seconds, 1) if seconds else None,
+            'chunks_per_second': round(total_chunks / seconds, 1) if seconds else None,
+        }
+    return summary
+
+
+def run(args):
+    import chromadb
+    from chromadb.utils import embedding_functions
+    from services.text_cache import text_cache
+
+    # 提取阶段必须真正解析文件
+    text_cache.enabled = False
+
+    workdir = tempfile.mkdtemp(prefix='bench_ingest_')
+    try:
+        files = collect_corpus(args, workdir)
+        if not files:
+            print("没有找到可测试的文件")
+            return 1
+
+        # 模型加载单独计时，不计入各文件的嵌入阶段
+        embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        start = time.perf_counter()
+        embedding_function(["warmup"])
+        warmup_seconds = time.perf_counter() - start
+
+        client = chromadb.PersistentClient(path=os.path.join(workdir, 'chroma'))
+
+        if args.trace_memory:
+            tracemalloc.start()
+
+        results = []
+        for index, item in enumerate(files):
+            record = bench_file(item, index, embedding_function, client, args)
+            results.append(record)
+            stages = '  '.join(f"{s} {record['stages'][s]['seconds']:.3f}s" for s in STAGES)
+            print(f"{record['file']:<36}{record['chars']:>10} chars {record['chunks']:>6} chunks  {stages}")
+
+        if args.trace_memory:
+            tracemalloc.stop()
+
+        report = {
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'chunk_size': args.chunk_size,
+                'overlap': args.overlap,
+                'unit': args.unit,
+                'batch_size': args.batch_size,
+                'trace_memory': args.trace_memory,
+                'model_warmup_seconds': round(warmup_seconds, 6),
+                # Linux 上 ru_maxrss 单位为 KB，包含嵌入模型等原生内存
+                'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            },
+            'results': results,
+            'summary': summarize(results),
+        }
+
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+        print(f"\n{'stage':<10}{'seconds':>10}{'peak MB':>10}{'chars/s':>14}")
+        for stage, values in report['summary'].items():
+            peak = values['peak_bytes']
+            print(f"{stage:<10}{values['seconds']:>10.3f}"
+                  f"{(peak / 1e6 if peak is not None else float('nan')):>10.1f}"
+                  f"{values['chars_per_second'] or 0:>14.0f}")
+        print(f"\nmax RSS: {report['meta']['max_rss_kb'] / 1024:.0f} MB, 结果已写入 {args.output}")
+        return 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(args):
+    """对比两次运行的各阶段汇总，超过阈值的变慢阶段返回非零退出码"""
+    with open(args.baseline, encoding='utf-8') as file:
+        baseline = json.load(file)
+    with open(args.current, encoding='utf-8') as file:
+        current = json.load(file)
+
+    for key in ('chunk_size', 'overlap', 'unit', 'batch_size', 'trace_memory'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print(f"警告: 两次运行的 {key} 不同 "
+                  f"({baseline['meta'].get(key)} vs {current['meta'].get(key)})")
+
+    regressions = []
+    print(f"{'stage':<10}{'baseline s':>12}{'current s':>12}{'change':>10}{'peak change':>14}")
+    for stage in STAGES:
+        old = baseline['summary'][stage]
+        new = current['summary'][stage]
+        change = (new['seconds'] - old['seconds']) / old['seconds'] if old['seconds'] else 0.0
+        if old.get('peak_bytes') and new.get('peak_bytes') is not None:
+            peak = f"{(new['peak_bytes'] - old['peak_bytes']) / old['peak_bytes']:+.1%}"
+        else:
+            peak = '-'
+        flag = ''
+        if change > args.threshold:
+            regressions.append(stage)
+            flag = '  <-- 变慢'
+        print(f"{stage:<10}{old['seconds']:>12.3f}{new['seconds']:>12.3f}{change:>+10.1%}{peak:>14}{flag}")
+
+    if regressions:
+        print(f"\n超过阈值 {args.threshold:.0%} 的阶段: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导入流水线分阶段基准')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='运行基准并写出 JSON 结果')
+    run_parser.add_argument('--corpus', help='使用已有目录，而不是生成合成语料')
+    run_parser.add_argument('--sizes', default='10000,100000,1000000', help='合成文档的目标字符数')
+    run_parser.add_argument('--cjk-ratios', default='0,0.5,1', help='中文段落比例')
+    run_parser.add_argument('--formats', default='pdf,docx,txt')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--chunk-size', type=int, default=Config.CHUNK_SIZE)
+    run_parser.add_argument('--overlap', type=int, default=Config.CHUNK_OVERLAP)
+    run_parser.add_argument('--unit', default=Config.CHUNK_UNIT, choices=['token', 'char'])
+    run_parser.add_argument('--batch-size', type=int, default=Config.VECTOR_BATCH_SIZE)
+    run_parser.add_argument('--no-tracemalloc', dest='trace_memory', action='store_false',
+                            help='关闭 Python 堆追踪（耗时更准确，但不记录各阶段峰值）')
+    run_parser.add_argument('--output', default='bench_ingest.json')
+
+    compare_parser = subparsers.add_parser('compare', help='对比两次运行结果')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='耗时增幅超过该比例视为回归')
+
+    args = parser.parse_args()
+    sys.exit(run(args) if args.command == 'run' else compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+int8 量化检索基准 - 对比 NumpyBackend 的 float32 精确检索与量化候选 + float 重排
+
+用带簇结构的合成单位向量（近似句向量的分布）建库，报告 recall@k（以 float 精确结果为基准）、
+查询延迟和常驻矩阵大小。
+
+用法（在 backend 目录执行）:
+    python benchmarks/bench_quantization.py [--rows 50000] [--dim 384] [--queries 200] [--rescore 50,100,200,400]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from services.vector_backends import NumpyBackend
+
+
+def synthetic_vectors(rows: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """簇中心 + 噪声，归一化为单位向量"""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed_query(backend, queries, top_k):
+    """逐条查询，返回 (结果ID列表, 每次耗时毫秒)"""
+    ids = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        result = backend.query([query], top_k)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append([doc['id'] for doc in result])
+    return ids, np.asarray(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='int8 量化检索基准')
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--rescore', default='50,100,200,400', help='重排候选数列表')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = synthetic_vectors(args.rows, args.dim, args.clusters, rng)
+    queries = synthetic_vectors(args.queries, args.dim, args.clusters, rng)
+
+    directory = tempfile.mkdtemp(prefix='bench_quantization_')
+    try:
+        backend = NumpyBackend(directory)
+        start = time.perf_counter()
+        for offset in range(0, args.rows, 5000):
+            end = min(offset + 5000, args.rows)
+            backend.add(
+                [f"c{i}" for i in range(offset, end)],
+                [''] * (end - offset),
+                [{'document_id': str(i // 50)} for i in range(offset, end)],
+                vectors[offset:end]
+            )
+        print(f"写入 {args.rows} x {args.dim} 向量: {time.perf_counter() - start:.1f}s")
+
+        stats = backend.stats()
+        print(f"float32 矩阵 {stats['float_bytes'] / 1e6:.1f} MB, "
+              f"int8 矩阵 {stats['quantized_bytes'] / 1e6:.1f} MB "
+              f"({stats['float_bytes'] / max(stats['quantized_bytes'], 1):.1f}x)")
+
+        backend.quantize = False
+        baseline, latencies = timed_query(backend, queries, args.top_k)
+        print(f"\n{'mode':<18}{'recall@' + str(args.top_k):>10}{'p50 ms':>10}{'p99 ms':>10}")
+        print(f"{'float32':<18}{1.0:>10.4f}{np.percentile(latencies, 50):>10.2f}"
+              f"{np.percentile(latencies, 99):>10.2f}")
+
+        backend.quantize = True
+        for rescore in [int(value) for value in args.rescore.split(',') if value]:
+            backend.rescore_candidates = rescore
+            results, latencies = timed_query(backend, queries, args.top_k)
+            recall = np.mean([
+                len(set(expected) & set(actual)) / len(expected)
+                for expected, actual in zip(baseline, results) if expected
+            ])
+            print(f"{'int8 + rescore ' + str(rescore):<18}{recall:>10.4f}"
+                  f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 99):>10.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
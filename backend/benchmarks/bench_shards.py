@@ -0,0 +1,116 @@
+"""
+分片检索基准 - 不同规模与分片数下 ShardedBackend（NumPy 分片）的查询延迟
+
+每种规模按 document_id 哈希写入 N 个分片，逐条查询并报告 p50 / p99 延迟；
+分片数为 1 时即单个 NumpyBackend。同一规模下各分片数使用相同的向量与查询，
+并以单分片结果为基准核对 top-k 是否一致（分片归并应与全量检索完全相同）。
+
+用法（在 backend 目录执行）:
+    python benchmarks/bench_shards.py [--rows 10000,100000,1000000] [--shards 1,2,4,8] [--dim 384]
+
+1M x 384 的 float32 矩阵约 1.5 GB，写入到 --dir 指定的目录（默认系统临时目录）。
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from services.vector_backends import NumpyBackend, ShardedBackend
+
+# 每批写入的行数
+WRITE_BATCH = 20000
+# 每个文档的分块数（决定 document_id，进而决定分片）
+CHUNKS_PER_DOCUMENT = 50
+
+
+def vector_batches(rows: int, dim: int, clusters: int, seed: int):
+    """按批生成带簇结构的单位向量；同一 seed 下批次内容固定，不必一次性放进内存"""
+    centers = np.random.default_rng(seed).standard_normal((clusters, dim)).astype(np.float32)
+    for offset in range(0, rows, WRITE_BATCH):
+        end = min(offset + WRITE_BATCH, rows)
+        rng = np.random.default_rng((seed, offset))
+        labels = rng.integers(0, clusters, end - offset)
+        vectors = centers[labels] + 0.6 * rng.standard_normal((end - offset, dim)).astype(np.float32)
+        yield offset, end, vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build(directory: str, shards: int, rows: int, dim: int, clusters: int, seed: int):
+    """在 directory 下建立 shards 个分片并写入 rows 行"""
+    if shards == 1:
+        backend = NumpyBackend(os.path.join(directory, 'shard_0'))
+    else:
+        backend = ShardedBackend([
+            NumpyBackend(os.path.join(directory, f"shard_{i}")) for i in range(shards)
+        ])
+    for offset, end, vectors in vector_batches(rows, dim, clusters, seed):
+        backend.add(
+            [f"c{i}" for i in range(offset, end)],
+            [''] * (end - offset),
+            [{'document_id': str(i // CHUNKS_PER_DOCUMENT)} for i in range(offset, end)],
+            vectors
+        )
+    return backend
+
+
+def timed_query(backend, queries, top_k):
+    """逐条查询，返回 (结果ID列表, 每次耗时毫秒)"""
+    ids = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        result = backend.query([query], top_k)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append([doc['id'] for doc in result])
+    return ids, np.asarray(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分片检索基准')
+    parser.add_argument('--rows', default='10000,100000,1000000', help='规模列表')
+    parser.add_argument('--shards', default='1,2,4,8', help='分片数列表')
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=10, help='计时前的预热查询数')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--dir', default=None, help='临时数据目录')
+    args = parser.parse_args()
+
+    rows_list = [int(value) for value in args.rows.split(',') if value]
+    shard_list = [int(value) for value in args.shards.split(',') if value]
+    queries = next(vector_batches(args.queries, args.dim, args.clusters, args.seed + 1))[2]
+
+    print(f"dim={args.dim}, top_k={args.top_k}, queries={args.queries}, CPU 核数={os.cpu_count()}")
+    print(f"\n{'rows':>10}{'shards':>8}{'build s':>10}{'p50 ms':>10}{'p99 ms':>10}{'match':>8}")
+
+    for rows in rows_list:
+        baseline = None
+        for shards in shard_list:
+            directory = tempfile.mkdtemp(prefix='bench_shards_', dir=args.dir)
+            try:
+                start = time.perf_counter()
+                backend = build(directory, shards, rows, args.dim, args.clusters, args.seed)
+                build_seconds = time.perf_counter() - start
+
+                timed_query(backend, queries[:args.warmup], args.top_k)
+                results, latencies = timed_query(backend, queries, args.top_k)
+                if baseline is None:
+                    baseline = results
+                match = np.mean([expected == actual for expected, actual in zip(baseline, results)])
+                print(f"{rows:>10}{shards:>8}{build_seconds:>10.1f}"
+                      f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 99):>10.2f}"
+                      f"{match:>8.2f}")
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+合成语料生成器 - 按指定字符数和中英文比例生成 PDF / DOCX / TXT 文档
+
+PDF 为手写的最小结构：英文行用 Helvetica，中文行用 Identity-H 编码的 Type0 字体并附
+ToUnicode 映射，保证 PyPDF2 能按原文提取。
+
+用法（在 backend 目录执行）:
+    python benchmarks/synthetic_corpus.py out_dir --sizes 10000,100000 --cjk-ratios 0,0.5 --formats pdf,docx,txt
+"""
+import os
+import random
+import argparse
+from typing import List, Dict
+
+EN_WORDS = (
+    "student course credit semester examination regulation university library assessment "
+    "curriculum faculty degree programme registration deadline policy academic conduct "
+    "undergraduate postgraduate handbook requirement module lecture tutorial grade appeal "
+    "plagiarism graduation scholarship campus department advisor enrolment transcript"
+).split()
+
+CJK_WORDS = (
+    "学生 课程 学分 学期 考试 规定 大学 图书馆 评核 课程表 学院 学位 课程计划 注册 截止日期 "
+    "政策 学术 操守 本科 研究生 手册 要求 单元 讲座 导修 成绩 上诉 抄袭 毕业 奖学金 校园 学系"
+).split()
+
+CJK_PUNCT = ['。', '！', '？', '，', '；']
+
+# PDF 版面
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+LINES_PER_PAGE = 50
+EN_LINE_CHARS = 90
+CJK_LINE_CHARS = 40
+
+
+def generate_paragraphs(total_chars: int, cjk_ratio: float, rng: random.Random) -> List[Dict]:
+    """生成段落列表 [{'cjk': bool, 'text': str}]，总字符数约为 total_chars"""
+    paragraphs = []
+    produced = 0
+    while produced < total_chars:
+        cjk = rng.random() < cjk_ratio
+        sentences = []
+        for _ in range(rng.randint(2, 6)):
+            if cjk:
+                words = rng.choices(CJK_WORDS, k=rng.randint(4, 12))
+                sentences.append(''.join(words) + rng.choice(CJK_PUNCT[:3]))
+            else:
+                words = rng.choices(EN_WORDS, k=rng.randint(6, 18))
+                sentences.append(' '.join(words).capitalize() + rng.choice(['.', '.', '!', '?']))
+        text = ('' if cjk else ' ').join(sentences)
+        paragraphs.append({'cjk': cjk, 'text': text})
+        produced += len(text) + 2
+    return paragraphs
+
+
+def _wrap(paragraph: Dict) -> List[str]:
+    """按版面宽度折行"""
+    text = paragraph['text']
+    if paragraph['cjk']:
+        return [text[i:i + CJK_LINE_CHARS] for i in range(0, len(text), CJK_LINE_CHARS)]
+
+    lines = []
+    current = ''
+    for word in text.split(' '):
+        if current and len(current) + 1 + len(word) > EN_LINE_CHARS:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        lines.append(current)
+    return lines
+
+
+def write_txt(path: str, paragraphs: List[Dict]):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('\n\n'.join(paragraph['text'] for paragraph in paragraphs))
+
+
+def write_docx(path: str, paragraphs: List[Dict]):
+    from docx import Document as DocxDocument
+
+    doc = DocxDocument()
+    for paragraph in paragraphs:
+        doc.add_paragraph(paragraph['text'])
+    doc.save(path)
+
+
+def _pdf_literal(text: str) -> str:
+    """WinAnsi 字面字符串转义"""
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def _pdf_hex_utf16(text: str) -> str:
+    """Identity-H 下以 Unicode 码位作为两字节编码"""
+    return '<' + ''.join(f"{ord(char):04X}" for char in text if ord(char) <= 0xFFFF) + '>'
+
+
+def _to_unicode_cmap() -> bytes:
+    """编码即 Unicode 码位的 ToUnicode 映射（每个 bfrange 不跨越高字节）"""
+    ranges = [f"<{high:02X}00> <{high:02X}FF> <{high:02X}00>" for high in range(0x01, 0x100)]
+    blocks = []
+    for start in range(0, len(ranges), 100):
+        block = ranges[start:start + 100]
+        blocks.append(f"{len(block)} beginbfrange\n" + '\n'.join(block) + "\nendbfrange")
+    cmap = (
+        "/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+        "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+        "1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n"
+        + '\n'.join(blocks) +
+        "\nendcmap\nCMapName currentdict /CMap defineresource pop\nend\nend\n"
+    )
+    return cmap.encode('ascii')
+
+
+def write_pdf(path: str, paragraphs: List[Dict]):
+    """写出最小可提取文本的 PDF"""
+    lines = []
+    for paragraph in paragraphs:
+        lines.extend((paragraph['cjk'], line) for line in _wrap(paragraph))
+        lines.append((False, ''))
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+
+    # 固定对象：1 目录、2 页树、3 英文字体、4 中文字体、5 CID 字体、6 字体描述、7 ToUnicode
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        4: b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /Identity-H "
+           b"/DescendantFonts [5 0 R] /ToUnicode 7 0 R >>",
+        5: b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /STSong-Light "
+           b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+           b"/FontDescriptor 6 0 R /DW 1000 >>",
+        6: b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [0 -200 1000 900] "
+           b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 80 >>",
+    }
+    cmap = _to_unicode_cmap()
+    objects[7] = b"<< /Length %d >>\nstream\n" % len(cmap) + cmap + b"\nendstream"
+
+    kids = []
+    next_id = 8
+    for page_lines in pages:
+        ops = ["BT", "14 TL", f"50 {PAGE_HEIGHT - 50} Td"]
+        for cjk, line in page_lines:
+            if cjk:
+                ops.append(f"/F2 10 Tf {_pdf_hex_utf16(line)} Tj T*")
+            else:
+                safe = line.encode('cp1252', 'replace').decode('cp1252')
+                ops.append(f"/F1 10 Tf {_pdf_literal(safe)} Tj T*")
+        ops.append("ET")
+        content = '\n'.join(ops).encode('cp1252')
+
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream"
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode('ascii')
+        kids.append(page_id)
+
+    objects[2] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>"
+    ).encode('ascii')
+
+    with open(path, 'wb') as file:
+        file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = {}
+        for object_id in sorted(objects):
+            offsets[object_id] = file.tell()
+            file.write(b"%d 0 obj\n" % object_id + objects[object_id] + b"\nendobj\n")
+
+        xref_offset = file.tell()
+        size = max(objects) + 1
+        file.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for object_id in range(1, size):
+            file.write(b"%010d 00000 n \n" % offsets[object_id])
+        file.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_offset))
+
+
+WRITERS = {'txt': write_txt, 'docx': write_docx, 'pdf': write_pdf}
+
+
+def generate_corpus(directory: str, sizes: List[int], cjk_ratios: List[float],
+                    formats: List[str], seed: int = 42) -> List[Dict]:
+    """
+    生成合成语料
+
+    Returns:
+        List[Dict]: 每个文件的 {'path', 'format', 'chars', 'cjk_ratio'}
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for size in sizes:
+        for ratio in cjk_ratios:
+            paragraphs = generate_paragraphs(size, ratio, random.Random(f"{seed}-{size}-{ratio}"))
+            for fmt in formats:
+                path = os.path.join(directory, f"synthetic_{size}_cjk{int(ratio * 100)}.{fmt}")
+                WRITERS[fmt](path, paragraphs)
+                files.append({'path': path, 'format': fmt, 'chars': size, 'cjk_ratio': ratio})
+    return files
+
+
+def parse_list(value: str, cast):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成语料')
+    parser.add_argument('directory')
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--cjk-ratios', default='0,0.5,1')
+    parser.add_argument('--formats', default='pdf,docx,txt')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    files = generate_corpus(
+        args.directory,
+        parse_list(args.sizes, int),
+        parse_list(args.cjk_ratios, float),
+        parse_list(args.formats, str),
+        args.seed
+    )
+    for item in files:
+        print(f"{item['path']}  {os.path.getsize(item['path'])} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,12 @@ class Config:
     DEEPSEEK_MODEL = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
     DEEPSEEK_BASE_URL = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
     
+    # LLM HTTP 客户端（每个服务商一个长连接池）
+    LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', 10))                  # 每个服务商的最大连接数
+    LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 5))     # 建立连接超时（秒）
+    LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', 60))          # 读取超时（秒，流式时为两段之间的间隔）
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+    
     # Microsoft Graph API 配置
     GRAPH_CLIENT_ID = os.getenv('GRAPH_CLIENT_ID', '')
     GRAPH_CLIENT_SECRET = os.getenv('GRAPH_CLIENT_SECRET', '')
@@ -41,16 +47,87 @@ class Config:
     # 向量数据库配置（使用 ChromaDB）
     CHROMA_PERSIST_DIR = os.getenv('CHROMA_PERSIST_DIR', './storage/chroma')
     CHROMA_COLLECTION_NAME = 'hku_knowledge_base'
+    # 向量后端：chroma（默认）或 numpy（内存映射矩阵暴力检索，多个 worker 共享页缓存）
+    VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma')
+    NUMPY_STORE_DIR = os.getenv('NUMPY_STORE_DIR', './storage/numpy_store')
+    # numpy 后端在 int8 量化矩阵上选候选，再用 float 向量精确重排
+    NUMPY_QUANTIZE = os.getenv('NUMPY_QUANTIZE', 'False').lower() == 'true'
+    NUMPY_RESCORE_CANDIDATES = int(os.getenv('NUMPY_RESCORE_CANDIDATES', 200))
+    # 分片数：按 document_id 哈希分到 N 个集合（或 NumPy 目录），检索并行查询后合并 top-k；
+    # 修改后需 --rebuild 才会对已有数据生效
+    VECTOR_SHARDS = max(1, int(os.getenv('VECTOR_SHARDS', 1)))
+    VECTOR_BATCH_SIZE = int(os.getenv('VECTOR_BATCH_SIZE', 64))  # 每批写入的文档块数
+    
+    # 检索模式：dense（仅向量）、bm25（仅词法）、hybrid（两路结果倒数排名融合）
+    SEARCH_MODE = os.getenv('SEARCH_MODE', 'hybrid')
+    BM25_INDEX_PATH = os.getenv(
+        'BM25_INDEX_PATH',
+        os.path.join(os.path.dirname(os.path.normpath(CHROMA_PERSIST_DIR)), 'bm25_index.pkl')
+    )
+    # 蓝绿重建：记录当前生效索引版本（集合 / NumPy 目录 / BM25 文件）的指针文件
+    INDEX_POINTER_PATH = os.getenv(
+        'INDEX_POINTER_PATH',
+        os.path.join(os.path.dirname(os.path.normpath(CHROMA_PERSIST_DIR)), 'active_index.json')
+    )
+    HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 20))  # 融合前每路召回的候选数
+    RRF_K = int(os.getenv('RRF_K', 60))                          # 倒数排名融合常数
+    
+    # 启动预热：导入应用时在后台线程打开向量库并加载嵌入模型（/api/health/ready 报告进度）
+    WARMUP_ON_START = os.getenv('WARMUP_ON_START', 'True').lower() == 'true'
+    WARMUP_RETRY_INTERVAL = float(os.getenv('WARMUP_RETRY_INTERVAL', 30))  # 预热失败后的重试间隔（秒）
+    
+    # 语义答案缓存：相似问题（余弦相似度 >= 阈值）且检索到的分块未变化时复用答案，不调用 LLM
+    ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'True').lower() == 'true'
+    ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 512))
+    ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 86400))           # 过期时间（秒）
+    ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+    ANSWER_CACHE_SEED_LIMIT = int(os.getenv('ANSWER_CACHE_SEED_LIMIT', 500))  # 启动时从问答历史预热的条数
+    
+    # 向量缓存配置（按模型和文本哈希缓存向量，避免重复计算）
+    EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'True').lower() == 'true'
+    EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', './storage/embedding_cache.db')
+    EMBEDDING_CACHE_MAX_BYTES = int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    
+    # LLM 响应缓存（提示词、模型和参数完全相同时复用生成结果）
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'True').lower() == 'true'
+    RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', './storage/response_cache.db')
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 86400))     # 过期时间（秒）
+    
+    # 检索缓存（查询文本 -> 向量，(向量, top_k) -> 结果；写入或删除时清空结果缓存）
+    SEARCH_CACHE_ENABLED = os.getenv('SEARCH_CACHE_ENABLED', 'True').lower() == 'true'
+    SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 1024))    # 每级最多条目数
+    SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 600))     # 过期时间（秒）
     
     # 文档处理配置
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', './storage/uploads')
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10MB
     ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt'}
     
+    # 提取文本缓存（按文件内容哈希保存，调整分块参数后无需重新解析文档）
+    TEXT_CACHE_ENABLED = os.getenv('TEXT_CACHE_ENABLED', 'True').lower() == 'true'
+    TEXT_CACHE_DIR = os.getenv('TEXT_CACHE_DIR', './storage/text_cache')
+    
+    # 后台导入队列
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 2))            # 并发处理的文档数
+    INGEST_POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', 5))  # 轮询待处理任务的间隔（秒）
+    INGEST_HEARTBEAT_INTERVAL = float(os.getenv('INGEST_HEARTBEAT_INTERVAL', 15))  # 运行中任务的心跳间隔（秒）
+    INGEST_STALE_AFTER = float(os.getenv('INGEST_STALE_AFTER', 120))    # 心跳超过此时长未更新的任务视为中断，重新排队
+    INGEST_PROGRESS_INTERVAL = float(os.getenv('INGEST_PROGRESS_INTERVAL', 2))  # 页进度写入数据库的最小间隔（秒）
+    
     # RAG 配置
-    CHUNK_SIZE = 1000
-    CHUNK_OVERLAP = 200
+    # 分块单位：'token' 按 token 预算切分，'char' 按字符数（兼容旧索引）
+    CHUNK_UNIT = os.getenv('CHUNK_UNIT', 'token')
+    CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 300 if CHUNK_UNIT == 'token' else 1000))
+    CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 50 if CHUNK_UNIT == 'token' else 200))
     TOP_K = 5
+    SEARCH_BATCH_MAX = int(os.getenv('SEARCH_BATCH_MAX', 50))  # 批量检索接口单次最多查询数
+    SEARCH_TOP_K_MAX = int(os.getenv('SEARCH_TOP_K_MAX', 50))  # 批量检索接口每个查询最多返回的结果数
+    
+    # 上下文装填（按 token 预算选择分块和邮件）
+    CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500))       # 提示词中上下文部分的 token 上限
+    CONTEXT_EMAIL_MAX_TOKENS = int(os.getenv('CONTEXT_EMAIL_MAX_TOKENS', 200))  # 单封邮件正文的 token 上限
+    CONTEXT_MIN_TOKENS = int(os.getenv('CONTEXT_MIN_TOKENS', 40))             # 截断后短于此值的片段不放入
     
     # 确保必要的目录存在
     os.makedirs(CHROMA_PERSIST_DIR, exist_ok=True)
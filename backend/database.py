@@ -2,6 +2,7 @@
 数据库模型和初始化
 """
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from datetime import datetime
 
 db = SQLAlchemy()
@@ -12,6 +13,30 @@ def init_db(app):
     db.init_app(app)
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+
+
+def upgrade_schema():
+    """为已存在的表补齐模型中新增的列和索引（create_all 不会修改旧表）"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+        if not missing:
+            continue
+        
+        for column in missing:
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(
+                f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+            ))
+        db.session.commit()
+        
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
 
 
 class User(db.Model):
@@ -99,10 +124,14 @@ class Document(db.Model):
     file_path = db.Column(db.String(500))
     file_type = db.Column(db.String(10))
     file_size = db.Column(db.Integer)
+    content_hash = db.Column(db.String(64), index=True)  # 文件内容 SHA-256
+    source_path = db.Column(db.String(500), index=True)  # 导入时相对于导入目录的路径（单文件导入为文件名）
     
     # 处理状态
     processed = db.Column(db.Boolean, default=False)
     chunks_count = db.Column(db.Integer, default=0)
+    # 从第一个分块起连续写入向量库的分块数；未处理完成（processed 为 False）时为续传起点
+    chunks_written = db.Column(db.Integer, default=0)
     
     # 上传信息
     uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -115,8 +144,55 @@ class Document(db.Model):
             'filename': self.filename,
             'file_type': self.file_type,
             'file_size': self.file_size,
+            'content_hash': self.content_hash,
+            'source_path': self.source_path,
             'processed': self.processed,
             'chunks_count': self.chunks_count,
+            'chunks_written': self.chunks_written,
             'uploaded_at': self.uploaded_at.isoformat()
         }
 
+
+class IngestJob(db.Model):
+    """文档导入任务表（后台处理队列）"""
+    __tablename__ = 'ingest_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    
+    # 任务状态：pending / running / done / failed
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)
+    error = db.Column(db.Text)
+    
+    # 处理进度
+    pages_total = db.Column(db.Integer)
+    pages_done = db.Column(db.Integer, default=0)
+    chunks_total = db.Column(db.Integer, default=0)
+    chunks_embedded = db.Column(db.Integer, default=0)
+    
+    # 认领任务的进程（主机名:pid）及其心跳时间，心跳超时的 running 任务才会被重新排队
+    owner = db.Column(db.String(100))
+    heartbeat_at = db.Column(db.DateTime)
+    
+    # 时间戳
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        """转换为字典"""
+        return {
+            'id': self.id,
+            'document_id': self.document_id,
+            'status': self.status,
+            'error': self.error,
+            'progress': {
+                'pages_total': self.pages_total,
+                'pages_done': self.pages_done,
+                'chunks_total': self.chunks_total,
+                'chunks_embedded': self.chunks_embedded
+            },
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -1,12 +1,16 @@
 """
 Chat routes - Q&A
 """
-from flask import Blueprint, request, jsonify, session
+import json
+import time
+from flask import Blueprint, Response, request, jsonify, session, stream_with_context
 from database import db, User, QueryHistory
 from config import Config
 from services.vector_store import vector_store
 from services.email_service import EmailService
 from services.rag_service import RAGService
+from services.answer_cache import answer_cache, knowledge_fingerprint
+from services.single_flight import single_flight, normalize_question
 
 chat_bp = Blueprint('chat', __name__)
 
@@ -26,6 +30,184 @@ rag_service = RAGService(
 )
 
 
+def _retrieve(user, question):
+    """Retrieve knowledge base chunks and the user's emails in parallel"""
+    def retrieve_knowledge(query):
+        """Search knowledge base (concurrent identical questions share one search)"""
+        try:
+            return single_flight.do(
+                ('retrieve', normalize_question(query)),
+                lambda: vector_store.search(query, Config.TOP_K)
+            )[0]
+        except Exception as e:
+            print(f"Knowledge retrieval failed: {e}")
+            return []
+    
+    def retrieve_emails(query):
+        """Search mailbox"""
+        try:
+            if not user.email_connected or not user.access_token:
+                return []
+            return email_service.search_emails(user.access_token, query, top=5)
+        except Exception as e:
+            print(f"Email retrieval failed: {e}")
+            return []
+    
+    retrieval_results = RAGService.parallel_retrieve(
+        knowledge_retriever=retrieve_knowledge,
+        email_retriever=retrieve_emails,
+        question=question
+    )
+    return retrieval_results['knowledge'], retrieval_results['emails']
+
+
+def _lookup_cached_answer(question, knowledge_docs, email_docs):
+    """
+    Semantic answer cache: only for answers built from the shared knowledge base,
+    never when personal email context is involved
+    
+    Returns:
+        tuple: (generation result or None, question embedding or None when not cacheable)
+    """
+    if email_docs:
+        return None, None
+    
+    start_time = time.time()
+    question_embedding = vector_store.query_embedding(question)
+    cached = answer_cache.lookup(question_embedding, knowledge_docs)
+    if not cached:
+        return None, question_embedding
+    return {
+        'answer': cached['answer'],
+        'model': cached['model'],
+        'provider': cached['provider'],
+        'tokens_used': 0,
+        'saved_tokens': cached['tokens_used'] or 0,
+        'response_time': time.time() - start_time,
+        'cached': True,
+        'cache_similarity': cached['similarity']
+    }, question_embedding
+
+
+def _generate(question, knowledge_docs, email_docs, use_cache=True):
+    """
+    Answer from the semantic cache, or pack the context and call the LLM
+    (use_cache=False skips both answer caches; prompts with emails never use the response cache)
+    """
+    generation_result, question_embedding = None, None
+    if use_cache:
+        generation_result, question_embedding = _lookup_cached_answer(question, knowledge_docs, email_docs)
+    if generation_result is None:
+        # Build context
+        context, context_stats = RAGService.pack_context(knowledge_docs, email_docs)
+        
+        # Generate answer
+        generation_result = rag_service.generate_answer(
+            question, context, use_cache=use_cache and not email_docs
+        )
+        generation_result['context'] = context_stats
+        # Response-cache hits carry no usage; storing them would make later semantic hits report 0 saved tokens
+        if question_embedding is not None and not generation_result.get('response_cached'):
+            answer_cache.store(question_embedding, knowledge_docs, generation_result)
+    return generation_result
+
+
+def _generate_coalesced(question, knowledge_docs, email_docs, use_cache=True):
+    """
+    Concurrent requests with the same normalized question and the same retrieved
+    knowledge chunks wait on a single generation and share its result.
+    Requests with personal email context or a cache bypass are never coalesced.
+    """
+    if email_docs or not use_cache:
+        return _generate(question, knowledge_docs, email_docs, use_cache)
+    
+    key = ('generate', normalize_question(question), knowledge_fingerprint(knowledge_docs))
+    generation_result, shared = single_flight.do(
+        key, lambda: _generate(question, knowledge_docs, email_docs)
+    )
+    if shared:
+        generation_result = {**generation_result, 'coalesced': True}
+    return generation_result
+
+
+def _format_sources(knowledge_docs, email_docs):
+    """Sources shown to the user"""
+    return {
+        'knowledge': [
+            {
+                'source': doc.get('metadata', {}).get('filename', 'unknown'),
+                'text': doc['text'][:200] + '...' if len(doc['text']) > 200 else doc['text']
+            }
+            for doc in knowledge_docs[:3]
+        ],
+        'emails': [
+            {
+                'subject': email.get('subject', ''),
+                'from': email.get('from', ''),
+                'date': email.get('date', ''),
+                'preview': email.get('preview', '')[:150] + '...' if len(email.get('preview', '')) > 150 else email.get('preview', '')
+            }
+            for email in email_docs[:3]
+        ]
+    }
+
+
+def _save_history(user_id, question, knowledge_docs, email_docs, generation_result):
+    """Persist one question/answer pair"""
+    query_history = QueryHistory(
+        user_id=user_id,
+        question=question,
+        answer=generation_result['answer'],
+        knowledge_sources=[
+            {
+                'text': doc['text'][:200],
+                'source': doc.get('metadata', {}).get('filename', 'unknown')
+            }
+            for doc in knowledge_docs[:3]
+        ],
+        email_sources=[
+            {
+                'subject': email.get('subject', ''),
+                'from': email.get('from', ''),
+                'preview': email.get('preview', '')[:200]
+            }
+            for email in email_docs[:3]
+        ],
+        model_used=generation_result.get('model'),
+        tokens_used=generation_result.get('tokens_used'),
+        response_time=generation_result.get('response_time')
+    )
+    db.session.add(query_history)
+    db.session.commit()
+    return query_history
+
+
+def _response_metadata(generation_result):
+    metadata = {
+        'model': generation_result.get('model'),
+        'tokens_used': generation_result.get('tokens_used'),
+        'saved_tokens': generation_result.get('saved_tokens', 0),
+        'prompt_tokens': generation_result.get('prompt_tokens', 0),
+        'context': generation_result.get('context'),
+        'response_time': round(generation_result.get('response_time', 0), 2),
+        'cached': generation_result.get('cached', False),
+        'coalesced': generation_result.get('coalesced', False),
+        'cache_similarity': generation_result.get('cache_similarity')
+    }
+    if rag_service.response_cache is not None:
+        metadata['response_cache'] = {
+            'hit': generation_result.get('response_cached', False),
+            'hit_rate': rag_service.response_cache.hit_rate(),
+            'saved_tokens': rag_service.response_cache.saved_tokens
+        }
+    return metadata
+
+
+def _sse(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @chat_bp.route('/ask', methods=['POST'])
 def ask_question():
     """Core Q&A endpoint"""
@@ -39,102 +221,25 @@ def ask_question():
     
     data = request.get_json()
     question = data.get('question', '').strip()
+    no_cache = bool(data.get('no_cache', False))
     
     if not question:
         return jsonify({'code': 400, 'message': 'Question cannot be empty', 'data': None}), 400
     
     try:
-        # Retrieval helpers
-        def retrieve_knowledge(query):
-            """Search knowledge base"""
-            try:
-                return vector_store.search(query, Config.TOP_K)
-            except Exception as e:
-                print(f"Knowledge retrieval failed: {e}")
-                return []
-        
-        def retrieve_emails(query):
-            """Search mailbox"""
-            try:
-                if not user.email_connected or not user.access_token:
-                    return []
-                return email_service.search_emails(user.access_token, query, top=5)
-            except Exception as e:
-                print(f"Email retrieval failed: {e}")
-                return []
-        
-        # Parallel retrieval
-        retrieval_results = RAGService.parallel_retrieve(
-            knowledge_retriever=retrieve_knowledge,
-            email_retriever=retrieve_emails,
-            question=question
-        )
-        
-        knowledge_docs = retrieval_results['knowledge']
-        email_docs = retrieval_results['emails']
+        knowledge_docs, email_docs = _retrieve(user, question)
+        generation_result = _generate_coalesced(question, knowledge_docs, email_docs, use_cache=not no_cache)
         
-        # Build context
-        context = RAGService.build_context(knowledge_docs, email_docs)
-        
-        # Generate answer
-        generation_result = rag_service.generate_answer(question, context)
-        answer = generation_result['answer']
-        
-        # Save history
-        query_history = QueryHistory(
-            user_id=user_id,
-            question=question,
-            answer=answer,
-            knowledge_sources=[
-                {
-                    'text': doc['text'][:200],
-                    'source': doc.get('metadata', {}).get('filename', 'unknown')
-                }
-                for doc in knowledge_docs[:3]
-            ],
-            email_sources=[
-                {
-                    'subject': email.get('subject', ''),
-                    'from': email.get('from', ''),
-                    'preview': email.get('preview', '')[:200]
-                }
-                for email in email_docs[:3]
-            ],
-            model_used=generation_result.get('model'),
-            tokens_used=generation_result.get('tokens_used'),
-            response_time=generation_result.get('response_time')
-        )
-        db.session.add(query_history)
-        db.session.commit()
+        # Save history (one row per user, also for coalesced answers)
+        _save_history(user_id, question, knowledge_docs, email_docs, generation_result)
         
         return jsonify({
             'code': 0,
             'message': 'OK',
             'data': {
-                'answer': answer,
-                'sources': {
-                    'knowledge': [
-                        {
-                            'source': doc.get('metadata', {}).get('filename', 'unknown'),
-                            'text': doc['text'][:200] + '...' if len(doc['text']) > 200 else doc['text']
-                        }
-                        for doc in knowledge_docs[:3]
-                    ],
-                    'emails': [
-                        {
-                            'subject': email.get('subject', ''),
-                            'from': email.get('from', ''),
-                            'date': email.get('date', ''),
-                            'preview': email.get('preview', '')[:150] + '...' if len(email.get('preview', '')) > 150 else email.get('preview', '')
-                        }
-                        for email in email_docs[:3]
-                    ]
-                },
-                'metadata': {
-                    'model': generation_result.get('model'),
-                    'tokens_used': generation_result.get('tokens_used'),
-                    'response_time': round(generation_result.get('response_time', 0), 2)
-                }
+                'answer': generation_result['answer'],
+                'sources': _format_sources(knowledge_docs, email_docs),
+                'metadata': _response_metadata(generation_result)
             }
         })
 
@@ -147,6 +252,69 @@ def ask_question():
         }), 500
 
 
+@chat_bp.route('/ask/stream', methods=['POST'])
+def ask_question_stream():
+    """
+    Streaming Q&A over server-sent events
+    
+    Events: `sources` (as soon as retrieval finishes), `token` ({"content": ...}, repeated),
+    then `done` (answer metadata and history_id) or `error`. The history row is written
+    after the last token, with the provider-reported token usage and generation time.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'code': 401, 'message': 'Not authenticated', 'data': None}), 401
+    
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'code': 404, 'message': 'User not found', 'data': None}), 404
+    
+    data = request.get_json()
+    question = data.get('question', '').strip()
+    no_cache = bool(data.get('no_cache', False))
+    
+    if not question:
+        return jsonify({'code': 400, 'message': 'Question cannot be empty', 'data': None}), 400
+    
+    def generate():
+        try:
+            knowledge_docs, email_docs = _retrieve(user, question)
+            yield _sse('sources', _format_sources(knowledge_docs, email_docs))
+            
+            generation_result, question_embedding = None, None
+            if not no_cache:
+                generation_result, question_embedding = _lookup_cached_answer(question, knowledge_docs, email_docs)
+            if generation_result is not None:
+                yield _sse('token', {'content': generation_result['answer']})
+            else:
+                context, context_stats = RAGService.pack_context(knowledge_docs, email_docs)
+                for event in rag_service.stream_answer(question, context):
+                    if event['type'] == 'token':
+                        yield _sse('token', {'content': event['content']})
+                    else:
+                        generation_result = event
+                generation_result['context'] = context_stats
+                if question_embedding is not None:
+                    answer_cache.store(question_embedding, knowledge_docs, generation_result)
+            
+            history = _save_history(user_id, question, knowledge_docs, email_docs, generation_result)
+            metadata = _response_metadata(generation_result)
+            time_to_first_token = generation_result.get('time_to_first_token')
+            metadata['time_to_first_token'] = round(time_to_first_token, 2) if time_to_first_token is not None else None
+            metadata['history_id'] = history.id
+            if generation_result.get('error'):
+                metadata['error'] = generation_result['error']
+            yield _sse('done', metadata)
+        except Exception as e:
+            db.session.rollback()
+            yield _sse('error', {'message': f'Failed to process question: {str(e)}'})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # keep nginx from buffering the stream
+    })
+
+
 @chat_bp.route('/history', methods=['GET'])
 def get_history():
     """Fetch chat history"""
@@ -5,16 +5,17 @@ from flask import Blueprint, request, jsonify, session
 from werkzeug.utils import secure_filename
 import os
 import uuid
-from database import db, User, Document
+from database import db, User, Document, IngestJob
 from config import Config
 from services.document_processor import document_processor
-from services.vector_store import vector_store
+from services.vector_store import vector_store, SEARCH_MODES
+from services.metadata_index import normalize_filters
+from services.answer_cache import answer_cache
+from services.single_flight import single_flight
+from services.ingest_queue import ingest_queue
 
 knowledge_bp = Blueprint('knowledge', __name__)
 
-# Initialize vector store
-vector_store.initialize()
-
 
 def allowed_file(filename):
     """Check whether file type is allowed"""
@@ -66,42 +67,23 @@ def upload_document():
             file_path=file_path,
             file_type=file_type,
             file_size=file_size,
+            content_hash=document_processor.compute_hash(file_path),
             uploaded_by=user_id
         )
         db.session.add(doc)
         db.session.commit()
         
-        # 处理文档：提取文本并分块
-        chunks = document_processor.process_document(
-            file_path=file_path,
-            filename=filename,
-            chunk_size=Config.CHUNK_SIZE,
-            overlap=Config.CHUNK_OVERLAP
-        )
-        
-        # 添加到向量库
-        texts = [chunk['text'] for chunk in chunks]
-        metadatas = [
-            {**chunk['metadata'], 'document_id': str(doc.id)}
-            for chunk in chunks
-        ]
-        ids = [f"doc_{doc.id}_chunk_{i}" for i in range(len(chunks))]
-        
-        vector_store.add_documents(texts, metadatas, ids)
-        
-        # 更新文档状态
-        doc.processed = True
-        doc.chunks_count = len(chunks)
-        db.session.commit()
+        # 提取、分块和向量写入交给后台队列，请求立即返回
+        job = ingest_queue.enqueue(doc.id)
         
         return jsonify({
             'code': 0,
-            'message': '文档上传成功',
+            'message': '文档已加入处理队列',
             'data': {
                 'document': doc.to_dict(),
-                'chunks_count': len(chunks)
+                'job': job.to_dict()
             }
-        })
+        }), 202
         
     except Exception as e:
         db.session.rollback()
@@ -116,6 +98,54 @@ def upload_document():
         }), 500
 
 
+@knowledge_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询文档导入任务状态与进度"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'code': 401, 'message': '未登录', 'data': None}), 401
+    
+    # 只能查询自己上传的文档的任务，其他用户的任务同样返回 404
+    job = IngestJob.query.join(Document, Document.id == IngestJob.document_id)\
+        .filter(IngestJob.id == job_id, Document.uploaded_by == user_id).first()
+    if not job:
+        return jsonify({'code': 404, 'message': '任务不存在', 'data': None}), 404
+    
+    return jsonify({
+        'code': 0,
+        'message': '成功',
+        'data': job.to_dict()
+    })
+
+
+@knowledge_bp.route('/jobs/<int:job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """重试失败的导入任务：新任务从文档已写入的分块之后续传"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'code': 401, 'message': '未登录', 'data': None}), 401
+    
+    job = IngestJob.query.join(Document, Document.id == IngestJob.document_id)\
+        .filter(IngestJob.id == job_id, Document.uploaded_by == user_id).first()
+    if not job:
+        return jsonify({'code': 404, 'message': '任务不存在', 'data': None}), 404
+    if job.status != 'failed':
+        return jsonify({'code': 400, 'message': '只能重试失败的任务', 'data': None}), 400
+    
+    # 同一文档已有未完成的任务时不重复排队
+    active = IngestJob.query.filter(
+        IngestJob.document_id == job.document_id,
+        IngestJob.status.in_(['pending', 'running'])
+    ).first()
+    new_job = active or ingest_queue.enqueue(job.document_id)
+    
+    return jsonify({
+        'code': 0,
+        'message': '任务已重新加入处理队列',
+        'data': new_job.to_dict()
+    }), 202
+
+
 @knowledge_bp.route('/documents', methods=['GET'])
 def list_documents():
     """获取文档列表"""
@@ -198,12 +228,22 @@ def search_knowledge():
     data = request.get_json()
     query = data.get('query', '')
     top_k = data.get('top_k', Config.TOP_K)
+    mode = data.get('mode')
+    filters = data.get('filters')
     
     if not query:
         return jsonify({'code': 400, 'message': '查询内容不能为空', 'data': None}), 400
     
+    if mode and mode not in SEARCH_MODES:
+        return jsonify({'code': 400, 'message': f'不支持的检索模式: {mode}', 'data': None}), 400
+    
+    try:
+        normalize_filters(filters)
+    except ValueError as e:
+        return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
+    
     try:
-        results = vector_store.search(query, top_k)
+        results = vector_store.search(query, top_k, mode, filters)
         
         return jsonify({
             'code': 0,
@@ -221,6 +261,69 @@ def search_knowledge():
         }), 500
 
 
+@knowledge_bp.route('/search/batch', methods=['POST'])
+def search_knowledge_batch():
+    """批量搜索知识库（一次向量计算、一次检索）"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'code': 401, 'message': '未登录', 'data': None}), 401
+    
+    data = request.get_json() or {}
+    queries = data.get('queries', [])
+    top_k = data.get('top_k', Config.TOP_K)
+    mode = data.get('mode')
+    filters = data.get('filters')
+    
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'code': 400, 'message': 'queries 必须是非空列表', 'data': None}), 400
+    
+    if len(queries) > Config.SEARCH_BATCH_MAX:
+        return jsonify({
+            'code': 400,
+            'message': f'单次最多 {Config.SEARCH_BATCH_MAX} 个查询',
+            'data': None
+        }), 400
+    
+    if any(not isinstance(query, str) or not query.strip() for query in queries):
+        return jsonify({'code': 400, 'message': '查询内容不能为空', 'data': None}), 400
+    
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= Config.SEARCH_TOP_K_MAX:
+        return jsonify({
+            'code': 400,
+            'message': f'top_k 必须是 1 到 {Config.SEARCH_TOP_K_MAX} 之间的整数',
+            'data': None
+        }), 400
+    
+    if mode and mode not in SEARCH_MODES:
+        return jsonify({'code': 400, 'message': f'不支持的检索模式: {mode}', 'data': None}), 400
+    
+    try:
+        normalize_filters(filters)
+    except ValueError as e:
+        return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
+    
+    try:
+        results = vector_store.search_many(queries, top_k, mode, filters)
+        
+        return jsonify({
+            'code': 0,
+            'message': '搜索成功',
+            'data': {
+                'results': [
+                    {'query': query, 'results': items, 'count': len(items)}
+                    for query, items in zip(queries, results)
+                ],
+                'count': len(results)
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'code': 500,
+            'message': f'搜索失败: {str(e)}',
+            'data': None
+        }), 500
+
+
 @knowledge_bp.route('/stats', methods=['GET'])
 def get_stats():
     """获取知识库统计信息"""
@@ -237,7 +340,11 @@ def get_stats():
             'message': '成功',
             'data': {
                 'documents_count': doc_count,
-                'vectors_count': vector_count
+                'vectors_count': vector_count,
+                'search_cache': vector_store.cache_stats(),
+                'answer_cache': answer_cache.stats(),
+                'single_flight': single_flight.stats(),
+                'backend': vector_store.backend_stats()
             }
         })
     except Exception as e:
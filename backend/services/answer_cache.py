@@ -0,0 +1,220 @@
+"""
+语义答案缓存 - 措辞不同但语义相同、且检索到的知识分块未变化的问题直接复用已生成的答案
+"""
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+from database import QueryHistory
+from services.vector_store import vector_store
+
+logger = logging.getLogger(__name__)
+
+
+def knowledge_fingerprint(knowledge_docs: List[Dict]) -> tuple:
+    """检索结果的指纹：按顺序的 (分块ID, 正文哈希)，分块被替换或重新分块后指纹随之变化"""
+    return tuple(
+        (doc.get('id'), hashlib.sha1(doc.get('text', '').encode('utf-8')).hexdigest())
+        for doc in knowledge_docs
+    )
+
+
+class SemanticAnswerCache:
+    """
+    语义答案缓存
+
+    每个条目保存 (问题向量, 检索结果指纹, 答案)。新问题与某条目的余弦相似度不低于
+    ANSWER_CACHE_THRESHOLD，且本次检索结果的指纹与条目完全相同（即 LLM 会看到同样的上下文）时命中。
+    只缓存不含个人邮件上下文的答案；检索到邮件的请求既不查询也不写入缓存。
+    按 LRU + TTL 淘汰。启动后可从 QueryHistory 预热（见 start）。
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 86400, threshold: float = 0.95):
+        self.app = None
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()  # 条目ID -> dict
+        self._matrix = None            # 按 _entries 顺序堆叠的单位向量，写入或淘汰后重建
+        self._matrix_keys = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._started = False
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+    def init_app(self, app):
+        """绑定 Flask 应用（不立即预热，首次请求时再 start）"""
+        self.app = app
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, knowledge_docs: List[Dict]) -> Optional[Dict]:
+        """
+        查找可复用的答案
+
+        Returns:
+            Dict: {'answer', 'model', 'provider', 'tokens_used', 'similarity'}，未命中返回 None
+        """
+        if self.max_size <= 0:
+            return None
+        fingerprint = knowledge_fingerprint(knowledge_docs)
+        query = self._unit(embedding)
+
+        with self._lock:
+            self._expire()
+            if self._entries:
+                if self._matrix is None:
+                    self._matrix_keys = list(self._entries)
+                    self._matrix = np.stack([self._entries[key]['embedding'] for key in self._matrix_keys])
+                similarities = self._matrix @ query
+                for index in np.argsort(-similarities):
+                    if similarities[index] < self.threshold:
+                        break
+                    key = self._matrix_keys[index]
+                    entry = self._entries[key]
+                    if entry['fingerprint'] == fingerprint:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        self.saved_tokens += entry['tokens_used'] or 0
+                        return {
+                            'answer': entry['answer'],
+                            'model': entry['model'],
+                            'provider': entry['provider'],
+                            'tokens_used': entry['tokens_used'],
+                            'similarity': round(float(similarities[index]), 4),
+                        }
+            self.misses += 1
+            return None
+
+    def store(self, embedding, knowledge_docs: List[Dict], generation_result: Dict,
+              created_at: Optional[float] = None):
+        """写入一条答案（生成失败的结果不缓存）；created_at 用于预热时按原始时间计算过期"""
+        if self.max_size <= 0 or generation_result.get('error') or not generation_result.get('answer'):
+            return
+        created_at = created_at or time.time()
+        if self.ttl and created_at + self.ttl < time.time():
+            return
+
+        with self._lock:
+            self._entries[self._next_id] = {
+                'embedding': self._unit(embedding),
+                'fingerprint': knowledge_fingerprint(knowledge_docs),
+                'answer': generation_result['answer'],
+                'model': generation_result.get('model'),
+                'provider': generation_result.get('provider'),
+                'tokens_used': generation_result.get('tokens_used'),
+                'expires_at': created_at + self.ttl if self.ttl else None,
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def _expire(self):
+        """删除过期条目（调用方持有锁）"""
+        now = time.time()
+        expired = [key for key, entry in self._entries.items()
+                   if entry['expires_at'] is not None and entry['expires_at'] < now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def start(self):
+        """后台从 QueryHistory 预热（幂等）"""
+        if self._started or self.max_size <= 0 or not Config.ANSWER_CACHE_SEED_LIMIT:
+            return
+        with self._lock:
+            if self._started or self.app is None:
+                return
+            self._started = True
+        threading.Thread(target=self._seed, name='answer-cache-seed', daemon=True).start()
+
+    def _seed(self):
+        try:
+            with self.app.app_context():
+                seeded = self.seed_from_history(Config.ANSWER_CACHE_SEED_LIMIT)
+            logger.info(f"语义答案缓存预热完成: {seeded} 条")
+        except Exception as e:
+            logger.error(f"语义答案缓存预热失败: {str(e)}")
+
+    def seed_from_history(self, limit: int, batch_size: int = 50) -> int:
+        """
+        用最近的问答记录预热（需在应用上下文中调用）
+
+        历史记录只保存了前 3 个知识来源的正文前 200 字，因此对每个问题重新检索，
+        当前结果与记录一致时才视为上下文未变化，以当前检索结果的指纹写入。
+        含邮件来源或生成失败（tokens_used 为空或 0）的记录跳过。
+        """
+        rows = QueryHistory.query\
+            .filter(QueryHistory.tokens_used > 0)\
+            .order_by(QueryHistory.created_at.desc())\
+            .limit(limit).all()
+
+        latest = {}
+        for row in rows:
+            if not row.email_sources and row.question.strip() not in latest:
+                latest[row.question.strip()] = row
+        records = list(reversed(list(latest.values())))  # 旧的先写入，最近的问题最后被淘汰
+
+        seeded = 0
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            questions = [row.question.strip() for row in batch]
+            embeddings = vector_store.query_embeddings(questions)
+            results = vector_store.search_many(questions, Config.TOP_K)
+            for row, embedding, knowledge_docs in zip(batch, embeddings, results):
+                recorded = [source.get('text') for source in row.knowledge_sources or []]
+                current = [doc['text'][:200] for doc in knowledge_docs[:3]]
+                if recorded != current:
+                    continue
+                # created_at 以 UTC 的 naive datetime 存储
+                created_at = row.created_at.replace(tzinfo=timezone.utc).timestamp() if row.created_at else None
+                self.store(embedding, knowledge_docs, {
+                    'answer': row.answer,
+                    'model': row.model_used,
+                    'tokens_used': row.tokens_used,
+                }, created_at=created_at)
+                seeded += 1
+        return seeded
+
+    def stats(self) -> Dict:
+        """命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'saved_tokens': self.saved_tokens,
+            }
+
+
+# 全局实例
+answer_cache = SemanticAnswerCache(
+    max_size=Config.ANSWER_CACHE_SIZE if Config.ANSWER_CACHE_ENABLED else 0,
+    ttl=Config.ANSWER_CACHE_TTL,
+    threshold=Config.ANSWER_CACHE_THRESHOLD
+)
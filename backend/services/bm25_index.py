@@ -0,0 +1,357 @@
+"""
+BM25 词法索引 - 与 ChromaDB 中的分块一一对应，补充课程代码、条例编号、专有名词等精确匹配
+"""
+import os
+import re
+import math
+import heapq
+import pickle
+import logging
+import threading
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from services.metadata_index import MetadataIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# 中文连续片段 | 字母+数字（课程代码 comp7404）| 数字编号（3.5.1、12a）| 英文单词
+_TOKEN_RE = re.compile(
+    r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+'
+    r'|[a-z]+\d+[a-z]*'
+    r'|\d+(?:\.\d+)*[a-z]?'
+    r'|[a-z]+'
+)
+
+_CJK_START_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or that the this to was were "
+    "will with what when where which who how do does can i you my me".split()
+)
+
+INDEX_VERSION = 2
+
+
+@contextmanager
+def _file_lock(path: str):
+    """进程间互斥锁（对锁文件加排他锁，进程退出时由系统释放）"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a+b') as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK 重试约 10 秒后仍未拿到锁
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词：英文小写单词与数字编号整体保留，中文连续片段切成二元组（单字保留为一元）。
+    "COMP 7404" 这类被空格分开的课程代码额外产出合并词 comp7404，与 "COMP7404" 互相匹配。
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = []
+    previous = None
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group()
+        if _CJK_START_RE.match(token):
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+            previous = None
+            continue
+
+        if token.isdigit() and previous and previous.isalpha() and 2 <= len(previous) <= 5:
+            tokens.append(previous + token)
+        if token not in _STOPWORDS:
+            tokens.append(token)
+        previous = token
+    return tokens
+
+
+class BM25Index:
+    """
+    内存倒排索引（Okapi BM25）
+
+    每个词的倒排表是两个 array('I')：内部文档编号与词频。删除只打墓碑
+    （doc_ids 置 None），墓碑超过存活文档的四分之一时在保存前压缩。
+    整个索引以 pickle 原子写入磁盘。服务器 worker、后台导入队列和导入脚本会同时修改
+    同一个文件，因此所有修改都在 update() 中进行：持有进程间文件锁，先加载其他进程
+    已保存的内容，修改后立即写回，不会覆盖别人的写入或删除；只读的进程由
+    reload_if_changed 按文件标识（inode、修改时间、大小）重新加载。
+
+    同时持有按分块ID组织的元数据索引（metadata），供带过滤条件的检索解析候选集合，
+    与词法索引一同保存和重新加载。
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock_path = f"{path}.lock"
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._reset()
+
+    def _reset(self):
+        self.doc_ids = []              # 内部编号 -> 分块ID（已删除为 None）
+        self.doc_owner = []            # 内部编号 -> document_id
+        self.doc_lengths = array('I')  # 内部编号 -> 词数
+        self.postings = {}             # 词 -> (array 文档编号, array 词频)
+        self.total_length = 0
+        self.metadata = MetadataIndex()
+        self._rebuild_lookups()
+        self.dirty = False
+
+    def _rebuild_lookups(self):
+        self.id_map = {}
+        self.by_document = defaultdict(set)
+        for internal, chunk_id in enumerate(self.doc_ids):
+            if chunk_id is not None:
+                self.id_map[chunk_id] = internal
+                self.by_document[self.doc_owner[internal]].add(internal)
+
+    def __len__(self) -> int:
+        return len(self.id_map)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _file_stamp(self) -> Optional[Tuple[int, int, int]]:
+        """磁盘文件的标识；每次保存都会替换为新文件，inode 随之变化"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> bool:
+        """从磁盘加载；文件不存在、损坏或版本过旧时为空索引并返回 False"""
+        with self._lock:
+            if not self.exists():
+                self._reset()
+                return False
+            try:
+                stamp = self._file_stamp()
+                with open(self.path, 'rb') as file:
+                    state = pickle.load(file)
+                if state.get('version') != INDEX_VERSION:
+                    raise ValueError(f"索引版本不匹配: {state.get('version')}")
+            except Exception as e:
+                logger.error(f"BM25 索引加载失败，将使用空索引: {str(e)}")
+                self._reset()
+                return False
+
+            self.doc_ids = state['doc_ids']
+            self.doc_owner = state['doc_owner']
+            self.doc_lengths = state['doc_lengths']
+            self.postings = state['postings']
+            self.total_length = state['total_length']
+            self.metadata = state['metadata']
+            self._rebuild_lookups()
+            self.dirty = False
+            self._stamp = stamp
+            logger.info(f"BM25 索引已加载: {len(self)} 个分块, {len(self.postings)} 个词")
+            return True
+
+    def reload_if_changed(self):
+        """磁盘文件被其他进程更新时重新加载（有未保存的修改时不覆盖）"""
+        stamp = self._file_stamp()
+        if stamp is not None and stamp != self._stamp and not self.dirty:
+            self.load()
+
+    @contextmanager
+    def update(self):
+        """
+        修改索引：持有进程间文件锁，先加载其他进程已保存的修改，正常结束时写回磁盘；
+        出错时丢弃内存中的修改，从磁盘重新加载
+        """
+        with self._lock, _file_lock(self.lock_path):
+            if self._file_stamp() != self._stamp:
+                self.load()
+            try:
+                yield self
+            except BaseException:
+                self.dirty = False
+                self.load()
+                raise
+            self.save()
+
+    def save(self):
+        """原子写入磁盘（必要时先压缩墓碑）；调用方需持有文件锁，见 update()"""
+        with self._lock:
+            if not self.dirty:
+                return
+            tombstones = len(self.doc_ids) - len(self)
+            if tombstones > max(64, len(self) // 4):
+                self._compact()
+
+            state = {
+                'version': INDEX_VERSION,
+                'doc_ids': self.doc_ids,
+                'doc_owner': self.doc_owner,
+                'doc_lengths': self.doc_lengths,
+                'postings': self.postings,
+                'total_length': self.total_length,
+                'metadata': self.metadata,
+            }
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._stamp = self._file_stamp()
+            self.dirty = False
+
+    def add(self, ids: List[str], texts: List[str], metadatas: List[Dict]):
+        """添加分块（同ID已存在时先删除旧内容）"""
+        with self._lock:
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                if chunk_id in self.id_map:
+                    self._remove(self.id_map[chunk_id])
+
+                internal = len(self.doc_ids)
+                owner = str(metadata.get('document_id', ''))
+                terms = Counter(tokenize(text))
+                length = sum(terms.values())
+
+                self.doc_ids.append(chunk_id)
+                self.doc_owner.append(owner)
+                self.doc_lengths.append(length)
+                self.total_length += length
+                self.id_map[chunk_id] = internal
+                self.by_document[owner].add(internal)
+                self.metadata.add(chunk_id, metadata)
+
+                for term, frequency in terms.items():
+                    posting = self.postings.get(term)
+                    if posting is None:
+                        posting = self.postings[term] = (array('I'), array('I'))
+                    posting[0].append(internal)
+                    posting[1].append(frequency)
+            self.dirty = True
+
+    def delete_document(self, document_id: str):
+        """删除某个文档的全部分块"""
+        with self._lock:
+            for internal in list(self.by_document.pop(str(document_id), ())):
+                self._remove(internal)
+            self.dirty = True
+
+    def _remove(self, internal: int):
+        chunk_id = self.doc_ids[internal]
+        if chunk_id is None:
+            return
+        self.id_map.pop(chunk_id, None)
+        self.metadata.remove(chunk_id)
+        owners = self.by_document.get(self.doc_owner[internal])
+        if owners is not None:
+            owners.discard(internal)
+        self.total_length -= self.doc_lengths[internal]
+        self.doc_lengths[internal] = 0
+        self.doc_ids[internal] = None
+
+    def _compact(self):
+        """去掉墓碑，重新编号"""
+        remap = {}
+        doc_ids, doc_owner, doc_lengths = [], [], array('I')
+        for internal, chunk_id in enumerate(self.doc_ids):
+            if chunk_id is not None:
+                remap[internal] = len(doc_ids)
+                doc_ids.append(chunk_id)
+                doc_owner.append(self.doc_owner[internal])
+                doc_lengths.append(self.doc_lengths[internal])
+
+        postings = {}
+        for term, (docs, frequencies) in self.postings.items():
+            new_docs, new_frequencies = array('I'), array('I')
+            for doc, frequency in zip(docs, frequencies):
+                if doc in remap:
+                    new_docs.append(remap[doc])
+                    new_frequencies.append(frequency)
+            if new_docs:
+                postings[term] = (new_docs, new_frequencies)
+
+        self.doc_ids, self.doc_owner, self.doc_lengths = doc_ids, doc_owner, doc_lengths
+        self.postings = postings
+        self._rebuild_lookups()
+
+    def resolve(self, filters: Dict[str, List[str]]) -> Optional[Set[str]]:
+        """将过滤条件解析为分块ID集合（无条件时为 None）"""
+        with self._lock:
+            ids = self.metadata.resolve(filters)
+            return None if ids is None else set(ids)
+
+    def search(self, query: str, top_k: int = 5,
+               allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """返回 [(分块ID, BM25 得分)]，按得分降序；allowed 不为 None 时只在这些分块中检索"""
+        with self._lock:
+            count = len(self)
+            if not count:
+                return []
+            average_length = self.total_length / count or 1.0
+            k1, b = self.k1, self.b
+
+            scores = defaultdict(float)
+            for term, query_frequency in Counter(tokenize(query)).items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    continue
+                docs, frequencies = posting
+                df = min(len(docs), count)
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                weight = query_frequency * idf * (k1 + 1)
+                for doc, frequency in zip(docs, frequencies):
+                    chunk_id = self.doc_ids[doc]
+                    if chunk_id is None or (allowed is not None and chunk_id not in allowed):
+                        continue
+                    norm = k1 * (1 - b + b * self.doc_lengths[doc] / average_length)
+                    scores[doc] += weight * frequency / (frequency + norm)
+
+            top = heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
+            return [(self.doc_ids[doc], score) for doc, score in top]
+
+    def rebuild(self, batches: Iterable[Tuple[List[str], List[str], List[Dict]]]):
+        """从 (ids, texts, metadatas) 批次完整重建"""
+        with self._lock, _file_lock(self.lock_path):
+            self._reset()
+            for ids, texts, metadatas in batches:
+                self.add(ids, texts, metadatas)
+            self.dirty = True
+            self.save()
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60,
+                           limit: Optional[int] = None) -> List[Tuple[str, float]]:
+    """倒数排名融合：score(d) = Σ 1 / (k + rank)，rank 从 1 开始"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] += 1.0 / (k + rank)
+    fused = sorted(scores.items(), key=itemgetter(1), reverse=True)
+    return fused[:limit] if limit else fused
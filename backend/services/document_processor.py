@@ -2,75 +2,153 @@
 文档处理服务 - 文本提取和分块
 """
 import os
+import re
+import mmap
+import codecs
+import hashlib
 import logging
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple, Callable
 from PyPDF2 import PdfReader
 from docx import Document as DocxDocument
 
+from services.text_chunker import TextChunker
+from services.text_cache import text_cache
+
 logger = logging.getLogger(__name__)
 
+# 字节序标记（UTF-32 必须先于 UTF-16 检查）
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+_NON_ASCII_RE = re.compile(rb'[\x80-\xff]')
+_CONTROL_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]')
+
+# 编码统计使用的样本大小，以及改用内存映射读取的文件大小阈值
+ENCODING_SAMPLE_SIZE = 16 * 1024
+MMAP_THRESHOLD = 4 * 1024 * 1024
+
 
 class DocumentProcessor:
     """文档处理器"""
     
+    @staticmethod
+    def compute_hash(file_path: str, block_size: int = 1024 * 1024) -> str:
+        """计算文件内容的 SHA-256，用于判断文档是否变化"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
     @staticmethod
     def extract_text(file_path: str) -> str:
-        """从文件中提取文本"""
+        """从文件中提取文本（结果写入提取文本缓存）"""
+        return "".join(DocumentProcessor.iter_text(file_path))
+    
+    @staticmethod
+    def iter_text(file_path: str, info: Optional[Dict] = None) -> Iterator[str]:
+        """
+        按片段流式产出文件文本：PDF 逐页产出，其余格式一次产出全文。
+        info 不为 None 时写入提取细节（如 TXT 的编码及置信度）。
+        启用提取文本缓存时，按文件内容哈希命中缓存则直接读取，否则边提取边写入缓存。
+        """
         ext = os.path.splitext(file_path)[1].lower()
+        if ext not in ('.pdf', '.docx', '.txt'):
+            raise ValueError(f"不支持的文件类型: {ext}")
         
+        if not text_cache.enabled:
+            yield from DocumentProcessor._iter_extracted(file_path, ext, info)
+            return
+        
+        content_hash = DocumentProcessor.compute_hash(file_path)
+        if text_cache.has(content_hash):
+            logger.info(f"命中提取文本缓存: {file_path}")
+            yield from text_cache.iter_pieces(content_hash, info)
+            return
+        
+        extracted_info = {} if info is None else info
+        with text_cache.writer(content_hash) as write:
+            for piece in DocumentProcessor._iter_extracted(file_path, ext, extracted_info):
+                write(piece)
+                yield piece
+            write.info = extracted_info
+    
+    @staticmethod
+    def _iter_extracted(file_path: str, ext: str, info: Optional[Dict]) -> Iterator[str]:
+        """解析原文件产出文本片段"""
         if ext == '.pdf':
-            return DocumentProcessor._extract_from_pdf(file_path)
-        elif ext == '.docx':
-            return DocumentProcessor._extract_from_docx(file_path)
+            for page_text in DocumentProcessor.iter_pdf_pages(file_path, info):
+                yield page_text + "\n"
         elif ext == '.txt':
-            return DocumentProcessor._extract_from_txt(file_path)
+            text, encoding, confidence = DocumentProcessor._read_txt(file_path)
+            if info is not None:
+                info['encoding'] = encoding
+                info['encoding_confidence'] = confidence
+            yield text
         else:
-            raise ValueError(f"不支持的文件类型: {ext}")
+            yield DocumentProcessor._extract_from_docx(file_path)
+    
+    @staticmethod
+    def iter_pdf_pages(file_path: str, info: Optional[Dict] = None) -> Iterator[str]:
+        """逐页产出PDF文本，只解析一次文件，按页决定是否回退到布局模式"""
+        with open(file_path, 'rb') as file:
+            pdf_reader = PdfReader(file)
+            num_pages = len(pdf_reader.pages)
+            logger.info(f"PDF文件共有 {num_pages} 页: {file_path}")
+            if info is not None:
+                info['pages'] = num_pages
+            
+            extracted_pages = 0
+            total_chars = 0
+            for i, page in enumerate(pdf_reader.pages):
+                page_text = DocumentProcessor._extract_pdf_page(page, i)
+                if page_text:
+                    extracted_pages += 1
+                    total_chars += len(page_text) + 1
+                    yield page_text
+            
+            if not extracted_pages:
+                logger.error(f"无法从PDF提取任何文本: {file_path}，可能是扫描版PDF或加密PDF")
+                raise ValueError(f"PDF文件无法提取文本，可能是扫描版（图片格式）或加密PDF: {file_path}")
+            
+            logger.info(f"成功从PDF提取 {extracted_pages}/{num_pages} 页，共 {total_chars} 个字符的文本")
+    
+    @staticmethod
+    def _extract_pdf_page(page, index: int) -> str:
+        """提取单页文本；普通模式为空时对该页尝试布局模式"""
+        try:
+            page_text = page.extract_text()
+        except Exception as e:
+            logger.warning(f"提取第 {index+1} 页文本时出错: {str(e)}")
+            page_text = ""
+        
+        if page_text and page_text.strip():
+            return page_text
+        
+        try:
+            page_text = page.extract_text(extraction_mode="layout")
+        except Exception as e:
+            logger.warning(f"使用布局模式提取第 {index+1} 页失败: {str(e)}")
+            page_text = ""
+        
+        if not page_text or not page_text.strip():
+            logger.warning(f"第 {index+1} 页无法提取文本（可能是扫描版PDF）")
+            return ""
+        return page_text
     
     @staticmethod
     def _extract_from_pdf(file_path: str) -> str:
         """从PDF提取文本，支持多种提取方法"""
-        text = ""
-        
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PdfReader(file)
-                num_pages = len(pdf_reader.pages)
-                logger.info(f"PDF文件共有 {num_pages} 页: {file_path}")
-                
-                for i, page in enumerate(pdf_reader.pages):
-                    try:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                        else:
-                            logger.warning(f"第 {i+1} 页无法提取文本（可能是扫描版PDF）")
-                    except Exception as e:
-                        logger.warning(f"提取第 {i+1} 页文本时出错: {str(e)}")
-                        continue
-                
-                # 如果提取的文本为空，尝试使用extract_text(extraction_mode="layout")
-                if not text.strip():
-                    logger.info("尝试使用布局模式提取PDF文本...")
-                    with open(file_path, 'rb') as file:
-                        pdf_reader = PdfReader(file)
-                        for i, page in enumerate(pdf_reader.pages):
-                            try:
-                                # 尝试使用不同的提取模式
-                                page_text = page.extract_text(extraction_mode="layout")
-                                if page_text:
-                                    text += page_text + "\n"
-                            except Exception as e:
-                                logger.warning(f"使用布局模式提取第 {i+1} 页失败: {str(e)}")
-                                continue
-                
-                if not text.strip():
-                    logger.error(f"无法从PDF提取任何文本: {file_path}，可能是扫描版PDF或加密PDF")
-                    raise ValueError(f"PDF文件无法提取文本，可能是扫描版（图片格式）或加密PDF: {file_path}")
-                
-                logger.info(f"成功从PDF提取 {len(text)} 个字符的文本")
-                return text
-                
+            return "".join(
+                page_text + "\n"
+                for page_text in DocumentProcessor.iter_pdf_pages(file_path)
+            )
         except Exception as e:
             logger.error(f"提取PDF文本失败: {file_path}, 错误: {str(e)}")
             raise
@@ -85,80 +163,205 @@ class DocumentProcessor:
     @staticmethod
     def _extract_from_txt(file_path: str) -> str:
         """从TXT文件读取文本，支持多种编码"""
-        # 尝试的编码列表（按优先级排序）
-        encodings = ['utf-8', 'gbk', 'gb2312', 'gb18030', 'big5', 'latin-1', 'cp1252']
-        
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as file:
-                    text = file.read()
-                    logger.info(f"成功使用 {encoding} 编码读取文件: {file_path}")
-                    return text
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                logger.warning(f"使用 {encoding} 编码读取文件失败: {str(e)}")
-                continue
-        
-        # 如果所有编码都失败，尝试使用错误处理策略
+        text, _, _ = DocumentProcessor._read_txt(file_path)
+        return text
+    
+    @staticmethod
+    def _read_txt(file_path: str) -> Tuple[str, str, float]:
+        """只读取一次文件（大文件使用内存映射），检测编码后整体解码，返回 (文本, 编码, 置信度)"""
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
-                text = file.read()
-                logger.warning(f"使用 UTF-8 编码（错误替换模式）读取文件: {file_path}")
-                return text
+            with open(file_path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size == 0:
+                    return "", 'utf-8', 1.0
+                
+                if size >= MMAP_THRESHOLD:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        encoding, confidence = DocumentProcessor.detect_encoding(data)
+                        text, encoding = DocumentProcessor._decode(memoryview(data), encoding)
+                else:
+                    data = file.read()
+                    encoding, confidence = DocumentProcessor.detect_encoding(data)
+                    text, encoding = DocumentProcessor._decode(data, encoding)
         except Exception as e:
-            raise ValueError(f"无法读取文件 {file_path}，所有编码尝试均失败: {str(e)}")
+            raise ValueError(f"无法读取文件 {file_path}: {str(e)}")
+        
+        if confidence < 0.5:
+            logger.warning(f"编码检测置信度较低 ({encoding}, {confidence}): {file_path}")
+        logger.info(f"使用 {encoding} 编码读取文件（置信度 {confidence}）: {file_path}")
+        return text, encoding, confidence
+    
+    @staticmethod
+    def _decode(data, encoding: str) -> Tuple[str, str]:
+        """整体解码；GBK 解码出现替换字符时（样本外有 GB18030 四字节字符）改用 GB18030"""
+        text = str(data, encoding, 'replace')
+        if encoding == 'gbk' and '\ufffd' in text:
+            text = str(data, 'gb18030', 'replace')
+            encoding = 'gb18030'
+        return text, encoding
     
     @staticmethod
-    def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """将文本分块"""
-        if len(text) <= chunk_size:
-            return [text]
+    def detect_encoding(data) -> Tuple[str, float]:
+        """
+        检测字节数据的编码，返回 (编码, 置信度)
         
-        chunks = []
-        start = 0
+        先检查 BOM；否则从第一个非 ASCII 字节处取样：能严格按 UTF-8 解码即为 UTF-8，
+        再按双字节编码的常用字区间分布在 GB18030 与 Big5 间打分，都不像时按单字节编码处理。
+        """
+        head = bytes(data[:4])
+        for bom, encoding in _BOMS:
+            if head.startswith(bom):
+                return encoding, 1.0
         
-        while start < len(text):
-            end = start + chunk_size
-            
-            # 如果不是最后一块，尝试在句子边界处分割
-            if end < len(text):
-                # 寻找最近的句号、问号或感叹号
-                for sep in ['\n\n', '。', '！', '？', '.', '!', '?', '\n']:
-                    last_sep = text.rfind(sep, start, end)
-                    if last_sep != -1:
-                        end = last_sep + 1
-                        break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
+        match = _NON_ASCII_RE.search(data)
+        if not match:
+            return 'utf-8', 1.0
+        
+        # 第一个非 ASCII 字节之前全是 ASCII，从这里取样不会截断多字节字符
+        start = match.start()
+        sample = bytes(data[start:start + ENCODING_SAMPLE_SIZE])
+        
+        try:
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+            return 'utf-8', 0.99
+        except UnicodeDecodeError:
+            pass
+        
+        scores = {
+            encoding: DocumentProcessor._double_byte_score(sample, encoding)
+            for encoding in ('gb18030', 'big5')
+        }
+        best = max(scores, key=scores.get)
+        if scores[best] >= 0.6:
+            confidence = round(scores[best], 3)
+            if best == 'gb18030':
+                # GBK 是 GB18030 的子集且解码更快，样本能按 GBK 严格解码时优先使用
+                try:
+                    codecs.getincrementaldecoder('gbk')().decode(sample, final=False)
+                    return 'gbk', confidence
+                except UnicodeDecodeError:
+                    pass
+            return best, confidence
+        
+        # 单字节编码：cp1252 未定义 0x81/0x8D/0x8F/0x90/0x9D，解码失败时退回 latin-1
+        try:
+            decoded = sample.decode('cp1252')
+            encoding = 'cp1252'
+        except UnicodeDecodeError:
+            decoded = sample.decode('latin-1')
+            encoding = 'latin-1'
+        controls = len(_CONTROL_RE.findall(decoded))
+        return encoding, round(1 - controls / len(decoded), 3)
+    
+    @staticmethod
+    def _double_byte_score(sample: bytes, encoding: str) -> float:
+        """
+        双字节编码打分：合法双字节序列中落在常用字区的比例
+        
+        GB2312 一级汉字（首字节 0xB0-0xD7）和全角标点（0xA1-0xA3）覆盖了简体文本的绝大部分；
+        Big5 常用字（首字节 0xA4-0xC6）和标点（0xA1-0xA3）覆盖了繁体文本的绝大部分。
+        """
+        pairs = 0
+        common = 0
+        i = 0
+        length = len(sample) - 1
+        while i < length:
+            lead = sample[i]
+            if lead < 0x80:
+                i += 1
+                continue
             
-            # 下一个块的起始位置（带重叠）
-            start = end - overlap if end < len(text) else end
+            trail = sample[i + 1]
+            pairs += 1
+            if encoding == 'gb18030':
+                if 0x30 <= trail <= 0x39:
+                    # GB18030 四字节序列，属于罕用字
+                    i += 4
+                    continue
+                valid = 0x81 <= lead <= 0xFE and 0x40 <= trail <= 0xFE and trail != 0x7F
+                is_common = (0xA1 <= lead <= 0xA3 or 0xB0 <= lead <= 0xD7) and 0xA1 <= trail <= 0xFE
+            else:
+                valid = 0x81 <= lead <= 0xFE and (0x40 <= trail <= 0x7E or 0xA1 <= trail <= 0xFE)
+                is_common = 0xA1 <= lead <= 0xC6 and valid
             
-        return chunks
+            if not valid:
+                i += 1
+                continue
+            if is_common:
+                common += 1
+            i += 2
+        
+        return common / pairs if pairs else 0.0
+    
+    @staticmethod
+    def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200,
+                   unit: str = 'char') -> List[str]:
+        """将文本分块（unit='token' 按 token 预算，'char' 按字符数）"""
+        return TextChunker(chunk_size, overlap, unit).split(text)
+    
+    @staticmethod
+    def chunk_stream(pieces: Iterable[str], chunk_size: int = 1000,
+                     overlap: int = 200, unit: str = 'char') -> Iterator[str]:
+        """
+        对流式文本片段（如PDF逐页文本）分块，结果与对拼接后的全文调用 chunk_text 一致。
+        缓冲区只保留尚未切出的尾部文本，内存占用与单页大小相当。
+        """
+        return TextChunker(chunk_size, overlap, unit).split_stream(pieces)
     
     @staticmethod
     def process_document(file_path: str, filename: str, chunk_size: int = 1000, 
-                        overlap: int = 200) -> List[Dict]:
-        """处理文档：提取文本并分块"""
-        # 提取文本
-        text = DocumentProcessor.extract_text(file_path)
+                        overlap: int = 200, unit: str = 'char',
+                        progress_callback: Optional[Callable[[int, Optional[int]], None]] = None
+                        ) -> List[Dict]:
+        """
+        处理文档：流式提取文本并分块
+        
+        progress_callback 在每个文本片段（PDF 每页）读完后回调 (已读片段数, 总页数或 None)
+        """
+        info = {}
+        pieces = DocumentProcessor.iter_text(file_path, info)
+        if progress_callback:
+            pieces = DocumentProcessor._track_pieces(pieces, info, progress_callback)
+        return DocumentProcessor._build_chunks(pieces, info, filename, chunk_size, overlap, unit)
+    
+    @staticmethod
+    def process_cached(content_hash: str, filename: str, chunk_size: int = 1000,
+                       overlap: int = 200, unit: str = 'char') -> List[Dict]:
+        """仅从提取文本缓存重新分块，不解析原文件"""
+        if not text_cache.has(content_hash):
+            raise ValueError(f"提取文本缓存不存在: {content_hash}")
         
-        # 分块
-        chunks = DocumentProcessor.chunk_text(text, chunk_size, overlap)
+        info = {}
+        pieces = text_cache.iter_pieces(content_hash, info)
+        return DocumentProcessor._build_chunks(pieces, info, filename, chunk_size, overlap, unit)
+    
+    @staticmethod
+    def _track_pieces(pieces: Iterable[str], info: Dict,
+                      callback: Callable[[int, Optional[int]], None]) -> Iterator[str]:
+        """逐片段回调进度"""
+        for done, piece in enumerate(pieces, 1):
+            yield piece
+            callback(done, info.get('pages'))
+    
+    @staticmethod
+    def _build_chunks(pieces: Iterable[str], info: Dict, filename: str, chunk_size: int,
+                      overlap: int, unit: str) -> List[Dict]:
+        """分块并构建元数据（info 在片段读完后才完整）"""
+        chunks = list(DocumentProcessor.chunk_stream(pieces, chunk_size, overlap, unit))
         
         # 构建元数据
+        file_type = os.path.splitext(filename)[1].lstrip('.').lower()
         documents = []
         for i, chunk in enumerate(chunks):
             documents.append({
                 'text': chunk,
                 'metadata': {
                     'filename': filename,
+                    'file_type': file_type,
                     'chunk_index': i,
                     'total_chunks': len(chunks),
-                    'source': 'document'
+                    'source': 'document',
+                    **info
                 }
             })
         
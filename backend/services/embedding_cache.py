@@ -0,0 +1,185 @@
+"""
+向量缓存 - 以 (嵌入模型, 规范化文本哈希) 为键，将 float32 向量持久化到 SQLite
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from typing import List, Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+# SQLite 单条语句的参数上限为 999，查询时按此分批
+_QUERY_BATCH = 500
+
+# 总字节数保存在 cache_meta 表中，由触发器在写入、删除的同一事务内维护
+_SIZE_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS embeddings_size_insert AFTER INSERT ON embeddings BEGIN
+           UPDATE cache_meta SET value = value + LENGTH(NEW.vector) WHERE key = 'total_bytes';
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS embeddings_size_delete AFTER DELETE ON embeddings BEGIN
+           UPDATE cache_meta SET value = value - LENGTH(OLD.vector) WHERE key = 'total_bytes';
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS embeddings_size_update AFTER UPDATE OF vector ON embeddings BEGIN
+           UPDATE cache_meta SET value = value + LENGTH(NEW.vector) - LENGTH(OLD.vector)
+           WHERE key = 'total_bytes';
+       END''',
+)
+
+
+class EmbeddingCache:
+    """
+    磁盘向量缓存，按最近使用时间淘汰，总大小不超过 max_bytes
+
+    服务器 worker 和导入脚本共享同一个数据库文件，总大小不能用进程内计数：
+    由触发器维护在 cache_meta 表的一行中，写入与淘汰在同一个写事务（BEGIN IMMEDIATE）内
+    读取它，所有进程看到同一个值，读取也无需扫描全表。
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """延迟打开数据库（调用方持有锁）"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.commit()
+
+            # 首次打开（或由旧版本创建的库）时统计一次已有条目，与建触发器放在同一事务内
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    "INSERT OR IGNORE INTO cache_meta (key, value) "
+                    "SELECT 'total_bytes', COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+                )
+                for trigger in _SIZE_TRIGGERS:
+                    conn.execute(trigger)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _total_bytes(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT value FROM cache_meta WHERE key = 'total_bytes'").fetchone()[0]
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """规范化空白后计算文本哈希"""
+        normalized = ' '.join(text.split())
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量读取向量，未命中的位置为 None"""
+        hashes = [self.text_hash(text) for text in texts]
+        found = {}
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(hashes), _QUERY_BATCH):
+                batch = list(set(hashes[start:start + _QUERY_BATCH]))
+                placeholders = ','.join('?' * len(batch))
+                rows = conn.execute(
+                    f'SELECT text_hash, vector FROM embeddings '
+                    f'WHERE model = ? AND text_hash IN ({placeholders})',
+                    [model, *batch]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+
+            if found:
+                conn.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?',
+                    [(now, model, text_hash) for text_hash in found]
+                )
+                conn.commit()
+
+            results = [found.get(text_hash) for text_hash in hashes]
+            hit_count = sum(1 for vector in results if vector is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """批量写入向量，超出容量时淘汰最久未使用的条目"""
+        now = time.time()
+        unique = {
+            self.text_hash(text): array('f', vector).tobytes()
+            for text, vector in zip(texts, vectors)
+        }
+        rows = [(model, text_hash, blob, now) for text_hash, blob in unique.items()]
+
+        with self._lock:
+            conn = self._connect()
+            # 写入、读取总大小和淘汰在同一个写事务内，多个进程同时写入时也不会超出容量
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # 不用 INSERT OR REPLACE：REPLACE 删除旧行时不触发 DELETE 触发器
+                conn.executemany(
+                    'INSERT INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (model, text_hash) DO UPDATE SET '
+                    'vector = excluded.vector, last_used = excluded.last_used',
+                    rows
+                )
+                total = self._total_bytes(conn)
+                if total > self.max_bytes:
+                    self._evict(conn, total)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def _evict(self, conn: sqlite3.Connection, total: int):
+        """按 last_used 从旧到新淘汰，直到低于容量的 90%（调用方持有锁并负责提交）"""
+        target = int(self.max_bytes * 0.9)
+        cursor = conn.execute(
+            'SELECT model, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used'
+        )
+        victims = []
+        for model, text_hash, size in cursor:
+            if total <= target:
+                break
+            victims.append((model, text_hash))
+            total -= size
+
+        conn.executemany('DELETE FROM embeddings WHERE model = ? AND text_hash = ?', victims)
+        logger.info(f"向量缓存淘汰 {len(victims)} 条，当前 {self._total_bytes(conn)} 字节")
+
+    def stats(self) -> Dict:
+        """缓存统计"""
+        with self._lock:
+            conn = self._connect()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes': self._total_bytes(conn),
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,80 @@
+"""
+索引版本 - 蓝绿重建时每个版本使用独立的向量集合（或 NumPy 目录）与 BM25 文件，
+当前生效版本、上一版本（用于回滚）以及各版本建立时的分片数记录在指针文件中
+"""
+import os
+import json
+import time
+from typing import Dict, Optional
+
+from config import Config
+
+
+def version_paths(version: int, shards: int = 1) -> Dict:
+    """
+    版本对应的存储位置
+
+    版本 0 即升级前的原始集合与文件，之后的版本在名称后加 _v{N}。
+    shards 大于 1 时后端在此基础上再按分片拆分（见 vector_backends.ShardedBackend）。
+    """
+    if not version:
+        return {
+            'version': 0,
+            'shards': shards,
+            'collection': Config.CHROMA_COLLECTION_NAME,
+            'numpy_dir': Config.NUMPY_STORE_DIR,
+            'bm25_path': Config.BM25_INDEX_PATH,
+        }
+    root, ext = os.path.splitext(Config.BM25_INDEX_PATH)
+    return {
+        'version': version,
+        'shards': shards,
+        'collection': f"{Config.CHROMA_COLLECTION_NAME}_v{version}",
+        'numpy_dir': f"{os.path.normpath(Config.NUMPY_STORE_DIR)}_v{version}",
+        'bm25_path': f"{root}_v{version}{ext}",
+    }
+
+
+def read_pointer(path: Optional[str] = None) -> Dict:
+    """读取指针文件；不存在时视为仍在使用版本 0。shards 为 {版本: 分片数}"""
+    path = path or Config.INDEX_POINTER_PATH
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        state = {}
+    return {
+        'active': int(state.get('active', 0)),
+        'previous': state.get('previous'),
+        'updated_at': state.get('updated_at'),
+        'shards': {int(version): count for version, count in state.get('shards', {}).items()},
+    }
+
+
+def shard_count(state: Dict, version: int) -> int:
+    """版本建立时的分片数；未记录的版本（引入分片之前建立）为 1"""
+    return state['shards'].get(version, 1)
+
+
+def write_pointer(active: int, previous: Optional[int], shards: Dict[int, int],
+                  path: Optional[str] = None):
+    """原子替换指针文件，其他进程按修改时间发现切换"""
+    path = path or Config.INDEX_POINTER_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({
+            'active': active,
+            'previous': previous,
+            'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'shards': {str(version): count for version, count in sorted(shards.items())},
+        }, file)
+    os.replace(tmp_path, path)
+
+
+def pointer_mtime(path: Optional[str] = None) -> Optional[int]:
+    """指针文件修改时间（纳秒）；不存在时为 None"""
+    try:
+        return os.stat(path or Config.INDEX_POINTER_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
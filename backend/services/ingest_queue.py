@@ -0,0 +1,228 @@
+"""
+后台导入队列 - 以 SQLite 中的 IngestJob 为队列，有界线程池处理文档提取、分块和向量写入
+"""
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from config import Config
+from database import db, Document, IngestJob
+from services.document_processor import document_processor
+from services.vector_store import vector_store, BatchWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    """
+    文档导入队列
+
+    任务状态保存在 ingest_jobs 表中；调度线程按空闲槽位认领 pending 任务
+    （条件 UPDATE 保证多进程下同一任务只被认领一次），交给有界线程池执行。
+    认领时记录本进程标识（主机名:pid），调度线程定期刷新本进程运行中任务的心跳；
+    心跳超过 INGEST_STALE_AFTER 未更新的 running 任务（所属进程已退出或卡死）才重新排队，
+    因此多个 worker 或单个 worker 重启时不会重复处理其他存活进程正在运行的任务。
+    写入失败时保留已写入的分块，Document.chunks_written 记录续传起点；
+    同一文档的下一个任务（重新排队或 /jobs/<id>/retry）从该处继续。
+    """
+
+    def __init__(self):
+        self.app = None
+        self.workers = Config.INGEST_WORKERS
+        self.executor = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = 0
+        self._started = False
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._last_heartbeat = 0.0
+
+    def init_app(self, app, workers: Optional[int] = None):
+        """绑定 Flask 应用（不立即启动线程，首次请求时再 start）"""
+        self.app = app
+        if workers:
+            self.workers = workers
+
+    def start(self):
+        """启动调度线程（幂等）"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started or self.app is None:
+                return
+            self._started = True
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ingest')
+        threading.Thread(target=self._dispatch_loop, name='ingest-dispatcher', daemon=True).start()
+        logger.info(f"导入队列已启动，工作线程数: {self.workers}")
+
+    def enqueue(self, document_id: int) -> IngestJob:
+        """为文档创建导入任务（需在应用上下文中调用）"""
+        job = IngestJob(document_id=document_id, status='pending')
+        db.session.add(job)
+        db.session.commit()
+        self._wakeup.set()
+        return job
+
+    def _dispatch_loop(self):
+        """按空闲槽位认领待处理任务"""
+        while True:
+            self._wakeup.wait(timeout=Config.INGEST_POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self._heartbeat()
+                self._dispatch()
+            except Exception as e:
+                logger.error(f"导入任务调度失败: {str(e)}")
+
+    def _heartbeat(self):
+        """刷新本进程运行中任务的心跳，并把心跳超时的任务重新排队（按 INGEST_HEARTBEAT_INTERVAL 限频）"""
+        if time.monotonic() - self._last_heartbeat < Config.INGEST_HEARTBEAT_INTERVAL:
+            return
+        self._last_heartbeat = time.monotonic()
+
+        with self.app.app_context():
+            try:
+                now = datetime.utcnow()
+                IngestJob.query.filter_by(status='running', owner=self.owner)\
+                    .update({'heartbeat_at': now})
+
+                # 旧版本写入的任务没有心跳，按开始时间判断
+                cutoff = now - timedelta(seconds=Config.INGEST_STALE_AFTER)
+                requeued = IngestJob.query\
+                    .filter(IngestJob.status == 'running')\
+                    .filter(db.func.coalesce(IngestJob.heartbeat_at, IngestJob.started_at) < cutoff)\
+                    .update({'status': 'pending', 'started_at': None, 'owner': None, 'heartbeat_at': None},
+                            synchronize_session=False)
+                db.session.commit()
+                if requeued:
+                    logger.info(f"重新排队 {requeued} 个心跳超时的导入任务")
+            finally:
+                db.session.remove()
+
+    def _dispatch(self):
+        with self.app.app_context():
+            try:
+                while True:
+                    with self._lock:
+                        if self._running >= self.workers:
+                            return
+
+                    job = IngestJob.query.filter_by(status='pending')\
+                        .order_by(IngestJob.id).first()
+                    if not job:
+                        return
+
+                    now = datetime.utcnow()
+                    claimed = IngestJob.query.filter_by(id=job.id, status='pending')\
+                        .update({'status': 'running', 'started_at': now,
+                                 'owner': self.owner, 'heartbeat_at': now})
+                    db.session.commit()
+                    if not claimed:
+                        continue
+
+                    with self._lock:
+                        self._running += 1
+                    self.executor.submit(self._run, job.id)
+            finally:
+                db.session.remove()
+
+    def _run(self, job_id: int):
+        """执行单个导入任务"""
+        try:
+            with self.app.app_context():
+                try:
+                    self._process(job_id)
+                finally:
+                    db.session.remove()
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._wakeup.set()
+
+    def _process(self, job_id: int):
+        job = IngestJob.query.get(job_id)
+        doc = Document.query.get(job.document_id)
+
+        try:
+            if not doc:
+                raise ValueError(f"文档不存在: {job.document_id}")
+
+            last_progress = [0.0]
+
+            def on_page(done, total):
+                # 逐页写库会与请求的写入争用 SQLite，按 INGEST_PROGRESS_INTERVAL 限频（最后一页总会写入）
+                job.pages_done = done
+                job.pages_total = total
+                now = time.monotonic()
+                if now - last_progress[0] >= Config.INGEST_PROGRESS_INTERVAL or done == total:
+                    last_progress[0] = now
+                    job.heartbeat_at = datetime.utcnow()
+                    db.session.commit()
+
+            chunks = document_processor.process_document(
+                file_path=doc.file_path,
+                filename=doc.filename,
+                chunk_size=Config.CHUNK_SIZE,
+                overlap=Config.CHUNK_OVERLAP,
+                unit=Config.CHUNK_UNIT,
+                progress_callback=on_page
+            )
+            # 续传：分块数与上次一致时跳过已连续写入的分块；否则（或从头开始时）先清理上次可能写入的分块
+            start = doc.chunks_written or 0
+            if start and doc.chunks_count != len(chunks):
+                start = 0
+            if not start:
+                vector_store.delete_by_document_id(str(doc.id))
+            doc.chunks_count = len(chunks)
+            doc.chunks_written = start
+            job.chunks_total = len(chunks)
+            job.chunks_embedded = start
+            db.session.commit()
+            if start:
+                logger.info(f"导入任务 {job_id} 从第 {start + 1} 个分块续传: {doc.filename}")
+
+            def on_batch(done, total):
+                job.chunks_embedded = start + done
+                job.heartbeat_at = datetime.utcnow()
+                db.session.commit()
+
+            if start < len(chunks) or not chunks:  # 没有分块时由 add_documents 报错
+                try:
+                    vector_store.add_documents(
+                        [chunk['text'] for chunk in chunks[start:]],
+                        [{**chunk['metadata'], 'document_id': str(doc.id)} for chunk in chunks[start:]],
+                        [f"doc_{doc.id}_chunk_{i}" for i in range(start, len(chunks))],
+                        progress_callback=on_batch
+                    )
+                except BatchWriteError as e:
+                    doc.chunks_written = start + e.report['resume_offset']
+                    db.session.commit()
+                    raise
+
+            doc.processed = True
+            doc.chunks_written = len(chunks)
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            logger.info(f"导入任务 {job_id} 完成: {doc.filename}, 分块数 {len(chunks)}")
+
+        except Exception as e:
+            db.session.rollback()
+            # 已写入的分块保留，chunks_embedded 记为续传起点
+            written = (doc.chunks_written or 0) if doc else 0
+            job.status = 'failed'
+            job.error = str(e)
+            job.chunks_embedded = written
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            logger.error(f"导入任务 {job_id} 失败（已写入 {written} 个分块，可重试续传）: {str(e)}")
+
+
+# 全局实例
+ingest_queue = IngestQueue()
@@ -0,0 +1,177 @@
+"""
+LLM 客户端层 - 每个服务商一个长连接池化的 HTTP 客户端，提供同步 / asyncio / 流式生成接口
+
+DeepSeek 与 OpenAI 都使用 OpenAI 兼容的 Chat Completions 协议，统一经 openai SDK 调用；
+SDK 的 HTTP 层替换为按服务商共享的 httpx 客户端，设置显式的连接 / 读取超时和连接池上限，
+同一进程内的所有请求复用已建立的 TLS 连接。
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 服务商 -> OpenAI 兼容接口地址
+DEFAULT_BASE_URLS = {
+    'openai': 'https://api.openai.com/v1',
+    'deepseek': 'https://api.deepseek.com',
+}
+
+
+def _usage_dict(usage) -> Dict:
+    """SDK 的 usage 对象（或字典）转换为 token 统计"""
+    if usage is None:
+        return {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+    get = usage.get if isinstance(usage, dict) else (lambda key, default=0: getattr(usage, key, default))
+    return {
+        'prompt_tokens': get('prompt_tokens', 0) or 0,
+        'completion_tokens': get('completion_tokens', 0) or 0,
+        'total_tokens': get('total_tokens', 0) or 0,
+    }
+
+
+class LLMClient:
+    """
+    单个服务商的客户端
+
+    同步请求共用一个 httpx.Client；异步请求按事件循环各持有一个 httpx.AsyncClient
+    （AsyncClient 的连接不能跨事件循环使用），循环被回收时随之释放。
+    """
+
+    def __init__(self, provider: str, api_key: str, base_url: Optional[str] = None,
+                 pool_size: int = 10, connect_timeout: float = 5, read_timeout: float = 60,
+                 max_retries: int = 2):
+        self.provider = provider
+        self.base_url = base_url or DEFAULT_BASE_URLS.get(provider)
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=60
+        )
+        self._http = httpx.Client(timeout=self.timeout, limits=self.limits)
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=self.base_url,
+            http_client=self._http,
+            max_retries=max_retries
+        )
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _async_client(self) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    http_client=httpx.AsyncClient(timeout=self.timeout, limits=self.limits),
+                    max_retries=self.max_retries
+                )
+                self._async_clients[loop] = client
+            return client
+
+    @staticmethod
+    def _result(response) -> Dict:
+        content = response.choices[0].message.content if response.choices else ""
+        return {
+            'content': content or "",
+            'model': getattr(response, 'model', None),
+            **_usage_dict(getattr(response, 'usage', None)),
+        }
+
+    def generate(self, messages: List[Dict], model: str, temperature: float = 0.7,
+                 max_tokens: int = 1000) -> Dict:
+        """
+        同步生成
+
+        Returns:
+            Dict: {'content', 'model', 'prompt_tokens', 'completion_tokens', 'total_tokens'}
+        """
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return self._result(response)
+
+    async def agenerate(self, messages: List[Dict], model: str, temperature: float = 0.7,
+                        max_tokens: int = 1000) -> Dict:
+        """asyncio 版本的 generate，返回值相同"""
+        response = await self._async_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return self._result(response)
+
+    def stream(self, messages: List[Dict], model: str, temperature: float = 0.7,
+               max_tokens: int = 1000) -> Iterator[Dict]:
+        """
+        流式生成
+
+        逐段产出 {'type': 'token', 'content': str}；服务商在流末尾附带用量时（如 DeepSeek）
+        最后产出 {'type': 'usage', 'prompt_tokens', 'completion_tokens', 'total_tokens'}。
+        提前关闭生成器会关闭底层响应，连接归还连接池。
+        """
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        usage = None
+        try:
+            for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield {'type': 'token', 'content': delta}
+        finally:
+            stream.response.close()
+        if usage is not None:
+            yield {'type': 'usage', **_usage_dict(usage)}
+
+    def close(self):
+        self._http.close()
+
+
+_clients: Dict[tuple, LLMClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client(provider: str, api_key: str, base_url: Optional[str] = None) -> LLMClient:
+    """按服务商（及密钥、地址）返回进程内共享的客户端，首次调用时创建"""
+    key = (provider, api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = LLMClient(
+                provider,
+                api_key,
+                base_url,
+                pool_size=Config.LLM_POOL_SIZE,
+                connect_timeout=Config.LLM_CONNECT_TIMEOUT,
+                read_timeout=Config.LLM_READ_TIMEOUT,
+                max_retries=Config.LLM_MAX_RETRIES
+            )
+            _clients[key] = client
+            logger.info(f"LLM 客户端已创建: {provider} ({client.base_url})，连接池上限 {Config.LLM_POOL_SIZE}")
+        return client
@@ -0,0 +1,126 @@
+"""
+分块元数据索引 - 将常用过滤条件（文档、文件名、文件类型、来源）解析为分块集合
+"""
+import os
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+
+# 支持过滤的元数据字段
+FILTER_FIELDS = ('document_id', 'filename', 'file_type', 'source')
+
+
+def normalize_filters(filters: Optional[Dict]) -> Dict[str, List[str]]:
+    """
+    校验并规范化过滤条件：{字段: 值或值列表} -> {字段: [字符串值, ...]}
+
+    同一字段内多个值为“或”，不同字段之间为“且”。
+    """
+    if not filters:
+        return {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters 必须是对象")
+
+    normalized = {}
+    for field, value in filters.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"不支持的过滤字段: {field}（可用: {', '.join(FILTER_FIELDS)}）")
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        values = sorted({str(item).lower() if field == 'file_type' else str(item) for item in values})
+        if not values:
+            raise ValueError(f"过滤字段 {field} 的值不能为空")
+        normalized[field] = values
+    return normalized
+
+
+def filters_key(filters: Dict[str, List[str]]) -> tuple:
+    """规范化过滤条件的可哈希形式，用作缓存键"""
+    return tuple((field, tuple(values)) for field, values in sorted(filters.items()))
+
+
+def to_chroma_where(filters: Dict[str, List[str]]) -> Optional[Dict]:
+    """翻译为 ChromaDB 的 where 子句"""
+    clauses = [
+        {field: values[0]} if len(values) == 1 else {field: {'$in': values}}
+        for field, values in sorted(filters.items())
+    ]
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def field_values(metadata: Dict) -> Dict[str, str]:
+    """从分块元数据中取出可过滤字段；旧数据缺少 file_type 时按文件名推断"""
+    values = {}
+    for field in FILTER_FIELDS:
+        value = metadata.get(field)
+        if value is None and field == 'file_type' and metadata.get('filename'):
+            value = os.path.splitext(metadata['filename'])[1].lstrip('.')
+        if value is not None and value != '':
+            values[field] = str(value).lower() if field == 'file_type' else str(value)
+    return values
+
+
+class MetadataIndex:
+    """
+    字段值 -> 键集合 的倒排表
+
+    键可以是分块ID，也可以是矩阵行号等任意可哈希值。
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(lambda: defaultdict(set))
+        self.entries = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, key: Hashable, metadata: Dict):
+        if key in self.entries:
+            self.remove(key)
+        values = field_values(metadata)
+        self.entries[key] = values
+        for field, value in values.items():
+            self.postings[field][value].add(key)
+
+    def add_many(self, keys: Iterable[Hashable], metadatas: Iterable[Dict]):
+        for key, metadata in zip(keys, metadatas):
+            self.add(key, metadata)
+
+    def remove(self, key: Hashable):
+        values = self.entries.pop(key, None)
+        if not values:
+            return
+        for field, value in values.items():
+            keys = self.postings[field].get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[field][value]
+
+    def resolve(self, filters: Dict[str, List[str]]) -> Optional[Set]:
+        """返回满足全部条件的键集合；没有过滤条件时返回 None（表示不限制）"""
+        if not filters:
+            return None
+        result = None
+        # 先处理命中最少的字段，尽早缩小交集
+        candidates = []
+        for field, values in filters.items():
+            keys = set()
+            for value in values:
+                keys |= self.postings[field].get(value, set())
+            candidates.append(keys)
+        for keys in sorted(candidates, key=len):
+            result = keys if result is None else result & keys
+            if not result:
+                return set()
+        return result
+
+    def __getstate__(self):
+        return {'entries': self.entries}
+
+    def __setstate__(self, state):
+        self.__init__()
+        for key, values in state['entries'].items():
+            self.entries[key] = values
+            for field, value in values.items():
+                self.postings[field][value].add(key)
@@ -3,10 +3,18 @@ RAG service - Retrieval Augmented Generation
 """
 
 import time
-from typing import List, Dict, Optional
+import logging
+from typing import List, Dict, Iterator, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import openai
-from openai import OpenAI
+from config import Config
+from services.llm_client import LLMClient, get_llm_client
+from services.response_cache import ResponseCache
+from services.text_chunker import truncate_tokens
+from services.tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are the HKU smart assistant, helping students with campus information and personal mailbox content."
 
 
 class RAGService:
@@ -22,41 +30,208 @@ class RAGService:
     ):
         self.provider = None
         self.model = openai_model
-        self.client = None
+        self.llm: Optional[LLMClient] = None
         self.deepseek_base_url = deepseek_base_url
+        self.temperature = 0.7
+        self.response_cache = None
+        if Config.RESPONSE_CACHE_ENABLED:
+            self.response_cache = ResponseCache(
+                Config.RESPONSE_CACHE_PATH,
+                Config.RESPONSE_CACHE_MAX_BYTES,
+                Config.RESPONSE_CACHE_TTL
+            )
 
         if deepseek_api_key:
             # 优先使用 DeepSeek
             self.provider = "deepseek"
             self.model = deepseek_model
-            self.client = OpenAI(
-                api_key=deepseek_api_key,
-                base_url=deepseek_base_url
-            )
+            self.llm = get_llm_client("deepseek", deepseek_api_key, deepseek_base_url)
         elif openai_api_key:
             # 回退到 OpenAI
             self.provider = "openai"
             self.model = openai_model
-            openai.api_key = openai_api_key
+            self.llm = get_llm_client("openai", openai_api_key)
         else:
             # 未配置任何模型
             self.provider = None
-            openai.api_key = None
     
-    def generate_answer(self, question: str, context: str) -> Dict:
-        """Generate answer via LLM"""
+    def _missing_key_result(self, start_time: float) -> Dict:
+        return {
+            'answer': "Sorry, no LLM API key is configured.",
+            'tokens_used': 0,
+            'response_time': time.time() - start_time,
+            'model': self.model,
+            'error': 'missing_api_key'
+        }
+    
+    def _answer_result(self, completion: Dict, start_time: float) -> Dict:
+        return {
+            'answer': completion['content'],
+            'tokens_used': completion['total_tokens'],
+            'prompt_tokens': completion['prompt_tokens'],
+            'response_time': time.time() - start_time,
+            'model': self.model,
+            'provider': self.provider
+        }
+    
+    def _cached_result(self, completion: Dict, start_time: float) -> Dict:
+        return {
+            'answer': completion['content'],
+            'tokens_used': 0,
+            'prompt_tokens': 0,
+            'saved_tokens': completion['total_tokens'],
+            'response_time': time.time() - start_time,
+            'model': self.model,
+            'provider': self.provider,
+            'cached': True,
+            'response_cached': True
+        }
+    
+    def _cache_key(self, messages: List[Dict], use_cache: bool) -> Optional[str]:
+        if not use_cache or self.response_cache is None:
+            return None
+        return ResponseCache.make_key(self.provider, self.model, self.temperature, messages)
+    
+    def _cache_get(self, key: Optional[str]) -> Optional[Dict]:
+        if key is None:
+            return None
+        try:
+            return self.response_cache.get(key)
+        except Exception as e:
+            logger.warning(f"Response cache read failed: {str(e)}")
+            return None
+    
+    def _cache_put(self, key: Optional[str], completion: Dict):
+        if key is None or not completion.get('content'):
+            return
+        try:
+            self.response_cache.put(key, completion)
+        except Exception as e:
+            logger.warning(f"Response cache write failed: {str(e)}")
+    
+    def _error_result(self, error: Exception, start_time: float) -> Dict:
+        return {
+            'answer': f"Sorry, failed to generate an answer: {str(error)}",
+            'tokens_used': 0,
+            'response_time': time.time() - start_time,
+            'model': self.model,
+            'error': str(error)
+        }
+    
+    def generate_answer(self, question: str, context: str, use_cache: bool = True) -> Dict:
+        """
+        Generate answer via LLM
+        
+        An identical request (provider, model, temperature and messages) is answered from
+        the response cache: 'cached' and 'response_cached' are set, tokens_used is 0 and
+        saved_tokens holds the original usage. use_cache=False neither reads nor writes the cache.
+        """
+        start_time = time.time()
+        
+        if not self.provider:
+            return self._missing_key_result(start_time)
+        
+        messages = self.build_messages(question, context)
+        key = self._cache_key(messages, use_cache)
+        cached = self._cache_get(key)
+        if cached:
+            return self._cached_result(cached, start_time)
+        
+        try:
+            completion = self.llm.generate(messages, model=self.model, temperature=self.temperature)
+        except Exception as e:
+            return self._error_result(e, start_time)
+        self._cache_put(key, completion)
+        return self._answer_result(completion, start_time)
+    
+    async def agenerate_answer(self, question: str, context: str, use_cache: bool = True) -> Dict:
+        """asyncio variant of generate_answer (same result shape)"""
+        start_time = time.time()
+        
+        if not self.provider:
+            return self._missing_key_result(start_time)
+        
+        messages = self.build_messages(question, context)
+        key = self._cache_key(messages, use_cache)
+        cached = self._cache_get(key)
+        if cached:
+            return self._cached_result(cached, start_time)
+        
+        try:
+            completion = await self.llm.agenerate(messages, model=self.model, temperature=self.temperature)
+        except Exception as e:
+            return self._error_result(e, start_time)
+        self._cache_put(key, completion)
+        return self._answer_result(completion, start_time)
+    
+    def stream_answer(self, question: str, context: str) -> Iterator[Dict]:
+        """
+        Stream the answer as the provider produces it
+        
+        Yields {'type': 'token', 'content': str} per delta, then a single
+        {'type': 'done', 'answer', 'tokens_used', 'prompt_tokens', 'response_time',
+        'time_to_first_token', 'model', 'provider'} event ('error' is set when generation failed).
+        Token counts come from the provider's usage chunk when it sends one,
+        otherwise it is counted locally from the prompt and the streamed answer.
+        Closing the generator early (client disconnected) closes the upstream stream.
+        """
         start_time = time.time()
         
         if not self.provider:
-            return {
-                'answer': "Sorry, no LLM API key is configured.",
-                'tokens_used': 0,
-                'response_time': time.time() - start_time,
-                'model': self.model,
-                'error': 'missing_api_key'
-            }
-        
-        # Build prompt
+            result = self._missing_key_result(start_time)
+            yield {'type': 'token', 'content': result['answer']}
+            yield {'type': 'done', 'time_to_first_token': None, 'provider': None, **result}
+            return
+        
+        messages = self.build_messages(question, context)
+        parts = []
+        usage = None
+        first_token_at = None
+        error = None
+        
+        try:
+            for event in self.llm.stream(messages, model=self.model, temperature=self.temperature):
+                if event['type'] == 'usage':
+                    usage = event
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.time()
+                parts.append(event['content'])
+                yield event
+        except Exception as e:
+            error = str(e)
+        
+        answer = "".join(parts)
+        if error and not parts:
+            answer = f"Sorry, failed to generate an answer: {error}"
+            yield {'type': 'token', 'content': answer}
+        
+        if usage is not None:
+            prompt_tokens = usage['prompt_tokens']
+            tokens_used = usage['total_tokens']
+        elif parts:
+            prompt_tokens = sum(count_tokens(message["content"]) for message in messages)
+            tokens_used = prompt_tokens + count_tokens(answer)
+        else:
+            prompt_tokens = tokens_used = 0
+        
+        done = {
+            'type': 'done',
+            'answer': answer,
+            'tokens_used': tokens_used,
+            'prompt_tokens': prompt_tokens,
+            'response_time': time.time() - start_time,
+            'time_to_first_token': first_token_at - start_time if first_token_at else None,
+            'model': self.model,
+            'provider': self.provider
+        }
+        if error:
+            done['error'] = error
+        yield done
+    
+    @staticmethod
+    def build_messages(question: str, context: str) -> List[Dict]:
+        """Chat messages for a question and its retrieved context"""
         prompt = f"""You are the HKU smart assistant.
 
 Primary goal:
@@ -76,55 +251,10 @@ Answer requirements:
 - If information conflicts, point it out and explain the reasoning you trust most.
 - Always respond in English."""
 
-        try:
-            # Call LLM provider
-            if self.provider == "deepseek":
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": "You are the HKU smart assistant, helping students with campus information and personal mailbox content."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=1000
-                )
-                answer = response.choices[0].message.content if response.choices else ""
-                usage = getattr(response, "usage", None)
-                if isinstance(usage, dict):
-                    tokens_used = usage.get("total_tokens", 0)
-                else:
-                    tokens_used = getattr(usage, "total_tokens", 0) if usage else 0
-            else:
-                response = openai.ChatCompletion.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": "You are the HKU smart assistant, helping students with campus information and personal mailbox content."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=1000
-                )
-                answer = response.choices[0].message.get("content", "") if response.choices else ""
-                tokens_used = getattr(response.usage, "total_tokens", 0)
-            
-            response_time = time.time() - start_time
-            
-            return {
-                'answer': answer,
-                'tokens_used': tokens_used,
-                'response_time': response_time,
-                'model': self.model,
-                'provider': self.provider
-            }
-            
-        except Exception as e:
-            return {
-                'answer': f"Sorry, failed to generate an answer: {str(e)}",
-                'tokens_used': 0,
-                'response_time': time.time() - start_time,
-                'model': self.model,
-                'error': str(e)
-            }
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
     
     @staticmethod
     def parallel_retrieve(knowledge_retriever, email_retriever, question: str) -> Dict:
@@ -154,32 +284,151 @@ Answer requirements:
         }
     
     @staticmethod
-    def build_context(knowledge_docs: List[Dict], email_docs: List[Dict]) -> str:
-        """Build context string"""
-        context_parts = []
+    def pack_context(knowledge_docs: List[Dict], email_docs: List[Dict],
+                     budget: Optional[int] = None) -> Tuple[str, Dict]:
+        """
+        Pack retrieved chunks and emails into a context string within a token budget
         
-        # Knowledge documents
-        if knowledge_docs:
-            context_parts.append("=== Knowledge Base ===")
-            for i, doc in enumerate(knowledge_docs[:3], 1):  # up to 3
-                text = doc.get('text', '')
-                source = doc.get('metadata', {}).get('filename', 'unknown')
-                context_parts.append(f"\n[Knowledge {i}] Source: {source}\n{text}")
+        Candidates are taken greedily in relevance order: knowledge chunks by retrieval
+        score, emails in the order the mailbox search returned them, alternating between
+        the two lists since their scores are not comparable. Each block (header included)
+        is added if it fits the remaining budget; otherwise it is cut at the last sentence
+        boundary that fits, or skipped if that leaves less than CONTEXT_MIN_TOKENS.
+        Text a chunk shares with an already packed neighbour from the same document
+        (the chunker's overlap) is dropped. Email bodies are capped at CONTEXT_EMAIL_MAX_TOKENS.
         
-        # Email content
-        if email_docs:
-            context_parts.append("\n\n=== Emails ===")
-            for i, email in enumerate(email_docs[:3], 1):  # up to 3
-                subject = email.get('subject', 'No Subject')
-                preview = email.get('preview', email.get('body', ''))[:300]
-                from_addr = email.get('from', 'Unknown Sender')
-                date = email.get('date', '')
-                context_parts.append(
-                    f"\n[Email {i}] Subject: {subject}\nFrom: {from_addr}\nDate: {date}\nContent: {preview}"
+        Returns:
+            tuple: (context, stats) with stats {'context_tokens', 'budget', 'knowledge_used',
+            'emails_used', 'truncated', 'overlap_tokens_removed'}
+        """
+        budget = Config.CONTEXT_TOKEN_BUDGET if budget is None else budget
+        stats = {
+            'context_tokens': 0,
+            'budget': budget,
+            'knowledge_used': 0,
+            'emails_used': 0,
+            'truncated': 0,
+            'overlap_tokens_removed': 0
+        }
+        
+        knowledge = sorted(knowledge_docs, key=_relevance)
+        emails = list(email_docs)
+        candidates = []
+        for i in range(max(len(knowledge), len(emails))):
+            if i < len(knowledge):
+                candidates.append(('knowledge', knowledge[i]))
+            if i < len(emails):
+                candidates.append(('email', emails[i]))
+        
+        packed_knowledge = []  # (header, text)
+        packed_emails = []
+        packed_chunks = {}     # (document_id, chunk_index) -> packed text
+        remaining = budget
+        
+        for kind, item in candidates:
+            if kind == 'knowledge':
+                metadata = item.get('metadata', {})
+                header = f"\n[Knowledge {len(packed_knowledge) + 1}] Source: {metadata.get('filename', 'unknown')}\n"
+                text = item.get('text', '')
+                position = _chunk_position(metadata)
+                if position is not None:
+                    original = text
+                    text = _drop_neighbour_overlap(text, position, packed_chunks)
+                    if text != original:
+                        stats['overlap_tokens_removed'] += count_tokens(original) - count_tokens(text)
+            else:
+                header = (
+                    f"\n[Email {len(packed_emails) + 1}] Subject: {item.get('subject', 'No Subject')}\n"
+                    f"From: {item.get('from', 'Unknown Sender')}\nDate: {item.get('date', '')}\nContent: "
                 )
+                text = item.get('preview', item.get('body', ''))
+                text = truncate_tokens(text, Config.CONTEXT_EMAIL_MAX_TOKENS) if text else text
+            
+            if not text.strip():
+                continue
+            
+            # +1 for the newline joining blocks
+            header_tokens = count_tokens(header) + 1
+            text_tokens = count_tokens(text)
+            if header_tokens + text_tokens > remaining:
+                room = remaining - header_tokens
+                if room < Config.CONTEXT_MIN_TOKENS:
+                    continue
+                text = truncate_tokens(text, room)
+                text_tokens = count_tokens(text)
+                if text_tokens < Config.CONTEXT_MIN_TOKENS:
+                    continue
+                stats['truncated'] += 1
+            
+            remaining -= header_tokens + text_tokens
+            if kind == 'knowledge':
+                packed_knowledge.append(header + text)
+                if position is not None:
+                    packed_chunks[position] = text
+            else:
+                packed_emails.append(header + text)
+        
+        context_parts = []
+        if packed_knowledge:
+            context_parts.append("=== Knowledge Base ===")
+            context_parts.extend(packed_knowledge)
+        if packed_emails:
+            context_parts.append("\n\n=== Emails ===")
+            context_parts.extend(packed_emails)
         
         if not context_parts:
-            return "No relevant context found."
+            context = "No relevant context found."
+        else:
+            context = "\n".join(context_parts)
         
-        return "\n".join(context_parts)
+        stats['context_tokens'] = count_tokens(context)
+        stats['knowledge_used'] = len(packed_knowledge)
+        stats['emails_used'] = len(packed_emails)
+        return context, stats
+    
+    @staticmethod
+    def build_context(knowledge_docs: List[Dict], email_docs: List[Dict]) -> str:
+        """Build context string (see pack_context)"""
+        return RAGService.pack_context(knowledge_docs, email_docs)[0]
+
+
+def _relevance(doc: Dict) -> tuple:
+    """Sort key, most relevant first: fused / BM25 score when present, otherwise vector distance"""
+    if doc.get('score') is not None:
+        return (0, -doc['score'])
+    if doc.get('distance') is not None:
+        return (1, doc['distance'])
+    return (2, 0)
+
+
+def _chunk_position(metadata: Dict) -> Optional[tuple]:
+    if metadata.get('document_id') is None or metadata.get('chunk_index') is None:
+        return None
+    return str(metadata['document_id']), int(metadata['chunk_index'])
+
+
+def _overlap(head: str, tail: str, min_chars: int = 16) -> int:
+    """Length of the longest suffix of head that is also a prefix of tail (0 if shorter than min_chars)"""
+    probe = tail[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    position = head.find(probe)
+    while position != -1:
+        if tail.startswith(head[position:]):
+            return len(head) - position
+        position = head.find(probe, position + 1)
+    return 0
+
 
+def _drop_neighbour_overlap(text: str, position: tuple, packed_chunks: Dict[tuple, str]) -> str:
+    """Remove the text a chunk shares with the packed chunks just before and after it"""
+    document_id, index = position
+    previous = packed_chunks.get((document_id, index - 1))
+    if previous:
+        text = text[_overlap(previous, text):].lstrip()
+    following = packed_chunks.get((document_id, index + 1))
+    if following:
+        cut = _overlap(text, following)
+        if cut:
+            text = text[:len(text) - cut].rstrip()
+    return text
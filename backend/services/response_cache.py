@@ -0,0 +1,189 @@
+"""
+LLM 响应缓存 - 以 (服务商, 模型, temperature, 完整消息列表) 的哈希为键，将生成结果持久化到 SQLite
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import List, Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+# 总字节数保存在 cache_meta 表中，由触发器在写入、删除的同一事务内维护
+_SIZE_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS responses_size_insert AFTER INSERT ON responses BEGIN
+           UPDATE cache_meta SET value = value + LENGTH(CAST(NEW.response AS BLOB))
+           WHERE key = 'total_bytes';
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS responses_size_delete AFTER DELETE ON responses BEGIN
+           UPDATE cache_meta SET value = value - LENGTH(CAST(OLD.response AS BLOB))
+           WHERE key = 'total_bytes';
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS responses_size_update AFTER UPDATE OF response ON responses BEGIN
+           UPDATE cache_meta SET value = value
+               + LENGTH(CAST(NEW.response AS BLOB)) - LENGTH(CAST(OLD.response AS BLOB))
+           WHERE key = 'total_bytes';
+       END''',
+)
+
+
+class ResponseCache:
+    """
+    磁盘响应缓存（精确匹配）
+
+    提示词完全相同（同一问题、同样的上下文、同一模型和参数）时直接返回上次的生成结果。
+    条目超过 ttl 秒后失效；总大小超过 max_bytes 时按最近使用时间淘汰。
+    多个进程共享同一个数据库文件，总大小不能用进程内计数：由触发器维护在 cache_meta 表的
+    一行中，写入与淘汰在同一个写事务（BEGIN IMMEDIATE）内读取它，无需每次扫描全表。
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: float = 86400):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """延迟打开数据库（调用方持有锁）"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_responses_last_used ON responses (last_used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.commit()
+
+            # 首次打开（或由旧版本创建的库）时统计一次已有条目，与建触发器放在同一事务内
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    "INSERT OR IGNORE INTO cache_meta (key, value) "
+                    "SELECT 'total_bytes', COALESCE(SUM(LENGTH(CAST(response AS BLOB))), 0) FROM responses"
+                )
+                for trigger in _SIZE_TRIGGERS:
+                    conn.execute(trigger)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _total_bytes(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT value FROM cache_meta WHERE key = 'total_bytes'").fetchone()[0]
+
+    @staticmethod
+    def make_key(provider: str, model: str, temperature: float, messages: List[Dict]) -> str:
+        """请求参数的哈希"""
+        payload = json.dumps(
+            [provider, model, temperature, messages],
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(',', ':')
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取缓存的生成结果，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT response, created_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl and row[1] + self.ttl < now:
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (now, key))
+            conn.commit()
+            response = json.loads(row[0])
+            self.hits += 1
+            self.saved_tokens += response.get('total_tokens') or 0
+            return response
+
+    def put(self, key: str, response: Dict):
+        """写入生成结果，超出容量时淘汰最久未使用的条目"""
+        now = time.time()
+        data = json.dumps(response, ensure_ascii=False)
+
+        with self._lock:
+            conn = self._connect()
+            # 写入、读取总大小和淘汰在同一个写事务内，多个进程同时写入时也不会超出容量
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # 不用 INSERT OR REPLACE：REPLACE 删除旧行时不触发 DELETE 触发器
+                conn.execute(
+                    'INSERT INTO responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (key) DO UPDATE SET response = excluded.response, '
+                    'created_at = excluded.created_at, last_used = excluded.last_used',
+                    (key, data, now, now)
+                )
+                if self._total_bytes(conn) > self.max_bytes:
+                    self._evict(conn)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def _evict(self, conn: sqlite3.Connection):
+        """先删除过期条目，再按 last_used 从旧到新淘汰，直到低于容量的 90%（调用方持有锁并负责提交）"""
+        if self.ttl:
+            conn.execute('DELETE FROM responses WHERE created_at < ?', (time.time() - self.ttl,))
+
+        total = self._total_bytes(conn)
+        target = int(self.max_bytes * 0.9)
+        cursor = conn.execute(
+            'SELECT key, LENGTH(CAST(response AS BLOB)) FROM responses ORDER BY last_used'
+        )
+        victims = []
+        for key, size in cursor:
+            if total <= target:
+                break
+            victims.append((key,))
+            total -= size
+
+        conn.executemany('DELETE FROM responses WHERE key = ?', victims)
+        logger.info(f"响应缓存淘汰 {len(victims)} 条，当前 {self._total_bytes(conn)} 字节")
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 4) if lookups else 0.0
+
+    def stats(self) -> Dict:
+        """缓存统计"""
+        with self._lock:
+            conn = self._connect()
+            return {
+                'entries': conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0],
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate(),
+                'saved_tokens': self.saved_tokens,
+                'bytes': self._total_bytes(conn),
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl
+            }
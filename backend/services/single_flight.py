@@ -0,0 +1,94 @@
+"""
+请求合并（single-flight）- 相同的请求同时到达时只执行一次，其余请求等待并共享结果
+"""
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_question(question: str) -> str:
+    """合并键使用的问题文本：去首尾空白、合并连续空白、忽略大小写"""
+    return _SPACE_RE.sub(' ', question.strip()).casefold()
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    按键合并进行中的调用
+
+    同一个键第一个到达的请求（leader）执行函数，执行期间到达的请求等待其完成后
+    拿到同一个结果对象（或同一个异常）；执行结束即移除该键，之后的请求重新执行。
+    共享的结果会被多个请求同时读取，调用方不应原地修改。
+    键为元组，首个元素作为统计分类（如 'retrieve'、'generate'）。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = Counter()
+        self.shared = Counter()
+
+    def do(self, key: Tuple[Hashable, ...], fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行或等待
+
+        Returns:
+            tuple: (结果, 是否为共享的结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed[key[0]] += 1
+            else:
+                call.waiters += 1
+                self.shared[key[0]] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+    def stats(self) -> Dict:
+        """按分类统计执行次数与共享次数"""
+        with self._lock:
+            kinds = set(self.executed) | set(self.shared)
+            return {
+                'in_flight': len(self._calls),
+                **{
+                    kind: {
+                        'executed': self.executed[kind],
+                        'shared': self.shared[kind],
+                    }
+                    for kind in sorted(kinds)
+                },
+            }
+
+
+# 全局实例
+single_flight = SingleFlight()
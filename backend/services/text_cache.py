@@ -0,0 +1,80 @@
+"""
+提取文本缓存 - 按文件内容哈希保存 gzip 压缩的纯文本，重新分块时无需再次解析 PDF/DOCX
+"""
+import os
+import gzip
+import json
+import uuid
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TextCache:
+    """
+    提取文本缓存
+
+    每个文件一份 <hash>.jsonl.gz：每行一个 JSON 对象，{"text": ...} 为一个文本片段
+    （PDF 一页），最后一行 {"info": {...}} 为提取细节。写入先落到临时文件，完整后再原子替换。
+    """
+
+    def __init__(self, directory: str, enabled: bool = True):
+        self.directory = directory
+        self.enabled = enabled
+
+    def path_for(self, content_hash: str) -> str:
+        """缓存文件路径（按哈希前两位分目录）"""
+        return os.path.join(self.directory, content_hash[:2], f"{content_hash}.jsonl.gz")
+
+    def has(self, content_hash: Optional[str]) -> bool:
+        """是否已缓存"""
+        return bool(self.enabled and content_hash and os.path.exists(self.path_for(content_hash)))
+
+    def iter_pieces(self, content_hash: str, info: Optional[Dict] = None) -> Iterator[str]:
+        """流式读取缓存的文本片段，info 不为 None 时写入缓存的提取细节"""
+        with gzip.open(self.path_for(content_hash), 'rt', encoding='utf-8') as file:
+            for line in file:
+                record = json.loads(line)
+                if 'text' in record:
+                    yield record['text']
+                elif info is not None:
+                    info.update(record.get('info', {}))
+
+    @contextmanager
+    def writer(self, content_hash: str):
+        """
+        写入缓存的上下文管理器
+
+        用法: with cache.writer(h) as write: write(piece) ...; write.info = {...}
+        中途异常（包括生成器被提前关闭）时丢弃临时文件。
+        """
+        path = self.path_for(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+
+        file = gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6)
+
+        def write(piece: str):
+            file.write(json.dumps({'text': piece}, ensure_ascii=False))
+            file.write('\n')
+
+        write.info = {}
+        try:
+            yield write
+            file.write(json.dumps({'info': write.info}, ensure_ascii=False))
+            file.write('\n')
+            file.close()
+            os.replace(tmp_path, path)
+        except BaseException:
+            file.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+# 全局实例
+text_cache = TextCache(Config.TEXT_CACHE_DIR, enabled=Config.TEXT_CACHE_ENABLED)
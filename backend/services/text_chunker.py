@@ -0,0 +1,213 @@
+"""
+文本分块引擎 - 一次扫描建立段落/句子边界索引，按 token（或字符）预算线性切分
+"""
+import re
+from typing import List, Tuple, Iterable, Iterator
+
+from .tokenizer import count_tokens
+
+# 边界强度：段落 > 句子 > 换行
+PARAGRAPH = 3
+SENTENCE = 2
+LINE = 1
+NONE = 0
+
+# 单次扫描识别所有边界；英文句点要求后跟空白，避免切开 3.5、e.g. 之类
+_BOUNDARY_RE = re.compile(
+    r'(?P<paragraph>\n[ \t\r\f\v]*\n\s*)'
+    r'|(?P<sentence>[。！？]+[”’」』）]*|[.!?]+["\')\]”’]*(?=\s|$))'
+    r'|(?P<line>\n)'
+)
+
+_LEVELS = {'paragraph': PARAGRAPH, 'sentence': SENTENCE, 'line': LINE}
+
+# 流式切分时，缓冲区至少积累这么多字符才尝试切分
+MIN_STREAM_BUFFER = 8192
+
+
+class TextChunker:
+    """
+    线性时间分块器
+
+    文本先按边界切成片段并计算每段大小的前缀和，再用双指针贪心地装填预算：
+    窗口后半段内优先选择最强的边界作为切分点，重叠部分按整段回退。
+    unit='token' 时按 token 计数（各片段 token 数之和近似整块 token 数），
+    unit='char' 时按字符数，兼容旧的 CHUNK_SIZE 配置。
+    """
+
+    def __init__(self, chunk_size: int = 300, overlap: int = 50, unit: str = 'token'):
+        if unit not in ('token', 'char'):
+            raise ValueError(f"不支持的分块单位: {unit}")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size 必须大于 0")
+
+        self.chunk_size = chunk_size
+        self.overlap = max(0, overlap)
+        self.unit = unit
+
+    def measure(self, text: str) -> int:
+        """按当前单位计算文本大小"""
+        if self.unit == 'char':
+            return len(text)
+        return count_tokens(text)
+
+    def split(self, text: str) -> List[str]:
+        """将整段文本分块"""
+        spans, _ = self._spans(text, final=True)
+        return [chunk for chunk in (text[start:end].strip() for start, end in spans) if chunk]
+
+    def split_stream(self, pieces: Iterable[str]) -> Iterator[str]:
+        """
+        对流式文本片段分块，结果与对拼接后的全文调用 split 一致。
+        缓冲区只保留尚未确定切分的尾部文本。
+        """
+        buffer = ""
+        threshold = MIN_STREAM_BUFFER
+
+        for piece in pieces:
+            buffer += piece
+            if len(buffer) < threshold:
+                continue
+
+            spans, consumed = self._spans(buffer, final=False)
+            for start, end in spans:
+                chunk = buffer[start:end].strip()
+                if chunk:
+                    yield chunk
+            buffer = buffer[consumed:]
+            threshold = max(MIN_STREAM_BUFFER, 2 * len(buffer))
+
+        for chunk in self.split(buffer):
+            yield chunk
+
+    def _segments(self, text: str) -> Tuple[List[int], List[int]]:
+        """一次扫描得到各片段的结束位置及其结尾边界的强度"""
+        ends = []
+        levels = []
+        for match in _BOUNDARY_RE.finditer(text):
+            ends.append(match.end())
+            levels.append(_LEVELS[match.lastgroup])
+
+        if not ends or ends[-1] < len(text):
+            ends.append(len(text))
+            levels.append(NONE)
+        return ends, levels
+
+    def _spans(self, text: str, final: bool) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        计算分块区间
+
+        final=False 时文本末尾可能还有后续内容：最后一个片段尚不稳定，
+        一旦窗口触及文本末尾就停止，并返回已确定部分的结束位置。
+        """
+        if not text:
+            return [], 0
+
+        ends, levels = self._segments(text)
+        starts = [0] + ends[:-1]
+        n = len(ends)
+
+        prefix = [0]
+        for start, end in zip(starts, ends):
+            prefix.append(prefix[-1] + self.measure(text[start:end]))
+
+        budget = self.chunk_size
+        half = budget / 2
+        spans = []
+        i = 0
+        j = 0
+
+        while i < n:
+            # 双指针：片段 i..j-1 能装入预算
+            if j < i:
+                j = i
+            while j < n and prefix[j + 1] - prefix[i] <= budget:
+                j += 1
+
+            if j == n:
+                if not final:
+                    break
+                spans.append((starts[i], ends[n - 1]))
+                i = n
+                break
+
+            if j == i:
+                # 单个片段超出预算，只能在片段内部硬切
+                if not final and i == n - 1:
+                    break
+                spans.extend(self._hard_split(text, starts[i], ends[i], prefix[i + 1] - prefix[i]))
+                i += 1
+                continue
+
+            # 在窗口后半段内选择最靠后的最强边界
+            best = j
+            best_level = levels[j - 1]
+            for k in range(j - 1, i, -1):
+                if prefix[k] - prefix[i] < half:
+                    break
+                if levels[k - 1] > best_level:
+                    best, best_level = k, levels[k - 1]
+
+            spans.append((starts[i], ends[best - 1]))
+
+            # 按整段回退形成重叠，且保证向前推进
+            m = best
+            while m - 1 > i and prefix[best] - prefix[m - 1] <= self.overlap:
+                m -= 1
+            i = m
+
+        consumed = starts[i] if i < n else len(text)
+        return spans, consumed
+
+    def _hard_split(self, text: str, start: int, end: int, size: int) -> List[Tuple[int, int]]:
+        """将超出预算的单个片段按近似字符窗口切开，尽量落在空格处"""
+        length = end - start
+        if self.unit == 'char' or size <= 0:
+            window = self.chunk_size
+            back = self.overlap
+        else:
+            chars_per_unit = length / size
+            window = max(1, int(self.chunk_size * chars_per_unit))
+            back = int(self.overlap * chars_per_unit)
+
+        spans = []
+        pos = start
+        while pos < end:
+            cut = min(pos + window, end)
+            if cut < end:
+                space = text.rfind(' ', pos + window // 2, cut)
+                if space != -1:
+                    cut = space + 1
+            spans.append((pos, cut))
+            if cut >= end:
+                break
+            next_pos = cut - back
+            pos = next_pos if next_pos > pos else cut
+        return spans
+
+
+def truncate_tokens(text: str, max_tokens: int, min_level: int = SENTENCE) -> str:
+    """
+    截取不超过 max_tokens 的最长前缀，且结尾落在强度不低于 min_level 的边界上
+    （默认句子或段落）。全文不超出预算时原样返回；没有满足条件的前缀时返回空串。
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    candidates = []
+    total = 0
+    start = 0
+    for match in _BOUNDARY_RE.finditer(text):
+        total += count_tokens(text[start:match.end()])
+        if total > max_tokens:
+            break
+        start = match.end()
+        if _LEVELS[match.lastgroup] >= min_level:
+            candidates.append(start)
+
+    # 片段 token 数之和只是近似，按实际计数从最长的候选往回找
+    for end in reversed(candidates):
+        prefix = text[:end].strip()
+        if count_tokens(prefix) <= max_tokens:
+            return prefix
+    return ""
@@ -0,0 +1,50 @@
+"""
+Token 计数工具 - 优先使用 tiktoken，未安装或编码表不可用时按字符估算
+"""
+import re
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # 可选依赖
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# 与 DeepSeek / OpenAI 对话模型接近的 BPE 编码
+TOKEN_ENCODING = 'cl100k_base'
+
+# 中日韩字符（含全角标点），估算时每个字符计为一个 token
+_CJK_RE = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """加载 tiktoken 编码表（只加载一次）"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        logger.warning(f"加载 tiktoken 编码 {TOKEN_ENCODING} 失败，改用字符估算: {str(e)}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """统计文本的 token 数"""
+    if not text:
+        return 0
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    # 估算：CJK 字符约 1 token/字，其余约 4 字符/token
+    cjk_chars = len(_CJK_RE.findall(text))
+    return cjk_chars + (len(text) - cjk_chars + 3) // 4
+
+
+def is_exact() -> bool:
+    """当前是否使用真实的分词器计数"""
+    return _get_encoding() is not None
@@ -0,0 +1,736 @@
+"""
+向量存储后端 - VectorStore 通过统一接口访问 ChromaDB 或本地 NumPy 内存映射矩阵
+"""
+import os
+import json
+import uuid
+import zlib
+import heapq
+import shutil
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import chromadb
+from chromadb.config import Settings
+
+from services.metadata_index import MetadataIndex, to_chroma_where
+
+logger = logging.getLogger(__name__)
+
+# SQLite 单条语句的参数上限较低，IN 查询按此分组
+_SQL_BATCH = 500
+
+
+class VectorBackend(ABC):
+    """
+    后端接口
+
+    query 返回与输入向量一一对应的结果列表，每项为
+    {'id', 'text', 'metadata', 'distance'}；distance 越小越相似。
+    filters 为 normalize_filters 规范化后的过滤条件，须在相似度排序之前生效。
+    未实现全部抽象方法的子类在实例化时即报错。
+    """
+
+    name = 'base'
+
+    @abstractmethod
+    def add(self, ids: List[str], texts: List[str], metadatas: List[Dict],
+            embeddings: List[List[float]]):
+        """写入分块（同ID已存在时替换）"""
+
+    @abstractmethod
+    def query(self, embeddings: List[List[float]], top_k: int,
+              filters: Optional[Dict[str, List[str]]] = None) -> List[List[Dict]]:
+        """向量检索"""
+
+    @abstractmethod
+    def get(self, ids: List[str]) -> List[Dict]:
+        """按ID取回分块 [{'id', 'text', 'metadata'}]，不存在的ID忽略"""
+
+    @abstractmethod
+    def iter_batches(self, page_size: int = 1000) -> Iterator[Tuple[List[str], List[str], List[Dict]]]:
+        """分页遍历全部分块 (ids, texts, metadatas)"""
+
+    @abstractmethod
+    def delete_document(self, document_id: str):
+        """删除某个文档的全部分块"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """分块总数"""
+
+    @abstractmethod
+    def drop(self):
+        """删除后端的全部持久化数据（蓝绿重建淘汰旧版本时使用），之后实例不可再用"""
+
+    def stats(self) -> Dict:
+        return {'backend': self.name, 'count': self.count()}
+
+
+class ChromaBackend(VectorBackend):
+    """ChromaDB 持久化集合"""
+
+    name = 'chroma'
+
+    def __init__(self, persist_dir: str, collection_name: str, embedding_function):
+        # ChromaDB 0.4.22 使用 PersistentClient 支持持久化存储
+        try:
+            self.client = chromadb.PersistentClient(path=persist_dir)
+        except (AttributeError, TypeError):
+            # 如果 PersistentClient 不存在或参数不匹配，尝试使用 Client + Settings
+            self.client = chromadb.Client(Settings(
+                persist_directory=persist_dir,
+                anonymized_telemetry=False
+            ))
+
+        self.collection_name = collection_name
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name,
+            metadata={"description": "HKU 知识库"},
+            embedding_function=embedding_function
+        )
+
+    def add(self, ids, texts, metadatas, embeddings):
+        # upsert：同ID重复写入视为替换（与 NumPy 后端一致），续传时可以重写已写入的批次
+        self.collection.upsert(
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=metadatas,
+            ids=ids
+        )
+
+    def query(self, embeddings, top_k, filters=None):
+        response = self.collection.query(
+            query_embeddings=embeddings,
+            n_results=top_k,
+            where=to_chroma_where(filters or {})
+        )
+        return [self._format_results(response, index) for index in range(len(embeddings))]
+
+    @staticmethod
+    def _format_results(results: Dict, index: int) -> List[Dict]:
+        """格式化第 index 个查询的检索结果"""
+        documents = []
+        if results['documents'] and len(results['documents']) > index:
+            for i, doc in enumerate(results['documents'][index]):
+                documents.append({
+                    'id': results['ids'][index][i],
+                    'text': doc,
+                    'metadata': results['metadatas'][index][i] if results['metadatas'] else {},
+                    'distance': results['distances'][index][i] if results['distances'] else 0
+                })
+        return documents
+
+    def get(self, ids):
+        fetched = self.collection.get(ids=ids, include=['documents', 'metadatas'])
+        return [
+            {
+                'id': chunk_id,
+                'text': fetched['documents'][i],
+                'metadata': fetched['metadatas'][i] if fetched['metadatas'] else {}
+            }
+            for i, chunk_id in enumerate(fetched['ids'])
+        ]
+
+    def iter_batches(self, page_size=1000):
+        offset = 0
+        while True:
+            page = self.collection.get(
+                include=['documents', 'metadatas'], limit=page_size, offset=offset
+            )
+            if not page['ids']:
+                return
+            yield page['ids'], page['documents'], page['metadatas']
+            offset += len(page['ids'])
+
+    def delete_document(self, document_id):
+        # ChromaDB 支持通过 where 条件删除
+        self.collection.delete(where={"document_id": document_id})
+
+    def count(self):
+        return self.collection.count()
+
+    def drop(self):
+        self.client.delete_collection(name=self.collection_name)
+
+    def stats(self):
+        return {**super().stats(), 'collection': self.collection_name}
+
+
+class NumpyBackend(VectorBackend):
+    """
+    本地暴力检索后端
+
+    归一化后的 float32 向量按行写入内存映射的 .npy 文件（预留容量，满了按倍数扩容
+    并换新文件），分块正文和元数据放在同目录的 SQLite 表中，行号即矩阵行。
+    删除只在表中打标记，查询时用存活掩码排除。
+
+    写入在 SQLite 写事务（BEGIN IMMEDIATE）内完成：先写向量再提交行数，
+    其他进程（多个 gunicorn worker、导入脚本）按 meta.version 发现变化后重新映射，
+    同一份文件经由页缓存在进程间共享。
+
+    查询对所有存活行做一次矩阵乘法，再用 argpartition 取 top-k。
+    distance 为单位向量的平方 L2 距离（2 - 2·cos），与 ChromaDB 默认度量一致。
+
+    同时维护一份 int8 量化矩阵（每个维度一个缩放系数，只增不减；新数据超出范围时
+    从 float 矩阵重新量化该维度）。quantize=True 时先在量化矩阵上分块计算近似得分，
+    取前 rescore_candidates 个候选，再读取这些行的 float 向量精确重排，
+    常驻内存的主要是 int8 矩阵，约为 float32 的四分之一。
+
+    过滤条件由按行号组织的内存元数据索引解析为行集合（随 _refresh 增量建立），
+    只对这些行计算得分。
+    """
+
+    name = 'numpy'
+
+    # 量化矩阵按块转换为 float32 计算，限制临时内存
+    QUANTIZED_BLOCK_ROWS = 16384
+
+    def __init__(self, directory: str, quantize: bool = False, rescore_candidates: int = 200):
+        self.directory = directory
+        self.quantize = quantize
+        self.rescore_candidates = rescore_candidates
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(directory, 'chunks.db'),
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS chunks ('
+            'row INTEGER PRIMARY KEY, id TEXT NOT NULL, document_id TEXT, '
+            'text TEXT NOT NULL, metadata TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_id ON chunks (id)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks (document_id)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+        self._version = None
+        self._file = None
+        self._matrix = None
+        self._codes_file = None
+        self._codes = None
+        self._scale = None
+        self._rows = 0
+        self._alive = np.zeros(0, dtype=bool)
+        self._metadata = MetadataIndex()
+        self._indexed_rows = 0
+
+    # ---- 元数据与映射 ----
+
+    def _meta(self) -> Dict:
+        meta = dict(self._conn.execute('SELECT key, value FROM meta').fetchall())
+        return {
+            'version': int(meta.get('version', 0)),
+            'rows': int(meta.get('rows', 0)),
+            'capacity': int(meta.get('capacity', 0)),
+            'dim': int(meta['dim']) if 'dim' in meta else None,
+            'file': meta.get('file'),
+            'codes_file': meta.get('codes_file'),
+            'scale': meta.get('scale'),
+        }
+
+    def _set_meta(self, **values):
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            [(key, str(value)) for key, value in values.items() if value is not None]
+        )
+
+    def _open_matrix(self, meta: Dict):
+        """按 meta 中记录的文件重新映射"""
+        if meta['file'] and meta['file'] != self._file:
+            self._matrix = np.load(os.path.join(self.directory, meta['file']), mmap_mode='r+')
+            self._file = meta['file']
+        if meta['codes_file'] and meta['codes_file'] != self._codes_file:
+            self._codes = np.load(os.path.join(self.directory, meta['codes_file']), mmap_mode='r+')
+            self._codes_file = meta['codes_file']
+        if meta['scale']:
+            self._scale = np.asarray(json.loads(meta['scale']), dtype=np.float32)
+
+    def _refresh(self):
+        """其他进程或线程写入后，重新映射矩阵并重建存活掩码（在同一读事务快照内读取）"""
+        meta = self._meta()
+        if meta['version'] == self._version:
+            return
+
+        self._conn.execute('BEGIN')
+        try:
+            meta = self._meta()
+            rows = [row for (row,) in self._conn.execute(
+                'SELECT row FROM chunks WHERE deleted = 0 AND row < ?', (meta['rows'],)
+            )]
+            # 元数据索引只追加新行；已删除的行由存活掩码排除
+            new_rows = self._conn.execute(
+                'SELECT row, metadata FROM chunks WHERE row >= ? AND row < ? ORDER BY row',
+                (self._indexed_rows, meta['rows'])
+            ).fetchall()
+        finally:
+            self._conn.execute('COMMIT')
+
+        self._open_matrix(meta)
+        alive = np.zeros(meta['rows'], dtype=bool)
+        if rows:
+            alive[np.asarray(rows, dtype=np.int64)] = True
+        for row, metadata in new_rows:
+            self._metadata.add(row, json.loads(metadata))
+        self._indexed_rows = max(self._indexed_rows, meta['rows'])
+        self._alive = alive
+        self._rows = meta['rows']
+        self._version = meta['version']
+
+    def _new_memmap(self, prefix: str, dtype, shape) -> Tuple[str, np.ndarray]:
+        filename = f"{prefix}.{uuid.uuid4().hex[:12]}.npy"
+        matrix = np.lib.format.open_memmap(
+            os.path.join(self.directory, filename), mode='w+', dtype=dtype, shape=shape
+        )
+        return filename, matrix
+
+    def _remove_file(self, filename: str):
+        # 其他进程已有的映射在 POSIX 上不受影响
+        if filename:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
+
+    def _ensure_capacity(self, meta: Dict, needed: int, dim: int,
+                         created: List[str], obsolete: List[str]):
+        """
+        容量不足时换更大的文件（float 与 int8 矩阵同步扩容）
+
+        新文件记入 created（回滚时删除），被替换的旧文件记入 obsolete（提交后才删除，
+        回滚后 meta 仍指向它们）
+        """
+        if needed <= meta['capacity'] and meta['codes_file']:
+            return
+        capacity = max(needed, meta['capacity'] * 2, 1024) if needed > meta['capacity'] else meta['capacity']
+        rows = meta['rows']
+
+        old_file, old_codes_file = meta['file'], meta['codes_file']
+        filename, matrix = self._new_memmap('vectors', np.float32, (capacity, dim))
+        codes_filename, codes = self._new_memmap('codes', np.int8, (capacity, dim))
+        created.extend((filename, codes_filename))
+        if rows:
+            matrix[:rows] = self._matrix[:rows]
+            if self._codes is not None:
+                codes[:rows] = self._codes[:rows]
+        matrix.flush()
+        codes.flush()
+
+        self._matrix, self._file = matrix, filename
+        self._codes, self._codes_file = codes, codes_filename
+        meta.update(capacity=capacity, file=filename, codes_file=codes_filename)
+        if rows and old_codes_file is None:
+            # 量化矩阵之前不存在（旧版数据），补齐已有行
+            meta['scale'] = None
+            self._scale = None
+            self._quantize_rows(meta, 0, rows, created, obsolete)
+        obsolete.extend(name for name in (old_file, old_codes_file) if name)
+
+    def _quantize_rows(self, meta: Dict, start: int, end: int,
+                       created: List[str], obsolete: List[str]):
+        """
+        量化 [start, end) 行；缩放系数不够时放大并重新量化受影响的维度
+
+        已提交的量化矩阵可能正被其他进程按旧缩放系数读取，重新量化已有行时先复制到
+        新文件（写时复制），随事务一起生效；新的缩放系数只写入 meta，提交后才对外可见
+        """
+        vectors = self._matrix[start:end]
+        dim = vectors.shape[1]
+        scale = self._scale if self._scale is not None else np.zeros(dim, dtype=np.float32)
+        needed = np.abs(vectors).max(axis=0) / 127.0 if end > start else scale
+        grown = needed > scale
+        if grown.any():
+            new_scale = np.where(grown, needed, scale).astype(np.float32)
+            columns = np.nonzero(grown & (scale > 0))[0]
+            if len(columns) and start:
+                if self._codes_file not in created:
+                    codes_filename, codes = self._new_memmap('codes', np.int8, self._codes.shape)
+                    created.append(codes_filename)
+                    obsolete.append(self._codes_file)
+                    codes[:start] = self._codes[:start]
+                    self._codes, self._codes_file = codes, codes_filename
+                    meta['codes_file'] = codes_filename
+                for block in range(0, start, self.QUANTIZED_BLOCK_ROWS):
+                    block_end = min(block + self.QUANTIZED_BLOCK_ROWS, start)
+                    self._codes[block:block_end, columns] = np.rint(
+                        self._matrix[block:block_end, columns] / new_scale[columns]
+                    ).astype(np.int8)
+            scale = new_scale
+
+        safe_scale = np.where(scale > 0, scale, 1.0)
+        self._codes[start:end] = np.clip(np.rint(vectors / safe_scale), -127, 127).astype(np.int8)
+        self._codes.flush()
+        self._scale = scale
+        meta['scale'] = json.dumps(scale.tolist())
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    # ---- 接口实现 ----
+
+    def add(self, ids, texts, metadatas, embeddings):
+        vectors = self._normalize(embeddings)
+        with self._lock:
+            # 回滚时恢复内存中的映射与缩放系数；旧文件在提交后才删除
+            mapped = (self._matrix, self._file, self._codes, self._codes_file, self._scale)
+            created, obsolete = [], []
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                meta = self._meta()
+                dim = meta['dim'] or vectors.shape[1]
+                if vectors.shape[1] != dim:
+                    raise ValueError(f"向量维度不一致: {vectors.shape[1]} != {dim}")
+
+                # 同ID重复写入视为替换
+                for start in range(0, len(ids), _SQL_BATCH):
+                    batch = ids[start:start + _SQL_BATCH]
+                    self._conn.execute(
+                        f"UPDATE chunks SET deleted = 1 WHERE deleted = 0 AND id IN "
+                        f"({','.join('?' * len(batch))})",
+                        batch
+                    )
+
+                self._open_matrix(meta)
+                start_row = meta['rows']
+                end_row = start_row + len(ids)
+                self._ensure_capacity(meta, end_row, dim, created, obsolete)
+                self._matrix[start_row:end_row] = vectors
+                self._matrix.flush()
+                self._quantize_rows(meta, start_row, end_row, created, obsolete)
+
+                self._conn.executemany(
+                    'INSERT INTO chunks (row, id, document_id, text, metadata) VALUES (?, ?, ?, ?, ?)',
+                    [
+                        (start_row + i, chunk_id, str(metadata.get('document_id', '')), text,
+                         json.dumps(metadata, ensure_ascii=False))
+                        for i, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas))
+                    ]
+                )
+                self._set_meta(version=meta['version'] + 1, rows=end_row, capacity=meta['capacity'],
+                               dim=dim, file=meta['file'], codes_file=meta['codes_file'],
+                               scale=meta['scale'])
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                self._matrix, self._file, self._codes, self._codes_file, self._scale = mapped
+                for filename in created:
+                    self._remove_file(filename)
+                raise
+
+            for filename in obsolete:
+                self._remove_file(filename)
+
+    def query(self, embeddings, top_k, filters=None):
+        queries = self._normalize(embeddings)
+        with self._lock:
+            self._refresh()
+            rows = self._rows
+            matrix = self._matrix
+            codes = self._codes
+            scale = self._scale
+            alive = self._alive
+            allowed = self._metadata.resolve(filters or {})
+
+        # row_ids 为 None 时扫描全部行（用存活掩码排除已删除行），否则只扫描过滤出的行
+        row_ids = None
+        if allowed is not None:
+            row_ids = np.fromiter(allowed, dtype=np.int64, count=len(allowed))
+            row_ids = np.sort(row_ids[alive[row_ids]]) if len(row_ids) else row_ids
+            candidate_count = len(row_ids)
+        else:
+            candidate_count = int(alive.sum())
+
+        if not rows or not candidate_count or top_k <= 0:
+            return [[] for _ in range(len(queries))]
+        k = min(top_k, candidate_count)
+
+        if self.quantize and codes is not None and candidate_count > self.rescore_candidates:
+            selections = self._quantized_top_k(matrix, codes, scale, rows, alive, row_ids, queries, k)
+        else:
+            # (rows, d) @ (d, m) -> (rows, m)，一次乘法完成所有查询
+            if row_ids is None:
+                scores = matrix[:rows] @ queries.T
+                scores[~alive] = -np.inf
+            else:
+                scores = matrix[row_ids] @ queries.T
+            selections = [
+                self._map_rows(self._top_k(scores[:, column], k), row_ids)
+                for column in range(scores.shape[1])
+            ]
+
+        records = self._fetch_rows({row for selection in selections for row, _ in selection})
+        results = []
+        for selection in selections:
+            documents = []
+            for row, score in selection:
+                record = records.get(row)
+                if record:
+                    documents.append({**record, 'distance': max(0.0, 2.0 - 2.0 * score)})
+            results.append(documents)
+        return results
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+    @staticmethod
+    def _map_rows(selection: List[Tuple[int, float]], row_ids: Optional[np.ndarray]):
+        """将子矩阵中的位置映射回行号"""
+        if row_ids is None:
+            return selection
+        return [(int(row_ids[position]), score) for position, score in selection]
+
+    def _quantized_top_k(self, matrix, codes, scale, rows, alive, row_ids, queries, k):
+        """int8 近似得分选候选，再用 float 向量精确重排"""
+        scaled = (queries * scale).T.astype(np.float32)  # (d, m)
+        total = rows if row_ids is None else len(row_ids)
+        approx = np.empty((total, queries.shape[0]), dtype=np.float32)
+        for block in range(0, total, self.QUANTIZED_BLOCK_ROWS):
+            block_end = min(block + self.QUANTIZED_BLOCK_ROWS, total)
+            block_codes = codes[block:block_end] if row_ids is None else codes[row_ids[block:block_end]]
+            approx[block:block_end] = block_codes.astype(np.float32) @ scaled
+        if row_ids is None:
+            approx[~alive] = -np.inf
+            live = int(alive.sum())
+        else:
+            live = total
+
+        candidates = min(max(self.rescore_candidates, k), live)
+        selections = []
+        for column in range(queries.shape[0]):
+            positions = np.argpartition(-approx[:, column], candidates - 1)[:candidates]
+            candidate_rows = np.sort(positions if row_ids is None else row_ids[positions])
+            exact = matrix[candidate_rows] @ queries[column]
+            selections.append([
+                (int(candidate_rows[index]), score) for index, score in self._top_k(exact, k)
+            ])
+        return selections
+
+    def _fetch_rows(self, rows) -> Dict[int, Dict]:
+        rows = list(rows)
+        records = {}
+        with self._lock:
+            for start in range(0, len(rows), _SQL_BATCH):
+                batch = rows[start:start + _SQL_BATCH]
+                cursor = self._conn.execute(
+                    f"SELECT row, id, text, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})",
+                    batch
+                )
+                for row, chunk_id, text, metadata in cursor:
+                    records[row] = {'id': chunk_id, 'text': text, 'metadata': json.loads(metadata)}
+        return records
+
+    def get(self, ids):
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = ids[start:start + _SQL_BATCH]
+                cursor = self._conn.execute(
+                    f"SELECT id, text, metadata FROM chunks WHERE deleted = 0 AND id IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch
+                )
+                for chunk_id, text, metadata in cursor:
+                    found[chunk_id] = {'id': chunk_id, 'text': text, 'metadata': json.loads(metadata)}
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def iter_batches(self, page_size=1000):
+        last_row = -1
+        while True:
+            with self._lock:
+                page = self._conn.execute(
+                    'SELECT row, id, text, metadata FROM chunks WHERE deleted = 0 AND row > ? '
+                    'ORDER BY row LIMIT ?',
+                    (last_row, page_size)
+                ).fetchall()
+            if not page:
+                return
+            last_row = page[-1][0]
+            yield ([chunk_id for _, chunk_id, _, _ in page],
+                   [text for _, _, text, _ in page],
+                   [json.loads(metadata) for _, _, _, metadata in page])
+
+    def delete_document(self, document_id):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                deleted = self._conn.execute(
+                    'UPDATE chunks SET deleted = 1 WHERE document_id = ? AND deleted = 0',
+                    (str(document_id),)
+                ).rowcount
+                if deleted:
+                    self._set_meta(version=self._meta()['version'] + 1)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM chunks WHERE deleted = 0').fetchone()[0]
+
+    def drop(self):
+        with self._lock:
+            self._matrix = None
+            self._codes = None
+            self._conn.close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            rows = self._rows
+            dim = self._matrix.shape[1] if self._matrix is not None else 0
+        return {
+            **super().stats(),
+            'directory': self.directory,
+            'quantized': self.quantize,
+            'rescore_candidates': self.rescore_candidates,
+            'float_bytes': rows * dim * 4,
+            'quantized_bytes': rows * dim,
+        }
+
+
+def shard_of(document_id, shards: int) -> int:
+    """文档所属分片（crc32，跨进程稳定）"""
+    return zlib.crc32(str(document_id).encode('utf-8')) % shards
+
+
+class ShardedBackend(VectorBackend):
+    """
+    按 document_id 哈希分片的组合后端
+
+    同一文档的分块总在同一分片，删除只落到所属分片。查询并行下发到各分片
+    （NumPy 的矩阵乘法与 ChromaDB 的 HNSW 查询都会释放 GIL），
+    每个分片返回自己的 top-k，再按 distance 用堆归并出全局 top-k。
+    过滤条件包含 document_id 时只查询这些文档所在的分片。
+    """
+
+    name = 'sharded'
+
+    def __init__(self, shards: List[VectorBackend]):
+        self.shards = shards
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(shards), thread_name_prefix='vector-shard'
+        )
+
+    def _owner(self, document_id) -> VectorBackend:
+        return self.shards[shard_of(document_id, len(self.shards))]
+
+    def _fan_out(self, call, shards: Optional[List[VectorBackend]] = None) -> List:
+        shards = self.shards if shards is None else shards
+        if len(shards) == 1:
+            return [call(shards[0])]
+        return list(self._executor.map(call, shards))
+
+    def add(self, ids, texts, metadatas, embeddings):
+        groups = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(shard_of(metadata.get('document_id', ''), len(self.shards)), []).append(i)
+
+        def add_group(item):
+            index, rows = item
+            self.shards[index].add(
+                [ids[i] for i in rows],
+                [texts[i] for i in rows],
+                [metadatas[i] for i in rows],
+                [embeddings[i] for i in rows]
+            )
+
+        list(self._executor.map(add_group, groups.items()))
+
+    def query(self, embeddings, top_k, filters=None):
+        targets = self.shards
+        if filters and 'document_id' in filters:
+            owners = {shard_of(document_id, len(self.shards)) for document_id in filters['document_id']}
+            targets = [self.shards[index] for index in sorted(owners)]
+
+        per_shard = self._fan_out(lambda shard: shard.query(embeddings, top_k, filters), targets)
+        return [
+            list(islice(heapq.merge(*(results[i] for results in per_shard),
+                                    key=itemgetter('distance')), top_k))
+            for i in range(len(embeddings))
+        ]
+
+    def get(self, ids):
+        found = {}
+        for records in self._fan_out(lambda shard: shard.get(ids)):
+            for record in records:
+                found[record['id']] = record
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def iter_batches(self, page_size=1000):
+        for shard in self.shards:
+            yield from shard.iter_batches(page_size)
+
+    def delete_document(self, document_id):
+        self._owner(document_id).delete_document(document_id)
+
+    def count(self):
+        return sum(self._fan_out(lambda shard: shard.count()))
+
+    def drop(self):
+        for shard in self.shards:
+            shard.drop()
+
+    def stats(self):
+        shard_stats = self._fan_out(lambda shard: shard.stats())
+        stats = {
+            'backend': f"{self.shards[0].name} x {len(self.shards)}",
+            'count': sum(item['count'] for item in shard_stats),
+            'shards': shard_stats,
+        }
+        for key in ('float_bytes', 'quantized_bytes'):
+            if key in shard_stats[0]:
+                stats[key] = sum(item[key] for item in shard_stats)
+        return stats
+
+
+def create_backend(kind: str, embedding_function, config,
+                   paths: Optional[Dict] = None) -> VectorBackend:
+    """
+    按配置创建后端；paths 为 index_versions.version_paths 的结果，默认使用版本 0 的位置
+
+    分片数大于 1 时，第 i 个分片使用集合 {collection}_s{i} 或目录 {numpy_dir}/shard_{i}。
+    """
+    collection = paths['collection'] if paths else config.CHROMA_COLLECTION_NAME
+    directory = paths['numpy_dir'] if paths else config.NUMPY_STORE_DIR
+    shards = paths['shards'] if paths else 1
+    if shards > 1:
+        return ShardedBackend([
+            _create_single(kind, embedding_function, config,
+                           f"{collection}_s{i}", os.path.join(directory, f"shard_{i}"))
+            for i in range(shards)
+        ])
+    return _create_single(kind, embedding_function, config, collection, directory)
+
+
+def _create_single(kind: str, embedding_function, config, collection: str,
+                   directory: str) -> VectorBackend:
+    if kind == 'chroma':
+        return ChromaBackend(config.CHROMA_PERSIST_DIR, collection, embedding_function)
+    if kind == 'numpy':
+        return NumpyBackend(
+            directory,
+            quantize=config.NUMPY_QUANTIZE,
+            rescore_candidates=config.NUMPY_RESCORE_CANDIDATES
+        )
+    raise ValueError(f"不支持的向量后端: {kind}")
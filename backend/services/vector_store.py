@@ -1,52 +1,288 @@
 """
-向量存储服务 - 使用 ChromaDB
+向量存储服务 - 默认使用 ChromaDB，可切换为本地 NumPy 内存映射后端
 """
-import chromadb
-from chromadb.config import Settings
-from typing import List, Dict
+import os
+import copy
+import time
+import struct
+import hashlib
+import threading
+from collections import Counter
+from chromadb.utils import embedding_functions
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Callable
 from config import Config
+from services.embedding_cache import EmbeddingCache
+from services.lru_cache import LRUCache
+from services.bm25_index import BM25Index, reciprocal_rank_fusion
+from services.vector_backends import VectorBackend, create_backend
+from services.metadata_index import normalize_filters, filters_key
+from services.index_versions import (
+    version_paths, read_pointer, write_pointer, pointer_mtime, shard_count
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+SEARCH_MODES = ('dense', 'bm25', 'hybrid')
+
+
+class BatchWriteError(RuntimeError):
+    """add_documents 有批次写入失败；report 为写入统计，其中 resume_offset 是续传起点"""
+
+    def __init__(self, message: str, report: Dict):
+        super().__init__(message)
+        self.report = report
+
 
 class VectorStore:
-    """向量存储管理"""
+    """
+    向量存储管理
+    
+    向量后端与 BM25 索引按版本成对存放（见 index_versions）。默认跟随指针文件中的生效版本，
+    其他进程切换版本后在下一次读写时原子替换；version 指定时固定使用该版本（蓝绿重建的新索引）。
+    """
     
-    def __init__(self):
-        self.client = None
-        self.collection = None
+    def __init__(self, version: Optional[int] = None):
+        self.pinned_version = version
+        self.index_version = None
+        self._pointer_mtime = None
+        self._swap_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self.backend: Optional[VectorBackend] = None
+        self.embedding_function = None
+        self.embedding_model_id = None
+        self.embedding_cache = None
+        self.lexical_index = None
+        
+        # 检索缓存：查询向量与集合内容无关，只有结果缓存需要在集合变化时清空
+        cache_size = Config.SEARCH_CACHE_SIZE if Config.SEARCH_CACHE_ENABLED else 0
+        self.query_embedding_cache = LRUCache(cache_size, Config.SEARCH_CACHE_TTL)
+        self.result_cache = LRUCache(cache_size, Config.SEARCH_CACHE_TTL)
         
     def initialize(self):
         """初始化向量数据库"""
         try:
-            # ChromaDB 0.4.22 使用 PersistentClient 支持持久化存储
-            # 尝试使用 PersistentClient（推荐方式）
-            try:
-                self.client = chromadb.PersistentClient(
-                    path=Config.CHROMA_PERSIST_DIR
+            # 显式持有嵌入函数，写入时自行计算向量以便分批流水线化
+            if self.embedding_function is None:
+                self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+                self.embedding_model_id = (
+                    f"{type(self.embedding_function).__name__}:"
+                    f"{getattr(self.embedding_function, 'MODEL_NAME', '')}"
                 )
-            except (AttributeError, TypeError):
-                # 如果 PersistentClient 不存在或参数不匹配，尝试使用 Client + Settings
-                self.client = chromadb.Client(Settings(
-                    persist_directory=Config.CHROMA_PERSIST_DIR,
-                    anonymized_telemetry=False
-                ))
+                if Config.EMBEDDING_CACHE_ENABLED:
+                    self.embedding_cache = EmbeddingCache(
+                        Config.EMBEDDING_CACHE_PATH,
+                        Config.EMBEDDING_CACHE_MAX_BYTES
+                    )
             
-            # 获取或创建集合
-            self.collection = self.client.get_or_create_collection(
-                name=Config.CHROMA_COLLECTION_NAME,
-                metadata={"description": "HKU 知识库"}
-            )
-            logger.info(f"ChromaDB 初始化成功，集合: {Config.CHROMA_COLLECTION_NAME}")
+            if self.pinned_version is None:
+                self._record_layout()
+                self._pointer_mtime = pointer_mtime()
+                version = read_pointer()['active']
+            else:
+                version = self.pinned_version
+            self._install(version, *self._open_version(version))
+            logger.info(f"向量库初始化成功，后端: {self.backend.name}，索引版本: {version}")
         except Exception as e:
-            logger.error(f"ChromaDB 初始化失败: {str(e)}")
+            self.backend = None
+            logger.error(f"向量库初始化失败: {str(e)}")
             raise
+    
+    def ensure_initialized(self):
+        """未初始化时初始化；并发调用只初始化一次，其余调用等待其完成（如后台预热进行中）"""
+        if self.backend:
+            return
+        with self._init_lock:
+            if not self.backend:
+                self.initialize()
+    
+    def warmup(self) -> Dict:
+        """
+        预热：打开向量后端与 BM25 索引，并计算一次查询向量以加载嵌入模型
+        
+        Returns:
+            Dict: 各步骤耗时（秒）
+        """
+        start = time.perf_counter()
+        self.ensure_initialized()
+        opened = time.perf_counter()
+        self._compute_embeddings(['warmup'])
+        return {
+            'open_seconds': round(opened - start, 3),
+            'embedding_model_seconds': round(time.perf_counter() - opened, 3),
+        }
+    
+    def _record_layout(self):
+        """
+        首次启动时在指针文件中记录生效版本的分片数
+        
+        升级前已有数据的版本 0 保持不分片；空库按 VECTOR_SHARDS 建立。
+        之后修改 VECTOR_SHARDS 只对 --rebuild 产生的新版本生效。
+        """
+        state = read_pointer()
+        if state['active'] in state['shards']:
+            return
+        shards = Config.VECTOR_SHARDS
+        if shards > 1 and create_backend(
+                Config.VECTOR_BACKEND, self.embedding_function, Config,
+                version_paths(state['active'])).count():
+            shards = 1
+        write_pointer(state['active'], state['previous'], {**state['shards'], state['active']: shards})
+    
+    def _open_version(self, version: int):
+        """打开某个版本的向量后端与 BM25 索引"""
+        paths = version_paths(version, shard_count(read_pointer(), version))
+        backend = create_backend(Config.VECTOR_BACKEND, self.embedding_function, Config, paths)
+        
+        # 词法索引：文件缺失或版本过旧但向量库已有数据时（如升级前建立的库）从向量库重建
+        lexical_index = BM25Index(paths['bm25_path'])
+        if not lexical_index.load() and backend.count():
+            lexical_index.rebuild(backend.iter_batches())
+            logger.info(f"BM25 索引已重建: {len(lexical_index)} 个分块")
+        return backend, lexical_index
+    
+    def _install(self, version: int, backend: VectorBackend, lexical_index: BM25Index):
+        """原子替换当前使用的版本；进行中的查询继续使用各自取到的旧实例"""
+        with self._swap_lock:
+            self.backend = backend
+            self.lexical_index = lexical_index
+            self.index_version = version
+        self.result_cache.invalidate()
+    
+    def _snapshot(self):
+        """取当前版本的 (后端, BM25 索引)，保证一次读写内两者属于同一版本"""
+        self.ensure_initialized()
+        self.reload_if_swapped()
+        with self._swap_lock:
+            return self.backend, self.lexical_index
+    
+    def reload_if_swapped(self):
+        """指针文件被其他进程（重建脚本）更新且生效版本变化时，切换到新版本"""
+        if self.pinned_version is not None:
+            return
+        mtime = pointer_mtime()
+        if mtime == self._pointer_mtime:
+            return
+        with self._reload_lock:
+            if mtime == self._pointer_mtime:
+                return
+            version = read_pointer()['active']
+            if version != self.index_version:
+                self._install(version, *self._open_version(version))
+                logger.info(f"索引版本已切换: {version}")
+            self._pointer_mtime = mtime
+    
+    def create_staging(self) -> 'VectorStore':
+        """
+        新建下一个版本的空索引用于蓝绿重建（共享本实例的嵌入模型与向量缓存）
+        
+        上次中断的重建留下的同版本数据会先被清除；新版本按当前 VECTOR_SHARDS 分片。
+        """
+        self.ensure_initialized()
+        state = read_pointer()
+        version = max(state['active'], state['previous'] or 0) + 1
+        self.drop_version(version)
+        state = read_pointer()
+        write_pointer(state['active'], state['previous'],
+                      {**state['shards'], version: Config.VECTOR_SHARDS})
+        
+        staging = VectorStore(version=version)
+        staging.embedding_function = self.embedding_function
+        staging.embedding_model_id = self.embedding_model_id
+        staging.embedding_cache = self.embedding_cache
+        staging.initialize()
+        return staging
+    
+    def activate_version(self, version: int) -> Dict:
+        """
+        将 version 设为生效版本：原子替换指针文件并在本进程内切换
         
-    def add_documents(self, texts: List[str], metadatas: List[Dict], ids: List[str]):
-        """添加文档到向量库"""
-        if not self.collection:
-            self.initialize()
+        原生效版本保留为回滚目标，再早一个版本的数据被删除。
+        
+        Returns:
+            Dict: 切换后的指针 {'active', 'previous', 'updated_at', 'shards'}
+        """
+        state = read_pointer()
+        if version == state['active']:
+            return state
+        write_pointer(version, state['active'], state['shards'])
+        self.reload_if_swapped()
+        
+        evicted = state['previous']
+        if evicted is not None and evicted not in (version, state['active']):
+            self.drop_version(evicted)
+        return read_pointer()
+    
+    def rollback(self) -> Dict:
+        """切回上一版本（当前版本保留，可再次回滚回来）"""
+        state = read_pointer()
+        if state['previous'] is None:
+            raise ValueError("没有可回滚的索引版本")
+        write_pointer(state['previous'], state['active'], state['shards'])
+        self.reload_if_swapped()
+        return read_pointer()
+    
+    def drop_version(self, version: int):
+        """删除某个非生效版本的全部数据"""
+        state = read_pointer()
+        if version == state['active']:
+            raise ValueError(f"不能删除生效中的索引版本: {version}")
+        paths = version_paths(version, shard_count(state, version))
+        create_backend(Config.VECTOR_BACKEND, self.embedding_function, Config, paths).drop()
+        for path in (paths['bm25_path'], f"{paths['bm25_path']}.lock"):
+            if os.path.exists(path):
+                os.remove(path)
+        if version in state['shards']:
+            shards = {key: value for key, value in state['shards'].items() if key != version}
+            write_pointer(state['active'], state['previous'], shards)
+        logger.info(f"索引版本 {version} 已删除")
+        
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """计算文本向量，优先读取磁盘向量缓存"""
+        self.ensure_initialized()
+        
+        if not self.embedding_cache:
+            return self._compute_embeddings(texts)
+        
+        embeddings = self.embedding_cache.get_many(self.embedding_model_id, texts)
+        missing = [i for i, vector in enumerate(embeddings) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            computed = self._compute_embeddings(missing_texts)
+            self.embedding_cache.put_many(self.embedding_model_id, missing_texts, computed)
+            for i, vector in zip(missing, computed):
+                embeddings[i] = vector
+        return embeddings
+    
+    def _compute_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """调用嵌入模型计算向量"""
+        vectors = self.embedding_function(texts)
+        return [vector.tolist() if hasattr(vector, 'tolist') else list(vector) for vector in vectors]
+        
+    def add_documents(self, texts: List[str], metadatas: List[Dict], ids: List[str],
+                      batch_size: Optional[int] = None,
+                      progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict:
+        """
+        分批添加文档到向量库
+        
+        计算下一批向量的同时写入当前批次；某一批失败不影响其余批次，
+        已写入的批次会保留，全部批次处理完后再统一抛出 BatchWriteError。
+        同ID重复写入视为替换，调用方可以从 resume_offset 起重新提交剩余分块续传。
+        
+        Args:
+            texts: 文本块列表
+            metadatas: 元数据列表
+            ids: 文本块ID列表
+            batch_size: 每批数量，默认 Config.VECTOR_BATCH_SIZE
+            progress_callback: 每批完成后回调 (已处理块数, 总块数)
+            
+        Returns:
+            Dict: 写入统计 {'added', 'failed', 'batches', 'failed_batches', 'resume_offset'}，
+                  resume_offset 为输入中从头起连续写入成功的分块数
+        """
+        backend, lexical_index = self._snapshot()
         
         # 验证输入
         if not texts or len(texts) == 0:
@@ -59,66 +295,249 @@ class VectorStore:
         valid_texts = []
         valid_metadatas = []
         valid_ids = []
+        positions = []  # 有效文本块在输入中的下标
         
         for i, text in enumerate(texts):
             if text and text.strip():  # 确保文本不为空
                 valid_texts.append(text.strip())
                 valid_metadatas.append(metadatas[i])
                 valid_ids.append(ids[i])
+                positions.append(i)
             else:
                 logger.warning(f"跳过空文本块，ID: {ids[i]}")
         
         if not valid_texts:
             raise ValueError("所有文本块都为空，无法添加到向量库")
         
+        batch_size = batch_size or Config.VECTOR_BATCH_SIZE
+        total = len(valid_texts)
+        bounds = [(start, min(start + batch_size, total)) for start in range(0, total, batch_size)]
+        report = {'added': 0, 'failed': 0, 'batches': len(bounds), 'failed_batches': []}
+        
+        written = []  # 已写入向量库的批次，结束时在文件锁内一次性写入 BM25 索引
+        # 单线程预取：第 i 批写入时，第 i+1 批的向量已在计算
         try:
-            self.collection.add(
-                documents=valid_texts,
-                metadatas=valid_metadatas,
-                ids=valid_ids
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                pending = executor.submit(self.embed, valid_texts[bounds[0][0]:bounds[0][1]])
+            
+                for batch_index, (start, end) in enumerate(bounds):
+                    current = pending
+                    if batch_index + 1 < len(bounds):
+                        next_start, next_end = bounds[batch_index + 1]
+                        pending = executor.submit(self.embed, valid_texts[next_start:next_end])
+                
+                    try:
+                        embeddings = current.result()
+                        backend.add(
+                            valid_ids[start:end],
+                            valid_texts[start:end],
+                            valid_metadatas[start:end],
+                            embeddings
+                        )
+                        written.append((start, end))
+                        report['added'] += end - start
+                        self.result_cache.invalidate()
+                        logger.info(f"批次 {batch_index + 1}/{len(bounds)} 写入 {end - start} 个文档块")
+                    except Exception as e:
+                        report['failed'] += end - start
+                        report['failed_batches'].append(batch_index)
+                        logger.error(f"批次 {batch_index + 1}/{len(bounds)} 写入失败: {str(e)}")
+                
+                    if progress_callback:
+                        progress_callback(end, total)
+        finally:
+            if written:
+                with lexical_index.update():
+                    for start, end in written:
+                        lexical_index.add(
+                            valid_ids[start:end], valid_texts[start:end], valid_metadatas[start:end]
+                        )
+                self.result_cache.invalidate()
+        
+        failed_batches = report['failed_batches']
+        report['resume_offset'] = positions[bounds[failed_batches[0]][0]] if failed_batches else len(texts)
+        if report['failed']:
+            raise BatchWriteError(
+                f"{report['failed']}/{total} 个文档块写入向量库失败（已写入 {report['added']} 个）",
+                report
             )
-            logger.info(f"成功添加 {len(valid_texts)} 个文档块到向量库")
-        except Exception as e:
-            logger.error(f"添加文档到向量库失败: {str(e)}")
-            raise
         
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
-        """语义搜索"""
-        if not self.collection:
-            self.initialize()
+        logger.info(f"成功添加 {report['added']} 个文档块到向量库（{len(bounds)} 批）")
+        return report
+        
+    def search(self, query: str, top_k: int = 5, mode: Optional[str] = None,
+               filters: Optional[Dict] = None) -> List[Dict]:
+        """语义搜索（重复的查询直接命中缓存，跳过向量计算和检索）"""
+        return self.search_many([query], top_k, mode, filters)[0]
+    
+    def search_many(self, queries: List[str], top_k: int = 5, mode: Optional[str] = None,
+                    filters: Optional[Dict] = None) -> List[List[Dict]]:
+        """
+        批量搜索
+        
+        未命中缓存的查询一次性计算向量，并合并为一次后端查询。
+        mode 为 dense / bm25 / hybrid，默认 Config.SEARCH_MODE；hybrid 时两路各召回
+        HYBRID_CANDIDATES 个候选，按倒数排名融合后取 top_k。
+        
+        filters 限定检索范围，如 {'file_type': 'pdf', 'document_id': ['3', '5']}：
+        同一字段多个值为“或”，不同字段为“且”。过滤在相似度排序之前生效——
+        向量检索下推为后端原生条件，词法检索只在元数据索引解析出的分块中打分；
+        没有分块满足条件时直接返回空结果。
+        
+        Returns:
+            List[List[Dict]]: 与 queries 一一对应的检索结果
+        """
+        backend, lexical_index = self._snapshot()
+        if not queries:
+            return []
+        
+        mode = mode or Config.SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"不支持的检索模式: {mode}")
+        filters = normalize_filters(filters)
+        scope = filters_key(filters)
+        
+        if mode == 'bm25':
+            embeddings = [None] * len(queries)
+            keys = [(query.strip(), top_k, mode, scope) for query in queries]
+        else:
+            embeddings = self.query_embeddings(queries)
+            keys = [(self._vector_key(embedding), top_k, mode, scope) for embedding in embeddings]
+        generation = self.result_cache.generation
+        
+        results = [None] * len(queries)
+        pending = {}
+        for i, key in enumerate(keys):
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                results[i] = copy.deepcopy(cached)
+            else:
+                pending.setdefault(key, []).append(i)
+        
+        if pending:
+            pending_keys = list(pending)
+            firsts = [pending[key][0] for key in pending_keys]
+            candidates = top_k if mode != 'hybrid' else max(top_k, Config.HYBRID_CANDIDATES)
             
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=top_k
-        )
-        
-        # 格式化结果
-        documents = []
-        if results['documents'] and len(results['documents']) > 0:
-            for i, doc in enumerate(results['documents'][0]):
-                documents.append({
-                    'text': doc,
-                    'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                    'distance': results['distances'][0][i] if results['distances'] else 0
-                })
+            allowed = None
+            if mode != 'dense':
+                lexical_index.reload_if_changed()
+                allowed = lexical_index.resolve(filters)
+            
+            if allowed is not None and not allowed:
+                ranked = [[] for _ in firsts]
+            else:
+                dense = [[] for _ in firsts]
+                if mode != 'bm25':
+                    dense = backend.query([embeddings[i] for i in firsts], candidates, filters)
                 
-        return documents
+                if mode == 'dense':
+                    ranked = dense
+                else:
+                    lexical = [lexical_index.search(queries[i], candidates, allowed) for i in firsts]
+                    ranked = self._merge_lexical(backend, dense, lexical, top_k, mode)
+            
+            for key, documents in zip(pending_keys, ranked):
+                self.result_cache.set(key, copy.deepcopy(documents), generation)
+                for i in pending[key]:
+                    results[i] = copy.deepcopy(documents)
+        
+        return results
+    
+    @staticmethod
+    def _merge_lexical(backend: VectorBackend, dense: List[List[Dict]], lexical: List[List],
+                       top_k: int, mode: str) -> List[List[Dict]]:
+        """合并词法结果；只在词法结果中出现的分块一次性从向量库取回正文和元数据"""
+        if mode == 'bm25':
+            rankings = [[(chunk_id, score) for chunk_id, score in hits[:top_k]] for hits in lexical]
+        else:
+            rankings = [
+                reciprocal_rank_fusion(
+                    [[doc['id'] for doc in dense_docs], [chunk_id for chunk_id, _ in hits]],
+                    k=Config.RRF_K,
+                    limit=top_k
+                )
+                for dense_docs, hits in zip(dense, lexical)
+            ]
+        
+        known = {doc['id']: doc for dense_docs in dense for doc in dense_docs}
+        missing = list({chunk_id for ranking in rankings for chunk_id, _ in ranking} - set(known))
+        if missing:
+            for record in backend.get(missing):
+                known[record['id']] = {**record, 'distance': None}
+        
+        merged = []
+        for ranking in rankings:
+            documents = []
+            for chunk_id, score in ranking:
+                # 词法索引可能短暂落后于向量库，取不到的分块直接跳过
+                if chunk_id in known:
+                    documents.append({**known[chunk_id], 'score': score})
+            merged.append(documents)
+        return merged
+    
+    def query_embedding(self, query: str) -> List[float]:
+        """计算单个查询向量"""
+        return self.query_embeddings([query])[0]
+    
+    def query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """批量计算查询向量（内存 LRU 缓存，未命中的一次性计算，不写入磁盘向量缓存）"""
+        keys = [query.strip() for query in queries]
+        embeddings = [self.query_embedding_cache.get(key) for key in keys]
+        
+        missing = list(dict.fromkeys(key for key, vector in zip(keys, embeddings) if vector is None))
+        if missing:
+            computed = dict(zip(missing, self._compute_embeddings(missing)))
+            for key, vector in computed.items():
+                self.query_embedding_cache.set(key, vector)
+            embeddings = [vector if vector is not None else computed[key]
+                          for key, vector in zip(keys, embeddings)]
+        return embeddings
+    
+    @staticmethod
+    def _vector_key(embedding: List[float]) -> str:
+        """向量的紧凑哈希，用作结果缓存键"""
+        return hashlib.sha1(struct.pack(f'{len(embedding)}f', *embedding)).hexdigest()
     
     def delete_by_document_id(self, document_id: str):
         """根据文档ID删除所有相关的chunks"""
-        if not self.collection:
-            self.initialize()
-            
-        # ChromaDB 支持通过 where 条件删除
-        self.collection.delete(
-            where={"document_id": document_id}
-        )
+        backend, lexical_index = self._snapshot()
+        backend.delete_document(document_id)
+        with lexical_index.update():
+            lexical_index.delete_document(document_id)
+        self.result_cache.invalidate()
+    
+    def rebuild_lexical_index(self, page_size: int = 1000):
+        """从向量库全量重建 BM25 索引"""
+        backend, lexical_index = self._snapshot()
+        lexical_index.rebuild(backend.iter_batches(page_size))
+        self.result_cache.invalidate()
+        logger.info(f"BM25 索引已重建: {len(lexical_index)} 个分块")
     
     def get_count(self) -> int:
         """获取向量库中的文档数量"""
-        if not self.collection:
-            self.initialize()
-        return self.collection.count()
+        backend, _ = self._snapshot()
+        return backend.count()
+    
+    def chunk_counts(self, page_size: int = 1000) -> Counter:
+        """遍历向量后端，统计每个 document_id 的分块数（用于与 Document 表核对）"""
+        backend, _ = self._snapshot()
+        counts = Counter()
+        for _, _, metadatas in backend.iter_batches(page_size):
+            counts.update(str(metadata.get('document_id', '')) for metadata in metadatas)
+        return counts
+    
+    def backend_stats(self) -> Dict:
+        """向量后端统计（numpy 后端包含 float / int8 矩阵大小）"""
+        backend, _ = self._snapshot()
+        return {**backend.stats(), 'index_version': self.index_version}
+    
+    def cache_stats(self) -> Dict:
+        """检索缓存命中统计"""
+        return {
+            'query_embeddings': self.query_embedding_cache.stats(),
+            'results': self.result_cache.stats()
+        }
 
 
 # 全局实例
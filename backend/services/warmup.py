@@ -0,0 +1,82 @@
+"""
+后台预热 - 进程启动后在后台线程中打开向量库并加载嵌入模型，就绪状态供 /api/health/ready 查询
+"""
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict
+
+from config import Config
+from services.vector_store import vector_store
+from services.answer_cache import answer_cache
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """
+    预热任务
+
+    状态依次为 pending -> running -> ready / failed。失败时记录错误并按
+    retry_interval 重试，期间就绪检查保持未就绪。就绪后再启动语义答案缓存的历史预热。
+    """
+
+    def __init__(self, retry_interval: float = 30):
+        self.retry_interval = retry_interval
+        self.state = 'pending'
+        self.error = None
+        self.attempts = 0
+        self.started_at = None
+        self.finished_at = None
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """启动后台预热线程（幂等）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name='warmup', daemon=True).start()
+
+    def _run(self):
+        self.started_at = datetime.utcnow()
+        while True:
+            self.state = 'running'
+            self.attempts += 1
+            start = time.perf_counter()
+            try:
+                self.timings = vector_store.warmup()
+                self.timings['total_seconds'] = round(time.perf_counter() - start, 3)
+                self.error = None
+                self.state = 'ready'
+                self.finished_at = datetime.utcnow()
+                logger.info(f"预热完成: {self.timings}")
+                break
+            except Exception as e:
+                self.error = str(e)
+                self.state = 'failed'
+                logger.error(f"预热失败（第 {self.attempts} 次），{self.retry_interval} 秒后重试: {str(e)}")
+                time.sleep(self.retry_interval)
+
+        answer_cache.start()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == 'ready'
+
+    def status(self) -> Dict:
+        return {
+            'state': self.state,
+            'attempts': self.attempts,
+            'error': self.error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'timings': self.timings,
+        }
+
+
+# 全局实例
+warmup = Warmup(retry_interval=Config.WARMUP_RETRY_INTERVAL)
@@ -0,0 +1,144 @@
+"""
+BM25 索引测试：分词、添加/删除、保存后重新加载、多实例写入合并
+"""
+import os
+import tempfile
+import unittest
+
+from services.bm25_index import BM25Index, tokenize, reciprocal_rank_fusion
+
+
+def add_chunks(index: BM25Index, document_id: str, texts, file_type: str = 'pdf'):
+    ids = [f"doc_{document_id}_chunk_{i}" for i in range(len(texts))]
+    metadatas = [{'document_id': document_id, 'filename': f'{document_id}.{file_type}',
+                  'file_type': file_type} for _ in texts]
+    index.add(ids, list(texts), metadatas)
+    return ids
+
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_course_codes(self):
+        self.assertIn('comp7404', tokenize("COMP 7404 syllabus"))
+        self.assertIn('comp7404', tokenize("COMP7404 syllabus"))
+
+    def test_cjk_bigrams_and_stopwords(self):
+        tokens = tokenize("The 考试规则")
+        self.assertNotIn('the', tokens)
+        self.assertEqual(tokens, ['考试', '试规', '规则'])
+
+    def test_regulation_numbers(self):
+        self.assertIn('3.5.1', tokenize("See regulation 3.5.1"))
+
+
+class BM25IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'bm25_index.pkl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def new_index(self) -> BM25Index:
+        index = BM25Index(self.path)
+        index.load()
+        return index
+
+    def test_search_ranks_exact_matches(self):
+        index = self.new_index()
+        with index.update():
+            add_chunks(index, '1', ["COMP7404 covers machine learning", "Library opening hours"])
+            add_chunks(index, '2', ["Exam regulation 3.5.1 on late submission"])
+        self.assertEqual(index.search("comp 7404", 1)[0][0], 'doc_1_chunk_0')
+        self.assertEqual(index.search("regulation 3.5.1", 1)[0][0], 'doc_2_chunk_0')
+        self.assertEqual(index.search("unrelated words", 5), [])
+
+    def test_delete_document(self):
+        index = self.new_index()
+        with index.update():
+            add_chunks(index, '1', ["scholarship application deadline"])
+            add_chunks(index, '2', ["scholarship interview schedule"])
+        with index.update():
+            index.delete_document('1')
+        self.assertEqual(len(index), 1)
+        self.assertEqual([chunk_id for chunk_id, _ in index.search("scholarship", 5)], ['doc_2_chunk_0'])
+        self.assertEqual(index.resolve({'document_id': ['1']}), set())
+
+    def test_save_and_reload_round_trip(self):
+        index = self.new_index()
+        with index.update():
+            add_chunks(index, '1', ["COMP7404 machine learning", "课程考试规则"], 'pdf')
+            add_chunks(index, '2', ["Graduation requirements"], 'docx')
+        with index.update():
+            index.delete_document('2')
+
+        reloaded = self.new_index()
+        self.assertEqual(len(reloaded), len(index))
+        for query in ("COMP7404", "考试规则", "graduation"):
+            self.assertEqual(reloaded.search(query, 5), index.search(query, 5))
+        self.assertEqual(reloaded.resolve({'file_type': ['pdf']}), {'doc_1_chunk_0', 'doc_1_chunk_1'})
+        self.assertEqual(reloaded.resolve({'file_type': ['docx']}), set())
+
+    def test_compaction_preserves_results(self):
+        index = self.new_index()
+        with index.update():
+            for document in range(100):
+                add_chunks(index, str(document), [f"topic{document} shared words"])
+        with index.update():
+            for document in range(90):
+                index.delete_document(str(document))
+        # 墓碑超过阈值，保存时压缩并重新编号
+        self.assertEqual(len(index.doc_ids), 10)
+        expected = index.search("shared", 20)
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(self.new_index().search("shared", 20), expected)
+
+    def test_concurrent_writers_do_not_overwrite_each_other(self):
+        first = self.new_index()
+        second = self.new_index()
+        with first.update():
+            add_chunks(first, '1', ["alpha handbook"])
+        with second.update():
+            add_chunks(second, '2', ["beta handbook"])
+        with first.update():
+            first.delete_document('2')
+        with second.update():
+            add_chunks(second, '3', ["gamma handbook"])
+
+        merged = self.new_index()
+        self.assertEqual(
+            {chunk_id for chunk_id, _ in merged.search("handbook", 10)},
+            {'doc_1_chunk_0', 'doc_3_chunk_0'}
+        )
+
+    def test_reader_reloads_after_other_writer_saves(self):
+        reader = self.new_index()
+        writer = self.new_index()
+        with writer.update():
+            add_chunks(writer, '1', ["zebra crossing rules"])
+        self.assertEqual(reader.search("zebra", 1), [])
+        reader.reload_if_changed()
+        self.assertEqual(reader.search("zebra", 1)[0][0], 'doc_1_chunk_0')
+
+    def test_failed_update_is_discarded(self):
+        index = self.new_index()
+        with self.assertRaises(RuntimeError):
+            with index.update():
+                add_chunks(index, '1', ["giraffe"])
+                raise RuntimeError("boom")
+        index.reload_if_changed()
+        self.assertEqual(index.search("giraffe", 1), [])
+        self.assertFalse(os.path.exists(self.path))
+
+
+class ReciprocalRankFusionTest(unittest.TestCase):
+
+    def test_items_in_both_rankings_win(self):
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'a', 'd']], k=60)
+        self.assertEqual([chunk_id for chunk_id, _ in fused][:2], ['a', 'c'])
+        self.assertEqual(len(reciprocal_rank_fusion([['a', 'b'], ['c']], limit=2)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+TXT 编码检测测试：BOM、UTF-8、GB18030/GBK、Big5 与单字节编码
+"""
+import os
+import codecs
+import tempfile
+import unittest
+
+from services.document_processor import DocumentProcessor
+
+SIMPLIFIED = "香港大学的课程安排、考试规则和奖学金申请说明如下：学生须在开学前完成注册。" * 20
+TRADITIONAL = "香港大學的課程安排、考試規則和獎學金申請說明如下：學生須在開學前完成註冊。" * 20
+
+
+class EncodingDetectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, data: bytes):
+        path = os.path.join(self.directory.name, 'sample.txt')
+        with open(path, 'wb') as file:
+            file.write(data)
+        return DocumentProcessor._read_txt(path)
+
+    def test_boms(self):
+        cases = [
+            (codecs.BOM_UTF8 + "课程".encode('utf-8'), 'utf-8-sig'),
+            (codecs.BOM_UTF16_LE + "课程".encode('utf-16-le'), 'utf-16'),
+            (codecs.BOM_UTF16_BE + "课程".encode('utf-16-be'), 'utf-16'),
+            (codecs.BOM_UTF32_LE + "课程".encode('utf-32-le'), 'utf-32'),
+        ]
+        for data, expected in cases:
+            self.assertEqual(DocumentProcessor.detect_encoding(data), (expected, 1.0))
+            text, encoding, _ = self.read(data)
+            self.assertEqual(text, "课程")
+            self.assertEqual(encoding, expected)
+
+    def test_ascii_and_utf8(self):
+        self.assertEqual(DocumentProcessor.detect_encoding(b"COMP7404 syllabus"), ('utf-8', 1.0))
+        data = ("Course outline\n" + SIMPLIFIED).encode('utf-8')
+        text, encoding, confidence = self.read(data)
+        self.assertEqual(encoding, 'utf-8')
+        self.assertEqual(text, "Course outline\n" + SIMPLIFIED)
+        self.assertGreater(confidence, 0.9)
+
+    def test_simplified_chinese_uses_gbk(self):
+        text, encoding, confidence = self.read(SIMPLIFIED.encode('gb18030'))
+        self.assertEqual(encoding, 'gbk')
+        self.assertEqual(text, SIMPLIFIED)
+        self.assertGreaterEqual(confidence, 0.6)
+
+    def test_gb18030_four_byte_characters(self):
+        # U+3400（CJK 扩展 A）不在 GBK 中，GB18030 编码为四字节
+        original = SIMPLIFIED + "㐀" + SIMPLIFIED
+        text, encoding, _ = self.read(original.encode('gb18030'))
+        self.assertEqual(encoding, 'gb18030')
+        self.assertEqual(text, original)
+
+    def test_traditional_chinese_uses_big5(self):
+        text, encoding, confidence = self.read(TRADITIONAL.encode('big5'))
+        self.assertEqual(encoding, 'big5')
+        self.assertEqual(text, TRADITIONAL)
+        self.assertGreaterEqual(confidence, 0.6)
+
+    def test_single_byte_fallback(self):
+        original = "Café résumé naïve façade " * 10
+        text, encoding, _ = self.read(original.encode('cp1252'))
+        self.assertEqual(encoding, 'cp1252')
+        self.assertEqual(text, original)
+
+    def test_empty_file(self):
+        self.assertEqual(self.read(b""), ("", 'utf-8', 1.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
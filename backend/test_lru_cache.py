@@ -0,0 +1,66 @@
+"""
+LRU + TTL 缓存测试：淘汰顺序、过期、失效代数
+"""
+import unittest
+from unittest import mock
+
+from services.lru_cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # a 变为最近使用
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = LRUCache(max_size=10, ttl=5)
+        with mock.patch('services.lru_cache.time.monotonic', return_value=100.0):
+            cache.set('a', 1)
+        with mock.patch('services.lru_cache.time.monotonic', return_value=104.0):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('services.lru_cache.time.monotonic', return_value=106.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_invalidate_clears_and_bumps_generation(self):
+        cache = LRUCache(max_size=10, ttl=60)
+        cache.set('a', 1)
+        generation = cache.generation
+        cache.invalidate()
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.generation, generation + 1)
+
+    def test_stale_generation_write_is_dropped(self):
+        cache = LRUCache(max_size=10, ttl=60)
+        generation = cache.generation  # 读取前记下代数
+        cache.invalidate()             # 计算期间发生写入
+        cache.set('a', 'stale', generation=generation)
+        self.assertIsNone(cache.get('a'))
+
+        cache.set('a', 'fresh', generation=cache.generation)
+        self.assertEqual(cache.get('a'), 'fresh')
+
+    def test_zero_size_disables_cache(self):
+        cache = LRUCache(max_size=0, ttl=60)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_hit_rate(self):
+        cache = LRUCache(max_size=10, ttl=60)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (1, 1, 0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+请求合并测试：同键并发调用只执行一次，结果与异常共享给等待者
+"""
+import time
+import threading
+import unittest
+
+from services.single_flight import SingleFlight, normalize_question
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+
+    def wait_for_waiters(self, key, count: int):
+        """等待 count 个请求挂在进行中的调用上"""
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with self.flight._lock:
+                call = self.flight._calls.get(key)
+                if call is not None and call.waiters >= count:
+                    return
+            time.sleep(0.005)
+        self.fail(f"等待者未达到 {count} 个")
+
+    def run_concurrently(self, key, fn, count: int):
+        results = [None] * count
+        errors = [None] * count
+
+        def worker(index):
+            try:
+                results[index] = self.flight.do(key, fn)
+            except Exception as e:
+                errors[index] = e
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+        threads[0].start()
+        self.wait_for_leader(key)
+        for thread in threads[1:]:
+            thread.start()
+        self.wait_for_waiters(key, count - 1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def wait_for_leader(self, key):
+        deadline = time.monotonic() + 5
+        while key not in self.flight._calls:
+            if time.monotonic() > deadline:
+                self.fail("leader 未开始执行")
+            time.sleep(0.005)
+
+    def test_concurrent_calls_execute_once(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            self.release.wait(5)
+            return {'answer': 42}
+
+        results, errors = self.run_concurrently(('generate', 'q'), fn, 5)
+        self.assertEqual(errors, [None] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True, True])
+        self.assertTrue(all(result is results[0][0] for result, _ in results))
+        self.assertEqual(
+            self.flight.stats(),
+            {'in_flight': 0, 'generate': {'executed': 1, 'shared': 4}}
+        )
+
+    def test_error_is_shared_with_waiters(self):
+        def fn():
+            self.release.wait(5)
+            raise ValueError("upstream failed")
+
+        _, errors = self.run_concurrently(('retrieve', 'q'), fn, 3)
+        self.assertEqual([type(error) for error in errors], [ValueError] * 3)
+        self.assertEqual(self.flight.stats()['in_flight'], 0)
+
+    def test_sequential_calls_execute_again(self):
+        counter = iter(range(10))
+        first, shared_first = self.flight.do(('generate', 'q'), lambda: next(counter))
+        second, shared_second = self.flight.do(('generate', 'q'), lambda: next(counter))
+        self.assertEqual((first, second), (0, 1))
+        self.assertFalse(shared_first or shared_second)
+
+    def test_different_keys_are_not_coalesced(self):
+        self.assertEqual(self.flight.do(('generate', 'a'), lambda: 'a'), ('a', False))
+        self.assertEqual(self.flight.do(('generate', 'b'), lambda: 'b'), ('b', False))
+        self.assertEqual(self.flight.stats()['generate'], {'executed': 2, 'shared': 0})
+
+    def test_normalize_question(self):
+        self.assertEqual(normalize_question("  What is\tCOMP7404?\n"), "what is comp7404?")
+        self.assertEqual(normalize_question("考试  规则"), "考试 规则")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+分块器测试：token 预算、句子边界、重叠，以及流式切分与整段切分一致
+"""
+import unittest
+
+from services.text_chunker import TextChunker, MIN_STREAM_BUFFER
+
+
+def make_text(sentences: int) -> str:
+    """每句以句点结尾，每五句一个段落"""
+    parts = []
+    for i in range(sentences):
+        parts.append(f"Sentence number {i} explains rule {i} of the handbook.")
+        parts.append("\n\n" if i % 5 == 4 else " ")
+    return "".join(parts)
+
+
+class TextChunkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chunker = TextChunker(chunk_size=60, overlap=15, unit='token')
+        self.text = make_text(200)
+
+    def test_chunks_fit_token_budget(self):
+        chunks = self.chunker.split(self.text)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(self.chunker.measure(chunk), self.chunker.chunk_size)
+
+    def test_chunks_end_on_sentence_boundaries(self):
+        for chunk in self.chunker.split(self.text):
+            self.assertTrue(chunk.startswith("Sentence number"), chunk)
+            self.assertTrue(chunk.endswith("."), chunk)
+
+    def test_consecutive_chunks_overlap_by_whole_sentences(self):
+        chunks = self.chunker.split(self.text)
+        for previous, current in zip(chunks, chunks[1:]):
+            first_sentence = current[:current.index(".") + 1]
+            self.assertIn(first_sentence, previous)
+            overlap = previous[previous.index(first_sentence):]
+            self.assertLessEqual(self.chunker.measure(overlap), self.chunker.overlap + 20)
+
+    def test_chunks_cover_all_sentences(self):
+        chunks = self.chunker.split(self.text)
+        joined = "\n".join(chunks)
+        for i in range(200):
+            self.assertIn(f"Sentence number {i} ", joined)
+
+    def test_split_stream_matches_split(self):
+        text = make_text(2000)
+        self.assertGreater(len(text), 2 * MIN_STREAM_BUFFER)
+        # 片段边界故意落在句子中间
+        pieces = [text[i:i + 997] for i in range(0, len(text), 997)]
+        self.assertEqual(list(self.chunker.split_stream(pieces)), self.chunker.split(text))
+
+    def test_split_stream_single_piece(self):
+        self.assertEqual(list(self.chunker.split_stream([self.text])), self.chunker.split(self.text))
+
+    def test_oversized_segment_is_hard_split(self):
+        chunker = TextChunker(chunk_size=100, overlap=10, unit='char')
+        text = " ".join(f"word{i}" for i in range(200))  # 没有句子或段落边界
+        chunks = chunker.split(text)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 100)
+        self.assertIn("word0", chunks[0])
+        self.assertIn("word199", chunks[-1])
+
+    def test_char_unit(self):
+        chunker = TextChunker(chunk_size=200, overlap=40, unit='char')
+        for chunk in chunker.split(self.text):
+            self.assertLessEqual(len(chunk), 200)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            TextChunker(chunk_size=0)
+        with self.assertRaises(ValueError):
+            TextChunker(unit='word')
+
+    def test_empty_text(self):
+        self.assertEqual(self.chunker.split(""), [])
+        self.assertEqual(list(self.chunker.split_stream([])), [])
+
+
+if __name__ == '__main__':
+    unittest.main()